@@ -0,0 +1,59 @@
+"""
+Micro-benchmark do SubscriptionService.validate_coupon
+Mostra que a latência da validação não cresce com o número de usos registrados
+
+Uso:
+    python bench_coupon_validation.py
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+from subscription_service import SubscriptionService
+from subscription_storage import InMemorySubscriptionStorage
+
+REDEMPTION_COUNTS = [10, 1_000, 100_000, 1_000_000]
+VALIDATIONS = 20_000
+
+
+async def bench(redemptions: int) -> float:
+    """Retorna a latência média (µs) de validate_coupon com N usos já registrados"""
+
+    storage = InMemorySubscriptionStorage()
+    SubscriptionService.configure(storage)
+
+    await SubscriptionService.create_coupon(
+        code="PROMO",
+        discount_type="percentage",
+        discount_value=10,
+        created_by="admin"
+    )
+
+    now = datetime.now()
+    for index in range(redemptions):
+        await storage.add_coupon_usage({
+            "coupon_code": "PROMO",
+            "user_id": f"user-{index}",
+            "discount_applied": 1.99,
+            "used_at": now
+        })
+
+    start = time.perf_counter()
+    for index in range(VALIDATIONS):
+        await SubscriptionService.validate_coupon("PROMO", f"new-user-{index}")
+    elapsed = time.perf_counter() - start
+
+    return elapsed / VALIDATIONS * 1_000_000
+
+
+async def main():
+    print(f"{'usos registrados':>18} | {'validate_coupon (µs)':>20}")
+    print("-" * 42)
+    for redemptions in REDEMPTION_COUNTS:
+        latency = await bench(redemptions)
+        print(f"{redemptions:>18,} | {latency:>20.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
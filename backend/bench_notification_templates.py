@@ -0,0 +1,132 @@
+"""
+Micro-benchmark da renderização dos lembretes
+Compara a montagem antiga (parse + f-string a cada envio) com o TemplateRenderer
+(48h/24h/12h x canais, parse e valores uma vez por versão do evento) e confere
+que as mensagens saem idênticas
+
+Uso:
+    python bench_notification_templates.py
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from notification_templates import (
+    DEFAULT_CHANNEL,
+    DEFAULT_LOCALE,
+    REMINDER_BODY_PT_BR,
+    REMINDER_HEADERS_PT_BR,
+    MessageTemplate,
+    TemplateRenderer,
+    reminder_header_pt_br,
+)
+
+# Eventos com lembrete em uma janela de 48h (cabem no cache de cada template)
+EVENTS = 2_000
+REPEAT = 3
+NOTIFICATION_TYPES = ["48h", "24h", "12h"]
+CHANNELS = ["push", "whatsapp"]
+
+
+def legacy_message(event, notification_type):
+    """Montagem anterior do NotificationScheduler.create_notification_message"""
+
+    emoji_map = {
+        "48h": "📅",
+        "24h": "⏰",
+        "12h": "🚨"
+    }
+
+    emoji = emoji_map.get(notification_type, "🔔")
+    time_text = notification_type.replace('h', ' horas')
+
+    event_date = datetime.fromisoformat(event['event_date'].replace('Z', '+00:00'))
+    date_str = event_date.strftime('%d/%m/%Y às %H:%M')
+
+    total = event.get('total_value', 0)
+    paid = event.get('amount_paid', 0)
+    remaining = total - paid
+
+    return f"""{emoji} Lembrete: Faltam {time_text}!
+
+📸 Evento: {event['event_type']}
+👤 Cliente: {event['client_name']}
+📍 Local: {event['location']}
+🗓️ Data: {date_str}
+
+💰 Valores:
+• Total: R$ {total:.2f}
+• Pago: R$ {paid:.2f}
+• Restante: R$ {remaining:.2f}
+
+Boa sorte no evento! 📸✨"""
+
+
+def make_events():
+    start = datetime(2025, 1, 1, 14, 0)
+    return [
+        {
+            "id": f"event-{index}",
+            "event_type": "Casamento",
+            "client_name": f"Cliente {index}",
+            "location": "São Paulo",
+            "event_date": (start + timedelta(hours=index)).strftime("%Y-%m-%dT%H:%M:%S"),
+            "total_value": 2500.0 + index,
+            "amount_paid": 1000.0,
+        }
+        for index in range(EVENTS)
+    ]
+
+
+def fresh_renderer() -> TemplateRenderer:
+    """Renderer com o template padrão e o cache de eventos vazio"""
+
+    return TemplateRenderer({
+        (DEFAULT_LOCALE, DEFAULT_CHANNEL): MessageTemplate(
+            "Evento: {{event_type}}", REMINDER_BODY_PT_BR, REMINDER_HEADERS_PT_BR, reminder_header_pt_br
+        ),
+    })
+
+
+def bench(make_render, events) -> float:
+    """Retorna mensagens/s (melhor de REPEAT) renderizando todos os avisos de todos os eventos"""
+
+    best = 0.0
+    for _ in range(REPEAT):
+        render = make_render()
+        renders = 0
+        start = time.perf_counter()
+        for notification_type in NOTIFICATION_TYPES:
+            for event in events:
+                for channel in CHANNELS:
+                    render(event, notification_type, channel)
+                    renders += 1
+        best = max(best, renders / (time.perf_counter() - start))
+    return best
+
+
+def main():
+    events = make_events()
+
+    # Conferência: o template padrão gera exatamente a mensagem antiga (inclusive tipos sem cabeçalho)
+    renderer = TemplateRenderer()
+    for notification_type in NOTIFICATION_TYPES + ["6h"]:
+        assert renderer.render(events[0], notification_type)[1] == legacy_message(events[0], notification_type)
+
+    legacy = bench(lambda: lambda event, notification_type, channel: legacy_message(event, notification_type), events)
+    # Cache vazio a cada rodada: um parse por evento, reaproveitado pelos 3 tipos x 2 canais
+    templated = bench(lambda: fresh_renderer().render, events)
+    # Cache já cheio (ex: canal/tipo seguinte de um evento já renderizado)
+    warm = fresh_renderer()
+    bench(lambda: warm.render, events)
+
+    print(f"{'renderização':>28} | {'mensagens/s':>12}")
+    print("-" * 43)
+    print(f"{'f-string a cada envio':>28} | {legacy:>12,.0f}")
+    print(f"{'template + cache por evento':>28} | {templated:>12,.0f}")
+    print(f"{'template, cache quente':>28} | {bench(lambda: warm.render, events):>12,.0f}")
+    print(f"\ncache: {warm.template_for(DEFAULT_LOCALE, DEFAULT_CHANNEL).stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,102 @@
-import mercadopago
+import asyncio
 import os
+import random
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 
+import httpx
+
+# Status que valem nova tentativa (limite de taxa e erros do gateway)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
 class MercadoPagoService:
-    """Serviço de integração com Mercado Pago"""
+    """Serviço de integração com Mercado Pago (cliente HTTP assíncrono)"""
+    
+    def __init__(
+        self,
+        access_token: Optional[str] = None,
+        base_url: Optional[str] = None,
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
+        self.access_token = access_token or os.getenv('MERCADOPAGO_ACCESS_TOKEN')
+        # Pode apontar para um gateway falso local nos testes
+        self.base_url = base_url or os.getenv('MERCADOPAGO_API_URL', 'https://api.mercadopago.com')
+        self.timeout = float(os.getenv('MERCADOPAGO_TIMEOUT', 10))
+        self.max_retries = int(os.getenv('MERCADOPAGO_MAX_RETRIES', 3))
+        self.retry_backoff = float(os.getenv('MERCADOPAGO_RETRY_BACKOFF', 0.5))
+        self._client = http_client
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Cliente HTTP compartilhado (keep-alive), criado no primeiro uso"""
+        
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.access_token}"},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+            )
+        return self._client
     
-    def __init__(self):
-        self.access_token = os.getenv('MERCADOPAGO_ACCESS_TOKEN')
-        self.sdk = mercadopago.SDK(self.access_token)
+    async def aclose(self) -> None:
+        """Fecha as conexões do pool (chamar no shutdown do app)"""
+        
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        json: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Faz a chamada com retentativas (backoff exponencial com jitter)
         
-    def create_subscription(
+        Args:
+            method: Método HTTP
+            path: Caminho da API (ex: /v1/payments)
+            json: Corpo da requisição
+            idempotency_key: Chave X-Idempotency-Key (a mesma em todas as tentativas)
+            timeout: Timeout desta chamada em segundos
+            
+        Returns:
+            Dict no formato do SDK: {"status": código HTTP, "response": corpo}
+        """
+        
+        headers = {}
+        if idempotency_key:
+            headers["X-Idempotency-Key"] = idempotency_key
+        
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(
+                    method,
+                    path,
+                    json=json,
+                    headers=headers,
+                    timeout=timeout or self.timeout
+                )
+                if response.status_code not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    try:
+                        body = response.json()
+                    except ValueError:
+                        body = {"message": response.text}
+                    return {"status": response.status_code, "response": body}
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+            
+            attempt += 1
+            await asyncio.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+        
+    async def create_subscription(
         self,
         user_email: str,
         plan_price: float,
@@ -49,16 +135,22 @@ class MercadoPagoService:
             "payment_method_id": payment_method_id,
         }
         
-        result = self.sdk.subscription().create(subscription_data)
-        return result
+        return await self._request(
+            "POST",
+            "/preapproval",
+            json=subscription_data,
+            idempotency_key=str(uuid.uuid4())
+        )
     
-    def create_payment(
+    async def create_payment(
         self,
         amount: float,
         description: str,
         payer_email: str,
         payment_method_id: str,
-        installments: int = 1
+        installments: int = 1,
+        external_reference: Optional[str] = None,
+        idempotency_key: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Cria um pagamento único (para o primeiro mês)
@@ -69,6 +161,8 @@ class MercadoPagoService:
             payer_email: Email do pagador
             payment_method_id: ID do método de pagamento
             installments: Número de parcelas
+            external_reference: Referência devolvida nas notificações (ID do usuário)
+            idempotency_key: Chave para o gateway não cobrar duas vezes a mesma operação
             
         Returns:
             Dict com dados do pagamento
@@ -85,10 +179,17 @@ class MercadoPagoService:
             "notification_url": os.getenv('BACKEND_URL', 'http://localhost:8000') + "/api/payments/webhook"
         }
         
-        result = self.sdk.payment().create(payment_data)
-        return result
+        if external_reference:
+            payment_data["external_reference"] = external_reference
+        
+        return await self._request(
+            "POST",
+            "/v1/payments",
+            json=payment_data,
+            idempotency_key=idempotency_key or str(uuid.uuid4())
+        )
     
-    def cancel_subscription(self, subscription_id: str) -> Dict[str, Any]:
+    async def cancel_subscription(self, subscription_id: str) -> Dict[str, Any]:
         """
         Cancela uma assinatura
         
@@ -99,13 +200,13 @@ class MercadoPagoService:
             Dict com resultado do cancelamento
         """
         
-        result = self.sdk.subscription().update(
-            subscription_id,
-            {"status": "cancelled"}
+        return await self._request(
+            "PUT",
+            f"/preapproval/{subscription_id}",
+            json={"status": "cancelled"}
         )
-        return result
     
-    def get_subscription(self, subscription_id: str) -> Dict[str, Any]:
+    async def get_subscription(self, subscription_id: str) -> Dict[str, Any]:
         """
         Busca informações de uma assinatura
         
@@ -116,10 +217,9 @@ class MercadoPagoService:
             Dict com dados da assinatura
         """
         
-        result = self.sdk.subscription().get(subscription_id)
-        return result
+        return await self._request("GET", f"/preapproval/{subscription_id}")
     
-    def get_payment(self, payment_id: str) -> Dict[str, Any]:
+    async def get_payment(self, payment_id: str) -> Dict[str, Any]:
         """
         Busca informações de um pagamento
         
@@ -130,8 +230,7 @@ class MercadoPagoService:
             Dict com dados do pagamento
         """
         
-        result = self.sdk.payment().get(payment_id)
-        return result
+        return await self._request("GET", f"/v1/payments/{payment_id}")
     
     def apply_discount(self, amount: float, discount_type: str, discount_value: float) -> float:
         """
@@ -0,0 +1,228 @@
+"""
+Outbox de notificações - Fotiva
+O scheduler só grava (usuário, canal, mensagem); workers de cada canal entregam em lote
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List
+
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryError(Exception):
+    """Falha de entrega reportada pelo canal: o item volta para a fila com backoff"""
+
+
+class NotificationOutbox:
+    """Fila de entregas no MongoDB com pools de workers independentes por canal"""
+
+    def __init__(
+        self,
+        collection,
+        handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[None]]],
+        workers: Dict[str, int] = None,
+        batch_size: int = 50,
+        max_attempts: int = 5,
+        retry_backoff: float = 30,
+        lease_seconds: float = 120,
+        poll_interval: float = 5
+    ):
+        """
+        Args:
+            collection: Coleção do Motor (db.notification_outbox)
+            handlers: Canal -> coroutine que entrega um item (qualquer exceção = nova tentativa)
+            workers: Canal -> quantos workers drenam aquele canal (padrão 1)
+            batch_size: Itens reservados por worker a cada leitura
+            max_attempts: Tentativas antes de mandar o item para "dead"
+            retry_backoff: Espera base (s) entre tentativas, dobrando a cada falha
+            lease_seconds: Tempo até um lote "processing" abandonado voltar para a fila
+            poll_interval: Intervalo (s) de consulta quando o canal está vazio
+        """
+        self.collection = collection
+        self.handlers = handlers
+        self.workers = workers or {}
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._wakeup = {channel: asyncio.Event() for channel in handlers}
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_indexes([
+            # Mesmo lembrete não entra duas vezes no mesmo canal
+            IndexModel([("dedupe_key", ASCENDING), ("channel", ASCENDING)], name="dedupe_key_channel_unique", unique=True),
+            IndexModel([("channel", ASCENDING), ("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="channel_status_next_attempt"),
+            IndexModel([("claim", ASCENDING)], name="claim", sparse=True),
+            # Entregues saem sozinhos depois de 7 dias
+            IndexModel([("processed_at", ASCENDING)], name="processed_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+        ])
+
+    async def enqueue(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Grava os itens ({dedupe_key, channel, user_id, to, message}) para entrega
+
+        Returns:
+            Quantos itens novos entraram (duplicados são ignorados)
+        """
+        if not records:
+            return 0
+
+        now = datetime.now(timezone.utc)
+        docs = [
+            {**record, "status": "pending", "attempts": 0, "next_attempt_at": now, "created_at": now}
+            for record in records
+        ]
+
+        try:
+            result = await self.collection.insert_many(docs, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+
+        for channel in {record["channel"] for record in records}:
+            if channel in self._wakeup:
+                self._wakeup[channel].set()
+
+        return inserted
+
+    async def claim(self, channel: str) -> List[Dict[str, Any]]:
+        """Reserva até batch_size itens prontos (ou com lease expirado) do canal"""
+        now = datetime.now(timezone.utc)
+        ready = {
+            "channel": channel,
+            "$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                {"status": "processing", "locked_until": {"$lte": now}},
+            ],
+        }
+
+        candidates = await self.collection.find(ready, {"_id": 1}).sort(
+            "next_attempt_at", ASCENDING
+        ).limit(self.batch_size).to_list(None)
+
+        if not candidates:
+            return []
+
+        # O filtro repetido garante que cada item fique com um worker só
+        claim = uuid.uuid4().hex
+        await self.collection.update_many(
+            {**ready, "_id": {"$in": [doc["_id"] for doc in candidates]}},
+            {
+                "$set": {"status": "processing", "claim": claim, "locked_until": now + timedelta(seconds=self.lease_seconds)},
+                "$inc": {"attempts": 1},
+            }
+        )
+        return await self.collection.find({"claim": claim}).to_list(None)
+
+    async def deliver(self, item: Dict[str, Any]) -> UpdateOne:
+        """Entrega um item e devolve a atualização de status correspondente"""
+        try:
+            await self.handlers[item["channel"]](item)
+        except Exception as e:
+            if item["attempts"] >= self.max_attempts:
+                status, next_attempt_at = "dead", None
+                logger.error(f"❌ Notificação {item['channel']}/{item['dedupe_key']} foi para dead-letter: {e}")
+            else:
+                status = "pending"
+                delay = self.retry_backoff * 2 ** (item["attempts"] - 1)
+                next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+                logger.warning(f"⚠️ Notificação {item['channel']}/{item['dedupe_key']} falhou, nova tentativa em {delay:.0f}s: {e}")
+
+            return UpdateOne(
+                {"_id": item["_id"], "claim": item["claim"]},
+                {
+                    "$set": {"status": status, "next_attempt_at": next_attempt_at, "last_error": str(e)},
+                    "$unset": {"locked_until": "", "claim": ""},
+                }
+            )
+
+        return UpdateOne(
+            {"_id": item["_id"], "claim": item["claim"]},
+            {
+                "$set": {"status": "processed", "processed_at": datetime.now(timezone.utc)},
+                "$unset": {"locked_until": "", "claim": ""},
+            }
+        )
+
+    async def _worker(self, channel: str) -> None:
+        wakeup = self._wakeup[channel]
+        while True:
+            try:
+                batch = await self.claim(channel)
+            except Exception as e:
+                logger.error(f"❌ Erro ao ler o outbox ({channel}): {e}")
+                batch = []
+
+            if not batch:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            updates = await asyncio.gather(*(self.deliver(item) for item in batch))
+            try:
+                await self.collection.bulk_write(list(updates), ordered=False)
+            except Exception as e:
+                # O lease expira e o lote volta para a fila
+                logger.error(f"❌ Erro ao gravar o status do lote ({channel}): {e}")
+
+    def start(self) -> None:
+        """Inicia os workers de cada canal no event loop atual"""
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker(channel))
+                for channel in self.handlers
+                for _ in range(self.workers.get(channel, 1))
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def lag(self) -> Dict[str, Dict[str, Any]]:
+        """Itens por status e atraso de cada canal (ver outbox_lag)"""
+        return await outbox_lag(self.collection)
+
+
+async def outbox_lag(collection) -> Dict[str, Dict[str, Any]]:
+    """
+    Por canal: quantidade por status e atraso (s) do item pendente mais antigo
+    (só consulta a coleção: a API mede o outbox sem instanciar workers)
+    """
+    now = datetime.now(timezone.utc)
+    metrics: Dict[str, Dict[str, Any]] = {}
+
+    async for row in collection.aggregate([
+        {"$group": {
+            "_id": {"channel": "$channel", "status": "$status"},
+            "count": {"$sum": 1},
+            "oldest": {"$min": "$next_attempt_at"},
+        }}
+    ]):
+        channel = metrics.setdefault(row["_id"]["channel"], {
+            "pending": 0, "processing": 0, "processed": 0, "dead": 0, "lag_seconds": 0.0
+        })
+        status = row["_id"]["status"]
+        channel[status] = row["count"]
+
+        oldest = row["oldest"]
+        if status in ("pending", "processing") and oldest is not None:
+            # Sem tz_aware no client, o Motor devolve UTC sem fuso
+            if oldest.tzinfo is None:
+                oldest = oldest.replace(tzinfo=timezone.utc)
+            lag = max((now - oldest).total_seconds(), 0.0)
+            channel["lag_seconds"] = max(channel["lag_seconds"], lag)
+
+    return metrics
@@ -5,106 +5,330 @@ Envia notificações para o FOTÓGRAFO (não cliente) em 48h, 24h e 12h antes do
 
 import os
 import asyncio
-import httpx
-from datetime import datetime, timedelta
+import heapq
+import itertools
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from notification_outbox import DeliveryError, NotificationOutbox
+from notification_templates import TemplateRenderer
+from push_delivery import PushDelivery
+from reminder_ledger import ReminderLedger
+from whatsapp_channel import WhatsAppChannel
+
+# Atraso máximo aceito para um lembrete (depois disso ele não é mais enviado)
+REMINDER_TOLERANCE = timedelta(minutes=12)
+
+# Espera antes de tentar de novo um lembrete que falhou (dentro da tolerância)
+REMINDER_RETRY = timedelta(minutes=2)
+
+# Só eventos ainda por acontecer recebem lembrete
+NOTIFIABLE_STATUS = ["confirmado", "pendente"]
+
+# Campos do fotógrafo usados pelos envios (nunca o hash da senha)
+PHOTOGRAPHER_PROJECTION = {"_id": 0, "id": 1, "name": 1, "email": 1, "phone": 1, "push_subscription": 1}
+
+# Formato de events.event_date (ex: 2025-02-06T14:00:00)
+EVENT_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Quanto da timeline (db.event_reminders) fica carregado no heap em memória
+TIMELINE_HORIZON = timedelta(hours=float(os.getenv('REMINDER_HORIZON_HOURS', 6)))
+
+# Mudanças da timeline que acordam o scheduler (ver ReminderTimeline.watch)
+TIMELINE_CHANGES = [{"$match": {"operationType": {"$in": ["insert", "replace", "delete"]}}}]
+
+
+def normalize_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Eventos do server-corrected.py (date/time, name, paid_amount) no formato
+    usado pelas mensagens e pelo ledger (event_date, event_type, amount_paid)
+    """
+    
+    if 'event_date' not in event and event.get('date'):
+        event_date = datetime.fromisoformat(f"{event['date']}T{event.get('time') or '00:00'}")
+        event['event_date'] = event_date.strftime(EVENT_DATE_FORMAT)
+    event.setdefault('event_type', event.get('name', ''))
+    event.setdefault('amount_paid', event.get('paid_amount', 0))
+    return event
+
+
+class ReminderTimeline:
+    """
+    Min-heap dos próximos disparos de lembrete (materializados pelo server.py
+    em db.event_reminders a cada escrita de evento)
+    """
+    
+    def __init__(self, db, horizon: timedelta = TIMELINE_HORIZON):
+        self.db = db
+        self.horizon = horizon
+        self.heap = []
+        self.loaded_until = None
+        self.changed = asyncio.Event()
+        self._seq = itertools.count()
+    
+    async def reload(self, now: datetime):
+        """
+        Recarrega os lembretes não enviados com fire_at em [now - tolerância, now + horizonte];
+        os que falharam voltam no próprio next_attempt_at (gravado por retry)
+        """
+        
+        self.changed.clear()
+        self.loaded_until = now + self.horizon
+        reminders = await self.db.event_reminders.find(
+            {
+                "sent_at": {"$exists": False},
+                "fire_at": {"$gte": now - REMINDER_TOLERANCE, "$lte": self.loaded_until},
+            },
+            {"_id": 1, "event_id": 1, "user_id": 1, "notification_type": 1, "fire_at": 1, "next_attempt_at": 1}
+        ).to_list(None)
+        
+        self.heap = []
+        for reminder in reminders:
+            # Client sem tz_aware: o Motor devolve UTC sem fuso
+            for field in ('fire_at', 'next_attempt_at'):
+                if reminder.get(field) and reminder[field].tzinfo is None:
+                    reminder[field] = reminder[field].replace(tzinfo=timezone.utc)
+            
+            at = max(reminder['fire_at'], reminder.get('next_attempt_at') or reminder['fire_at'])
+            if at <= reminder['fire_at'] + REMINDER_TOLERANCE:
+                self.heap.append((at, next(self._seq), reminder))
+        heapq.heapify(self.heap)
+    
+    def next_wakeup(self) -> datetime:
+        """Próximo disparo do heap, ou o fim do horizonte carregado"""
+        
+        if self.heap:
+            return min(self.heap[0][0], self.loaded_until)
+        return self.loaded_until
+    
+    def pop_due(self, now: datetime) -> List[Dict[str, Any]]:
+        """Retira do heap todos os lembretes com fire_at <= now"""
+        
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[2])
+        return due
+    
+    async def retry(self, reminders: List[Dict[str, Any]], at: datetime):
+        """
+        Agenda para `at` os lembretes que falharam: grava next_attempt_at (a espera
+        sobrevive às recargas) e devolve ao heap os que ainda estão dentro da tolerância
+        """
+        
+        if not reminders:
+            return
+        
+        await self.db.event_reminders.update_many(
+            {"_id": {"$in": [reminder['_id'] for reminder in reminders]}},
+            {"$set": {"next_attempt_at": at}}
+        )
+        for reminder in reminders:
+            reminder['next_attempt_at'] = at
+            if at <= reminder['fire_at'] + REMINDER_TOLERANCE:
+                heapq.heappush(self.heap, (at, next(self._seq), reminder))
+    
+    async def watch(self):
+        """
+        Acorda o scheduler quando um evento é criado/alterado (change stream em
+        db.event_reminders). Se o stream cai (ou não existe, sem replica set),
+        recarrega a timeline e tenta reabrir com backoff de até metade da tolerância
+        
+        O server.py só insere e apaga lembretes; os updates são do próprio scheduler
+        (sent_at, next_attempt_at) e não podem acordá-lo, senão cada passada dispara
+        uma recarga que descarta a espera de REMINDER_RETRY
+        """
+        
+        max_backoff = (REMINDER_TOLERANCE / 2).total_seconds()
+        backoff = 1.0
+        while True:
+            try:
+                async with self.db.event_reminders.watch(TIMELINE_CHANGES) as stream:
+                    backoff = 1.0
+                    async for _ in stream:
+                        self.changed.set()
+            except Exception as e:
+                print(f"⚠️ Change stream indisponível ({e}); nova tentativa em {backoff:.0f}s")
+            
+            # Mudanças perdidas enquanto o stream estava fechado
+            self.changed.set()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+    
+    async def wait(self, timeout: float):
+        """Dorme até o próximo disparo ou até uma mudança na timeline"""
+        
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+
 
 class NotificationScheduler:
     """Scheduler de notificações"""
     
-    def __init__(self):
-        self.api_url = os.getenv('BACKEND_URL', 'http://localhost:8000')
+    def __init__(self, db=None):
+        # Acesso direto ao MongoDB da API (mesmas variáveis do server.py)
+        if db is None:
+            db = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)[os.environ['DB_NAME']]
+        self.db = db
+        
+        # Reserva exactly-once dos lembretes (compartilhada entre instâncias)
+        self.ledger = ReminderLedger(db.reminder_ledger)
+        
+        # Memo user_id -> fotógrafo, refeito a cada passada
+        self.photographers: Dict[str, Dict[str, Any]] = {}
+        
+        # Mensagens pré-compiladas; data e valores formatados uma vez por versão do evento
+        self.templates = TemplateRenderer()
+        self.locale = os.getenv('NOTIFICATION_LOCALE', 'pt-BR')
+        
         self.enable_whatsapp = os.getenv('ENABLE_WHATSAPP', 'false').lower() == 'true'
+        
+        # Push enviado no próprio processo (mesmo módulo da API)
+        self.push = PushDelivery.from_env(db.users)
+        
+        # Um Client do Twilio para o processo inteiro (None sem credenciais)
+        self.whatsapp = WhatsAppChannel.from_env() if self.enable_whatsapp else None
+        
+        # Limite de eventos processados em paralelo pela varredura
+        self.event_limit = asyncio.Semaphore(int(os.getenv('NOTIFICATION_CONCURRENCY', 50)))
+        
+        # A varredura só grava no outbox; cada canal tem seu pool de workers
+        self.outbox = NotificationOutbox(
+            db.notification_outbox,
+            handlers={"push": self.deliver_push, "whatsapp": self.deliver_whatsapp},
+            workers={
+                "push": int(os.getenv('OUTBOX_PUSH_WORKERS', 4)),
+                "whatsapp": int(os.getenv('OUTBOX_WHATSAPP_WORKERS', 2)),
+            },
+            batch_size=int(os.getenv('OUTBOX_BATCH_SIZE', 50)),
+            max_attempts=int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+        )
     
-    async def check_and_send_notifications(self):
-        """Verifica eventos e envia notificações quando necessário"""
+    async def aclose(self):
+        """Para os workers do outbox e fecha os pools de envio de push e WhatsApp"""
+        await self.outbox.stop()
+        await self.push.aclose()
+        if self.whatsapp is not None:
+            await self.whatsapp.aclose()
+    
+    async def send_reminders(self, reminders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Envia os lembretes vencidos do heap e marca sent_at só nos que foram enfileirados
         
-        print("🔔 Verificando eventos para notificar...")
+        Returns:
+            Lembretes que falharam (ou que outra instância ainda está enviando)
+        """
         
-        # Pegar todos os eventos
-        events = await self.get_all_events()
+        events = await self.db.events.find(
+            {"id": {"$in": list({reminder['event_id'] for reminder in reminders})}, "status": {"$in": NOTIFIABLE_STATUS}},
+            {"_id": 0}
+        ).to_list(None)
+        events_by_id = {event['id']: normalize_event(event) for event in events}
         
-        if not events:
-            print("✅ Nenhum evento encontrado")
-            return
+        # Evento cancelado/removido depois do carregamento: o lembrete é apagado da timeline
+        dropped = [reminder['_id'] for reminder in reminders if reminder['event_id'] not in events_by_id]
+        if dropped:
+            await self.db.event_reminders.delete_many({"_id": {"$in": dropped}})
+        
+        due = [(reminder, events_by_id[reminder['event_id']]) for reminder in reminders if reminder['event_id'] in events_by_id]
+        await self.load_photographers(event['user_id'] for event in events)
+        await self.load_client_names(events)
+        results = await asyncio.gather(*(
+            self.notify_event(event, reminder['notification_type'])
+            for reminder, event in due
+        ))
+        
+        sent = [reminder['_id'] for (reminder, _), ok in zip(due, results) if ok]
+        if sent:
+            await self.db.event_reminders.update_many(
+                {"_id": {"$in": sent}},
+                {"$set": {"sent_at": datetime.now(timezone.utc)}}
+            )
         
-        now = datetime.now()
-        notifications_sent = 0
+        print(f"🎉 Total de lembretes enfileirados: {len(sent)}")
+        return [reminder for (reminder, _), ok in zip(due, results) if not ok]
+    
+    async def notify_event(self, event: Dict[str, Any], notification_type: str) -> bool:
+        """Busca o fotógrafo e envia a notificação de um evento; True se enviou"""
         
-        for event in events:
+        async with self.event_limit:
             try:
-                # Converter event_date para datetime
-                if isinstance(event['event_date'], str):
-                    event_date = datetime.fromisoformat(event['event_date'].replace('Z', '+00:00'))
-                else:
-                    event_date = event['event_date']
-                
-                # Calcular diferença em horas
-                time_until_event = event_date - now
-                hours_until = time_until_event.total_seconds() / 3600
-                
-                # Verificar se precisa notificar
-                should_notify = False
-                notification_type = ""
+                # Outra instância (ou passada anterior) já cuidou deste lembrete
+                if not await self.ledger.claim(event, notification_type):
+                    return False
                 
-                # 48 horas antes (entre 47h50 e 48h10)
-                if 47.8 <= hours_until <= 48.2:
-                    should_notify = True
-                    notification_type = "48h"
+                # Buscar dados do fotógrafo (usuário dono do evento)
+                photographer = await self.get_photographer(event['user_id'])
                 
-                # 24 horas antes (entre 23h50 e 24h10)
-                elif 23.8 <= hours_until <= 24.2:
-                    should_notify = True
-                    notification_type = "24h"
+                if not photographer:
+                    await self.ledger.release(event, notification_type)
+                    return False
                 
-                # 12 horas antes (entre 11h50 e 12h10)
-                elif 11.8 <= hours_until <= 12.2:
-                    should_notify = True
-                    notification_type = "12h"
+                await self.send_notification(event, photographer, notification_type)
+                await self.ledger.mark_sent(event, notification_type)
+                print(f"✅ Notificação enfileirada: {event['event_type']} - {notification_type}")
+                return True
                 
-                if should_notify:
-                    # Buscar dados do fotógrafo (usuário dono do evento)
-                    photographer = await self.get_photographer(event['user_id'])
-                    
-                    if photographer:
-                        await self.send_notification(event, photographer, notification_type)
-                        notifications_sent += 1
-                        print(f"✅ Notificação enviada: {event['event_type']} - {notification_type}")
-                    
             except Exception as e:
                 print(f"❌ Erro ao processar evento {event.get('id')}: {str(e)}")
-                continue
+                await self.ledger.release(event, notification_type)
+                return False
+    
+    async def load_photographers(self, user_ids) -> Dict[str, Dict[str, Any]]:
+        """Carrega em um único find ($in) os fotógrafos da passada no memo"""
+        
+        self.photographers = {}
+        ids = list(set(user_ids))
+        
+        if not ids:
+            return self.photographers
+        
+        try:
+            async for user in self.db.users.find({"id": {"$in": ids}}, PHOTOGRAPHER_PROJECTION):
+                self.photographers[user['id']] = user
+        except Exception as e:
+            print(f"❌ Erro ao buscar fotógrafos: {str(e)}")
         
-        print(f"🎉 Total de notificações enviadas: {notifications_sent}")
+        return self.photographers
     
-    async def get_all_events(self) -> List[Dict[str, Any]]:
-        """Busca todos os eventos do sistema"""
+    async def load_client_names(self, events: List[Dict[str, Any]]):
+        """Preenche client_name dos eventos que só guardam client_id (um find por passada)"""
+        
+        missing = [event for event in events if not event.get('client_name') and event.get('client_id')]
+        if not missing:
+            return
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.api_url}/api/events/all")
-                
-                if response.status_code == 200:
-                    return response.json()
-                
-                return []
-                
+            names = {
+                client['id']: client['name']
+                async for client in self.db.clients.find(
+                    {"id": {"$in": list({event['client_id'] for event in missing})}},
+                    {"_id": 0, "id": 1, "name": 1}
+                )
+            }
         except Exception as e:
-            print(f"❌ Erro ao buscar eventos: {str(e)}")
-            return []
+            print(f"❌ Erro ao buscar clientes: {str(e)}")
+            return
+        
+        for event in missing:
+            event['client_name'] = names.get(event['client_id'], '')
     
     async def get_photographer(self, user_id: str) -> Dict[str, Any]:
-        """Busca dados do fotógrafo pelo ID"""
+        """Busca dados do fotógrafo pelo ID (memo da passada, senão direto no banco)"""
+        
+        if user_id in self.photographers:
+            return self.photographers[user_id]
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{self.api_url}/api/users/{user_id}")
-                
-                if response.status_code == 200:
-                    return response.json()
-                
-                return None
-                
+            photographer = await self.db.users.find_one({"id": user_id}, PHOTOGRAPHER_PROJECTION)
+            
+            if photographer:
+                self.photographers[user_id] = photographer
+            
+            return photographer
+            
         except Exception as e:
             print(f"❌ Erro ao buscar fotógrafo: {str(e)}")
             return None
@@ -115,160 +339,155 @@ class NotificationScheduler:
         photographer: Dict[str, Any],
         notification_type: str
     ):
-        """Envia notificação para o fotógrafo"""
+        """Grava no outbox as entregas (push e WhatsApp) do lembrete para o fotógrafo"""
         
-        # Preparar mensagem
-        message = self.create_notification_message(event, notification_type)
+        locale = photographer.get('locale') or self.locale
+        dedupe_key = f"{event['id']}:{notification_type}:{event['event_date']}"
+        records = []
         
-        # Enviar Push Notification
-        await self.send_push_notification(photographer, message, event)
+        if photographer.get('push_subscription'):
+            title, body = self.templates.render(event, notification_type, "push", locale)
+            records.append({
+                "dedupe_key": dedupe_key,
+                "channel": "push",
+                "user_id": photographer['id'],
+                # A subscription já veio junto com o fotógrafo (load_photographers)
+                "to": photographer['push_subscription'],
+                "message": {
+                    "title": title,
+                    "body": body,
+                    "icon": "/fotiva-icon-192.png",
+                    "badge": "/fotiva-icon-192.png"
+                },
+            })
+        else:
+            print(f"⚠️ Fotógrafo {photographer.get('name')} não tem push ativado")
         
         # Enviar WhatsApp (apenas se ativado e fotógrafo tiver telefone)
         if self.enable_whatsapp and photographer.get('phone'):
-            await self.send_whatsapp(photographer['phone'], message)
+            _, body = self.templates.render(event, notification_type, "whatsapp", locale)
+            records.append({
+                "dedupe_key": dedupe_key,
+                "channel": "whatsapp",
+                "user_id": photographer['id'],
+                "to": photographer['phone'],
+                "message": body,
+            })
+        
+        await self.outbox.enqueue(records)
     
     def create_notification_message(
         self,
         event: Dict[str, Any],
         notification_type: str
     ) -> str:
-        """Cria mensagem de notificação"""
-        
-        # Emojis para cada tipo
-        emoji_map = {
-            "48h": "📅",
-            "24h": "⏰",
-            "12h": "🚨"
-        }
-        
-        emoji = emoji_map.get(notification_type, "🔔")
-        time_text = notification_type.replace('h', ' horas')
-        
-        # Formatar data/hora
-        if isinstance(event['event_date'], str):
-            event_date = datetime.fromisoformat(event['event_date'].replace('Z', '+00:00'))
-        else:
-            event_date = event['event_date']
-        
-        date_str = event_date.strftime('%d/%m/%Y às %H:%M')
+        """Cria mensagem de notificação (template padrão)"""
         
-        # Calcular valores
-        total = event.get('total_value', 0)
-        paid = event.get('amount_paid', 0)
-        remaining = total - paid
+        return self.templates.render(event, notification_type, locale=self.locale)[1]
+    
+    async def deliver_push(self, item: Dict[str, Any]):
+        """Worker do outbox: envia um Push Notification"""
         
-        message = f"""{emoji} Lembrete: Faltam {time_text}!
-
-📸 Evento: {event['event_type']}
-👤 Cliente: {event['client_name']}
-📍 Local: {event['location']}
-🗓️ Data: {date_str}
-
-💰 Valores:
-• Total: R$ {total:.2f}
-• Pago: R$ {paid:.2f}
-• Restante: R$ {remaining:.2f}
-
-Boa sorte no evento! 📸✨"""
+        result = await self.push.send(item['to'], item['message'])
         
-        return message
+        # Expirada (404/410): o push_delivery já agendou a limpeza, não há o que repetir
+        if result["status"] == "error":
+            raise DeliveryError(f"{result['status_code']} {result['error']}")
     
-    async def send_push_notification(
-        self,
-        photographer: Dict[str, Any],
-        message: str,
-        event: Dict[str, Any]
-    ):
-        """Envia Push Notification para o fotógrafo"""
+    async def deliver_whatsapp(self, item: Dict[str, Any]):
+        """Worker do outbox: envia uma mensagem via WhatsApp (Twilio)"""
         
-        try:
-            if not photographer.get('push_subscription'):
-                print(f"⚠️ Fotógrafo {photographer.get('name')} não tem push ativado")
-                return
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.api_url}/api/push/send",
-                    json={
-                        "user_id": photographer['id'],
-                        "title": f"Evento: {event['event_type']}",
-                        "body": message,
-                        "icon": "/fotiva-icon-192.png",
-                        "badge": "/fotiva-icon-192.png"
-                    }
-                )
-                
-                if response.status_code == 200:
-                    print(f"✅ Push enviado para {photographer.get('name')}")
-                else:
-                    print(f"❌ Erro ao enviar push: {response.status_code}")
-                    
-        except Exception as e:
-            print(f"❌ Erro ao enviar push notification: {str(e)}")
-    
-    async def send_whatsapp(self, phone: str, message: str):
-        """Envia mensagem via WhatsApp (Twilio)"""
+        if self.whatsapp is None:
+            raise DeliveryError("Credenciais do Twilio não configuradas")
         
-        if not self.enable_whatsapp:
-            print("⚠️ WhatsApp desativado (ENABLE_WHATSAPP=false)")
-            return
+        result = await self.whatsapp.send(item['to'], item['message'])
         
-        try:
-            from twilio.rest import Client
-            
-            account_sid = os.getenv('TWILIO_ACCOUNT_SID')
-            auth_token = os.getenv('TWILIO_AUTH_TOKEN')
-            from_whatsapp = os.getenv('TWILIO_WHATSAPP_FROM')
-            
-            if not all([account_sid, auth_token, from_whatsapp]):
-                print("❌ Credenciais do Twilio não configuradas")
-                return
-            
-            client = Client(account_sid, auth_token)
-            
-            # Formatar número (adicionar +55 se não tiver)
-            if not phone.startswith('+'):
-                phone = '+55' + phone.replace('(', '').replace(')', '').replace('-', '').replace(' ', '')
-            
-            # Enviar mensagem
-            client.messages.create(
-                from_=f'whatsapp:{from_whatsapp}',
-                to=f'whatsapp:{phone}',
-                body=message
-            )
-            
-            print(f"✅ WhatsApp enviado para {phone}")
-            
-        except Exception as e:
-            print(f"❌ Erro ao enviar WhatsApp: {str(e)}")
-
+        if result["status"] != "success":
+            raise DeliveryError(result['error'])
 
 # ========================================
 # EXECUTAR SCHEDULER
 # ========================================
 
-async def run_scheduler():
-    """Roda o scheduler em loop infinito"""
+async def run_scheduler(mode: str = "all"):
+    """
+    Roda o scheduler em loop infinito
+    
+    mode: "all" (varredura + entregas), "scan" (só grava no outbox) ou
+    "workers" (só drena o outbox) - para escalar cada parte separadamente
+    """
     
     scheduler = NotificationScheduler()
+    await scheduler.ledger.ensure_indexes()
+    await scheduler.outbox.ensure_indexes()
     
     print("🚀 Scheduler de notificações iniciado!")
-    print(f"⏰ Verificando eventos a cada 10 minutos")
     print(f"📱 WhatsApp: {'✅ Ativado' if scheduler.enable_whatsapp else '❌ Desativado'}")
-    print("")
+    
+    if mode in ("all", "workers"):
+        scheduler.push.start()
+        scheduler.outbox.start()
+        print(f"📤 Workers do outbox: {scheduler.outbox.workers}")
+    
+    try:
+        if mode == "workers":
+            await report_outbox_lag(scheduler.outbox)
+        else:
+            await scan_reminders(scheduler)
+    finally:
+        await scheduler.aclose()
+
+
+async def report_outbox_lag(outbox: NotificationOutbox, interval: float = 60):
+    """Mostra periodicamente o atraso de cada canal do outbox"""
     
     while True:
+        await asyncio.sleep(interval)
         try:
-            await scheduler.check_and_send_notifications()
-            
-            # Aguardar 10 minutos antes da próxima verificação
-            await asyncio.sleep(600)  # 600 segundos = 10 minutos
-            
+            for channel, metrics in (await outbox.lag()).items():
+                print(f"📊 {channel}: {metrics['pending']} pendentes, atraso {metrics['lag_seconds']:.0f}s, {metrics['dead']} mortas")
         except Exception as e:
-            print(f"❌ Erro no scheduler: {str(e)}")
-            await asyncio.sleep(60)  # Em caso de erro, aguarda 1 minuto
+            print(f"❌ Erro ao medir o outbox: {str(e)}")
+
+
+async def scan_reminders(scheduler: NotificationScheduler):
+    """Varredura: dorme até o próximo lembrete da timeline e grava as entregas no outbox"""
+    
+    timeline = ReminderTimeline(scheduler.db)
+    watcher = asyncio.create_task(timeline.watch())
+    
+    print(f"⏰ Disparo no horário exato de cada lembrete (timeline de {timeline.horizon})")
+    print("")
+    
+    try:
+        while True:
+            try:
+                now = datetime.now(timezone.utc)
+                
+                # Recarrega o heap ao fim do horizonte ou quando um evento mudou
+                if timeline.loaded_until is None or timeline.changed.is_set() or now >= timeline.loaded_until:
+                    await timeline.reload(now)
+                
+                due = timeline.pop_due(now)
+                if due:
+                    failed = await scheduler.send_reminders(due)
+                    # Sem sent_at: nova tentativa daqui a pouco (next_attempt_at vale também após recargas)
+                    await timeline.retry(failed, datetime.now(timezone.utc) + REMINDER_RETRY)
+                    continue
+                
+                # Dorme exatamente até o próximo disparo (ou até uma mudança)
+                await timeline.wait((timeline.next_wakeup() - datetime.now(timezone.utc)).total_seconds())
+                
+            except Exception as e:
+                print(f"❌ Erro no scheduler: {str(e)}")
+                timeline.loaded_until = None
+                await asyncio.sleep(60)  # Em caso de erro, aguarda 1 minuto
+    finally:
+        watcher.cancel()
 
 
 if __name__ == "__main__":
-    # Rodar o scheduler
-    asyncio.run(run_scheduler())
+    import sys
+    
+    # python notification_service_updated.py [all|scan|workers]
+    asyncio.run(run_scheduler(sys.argv[1] if len(sys.argv) > 1 else "all"))
@@ -0,0 +1,224 @@
+"""
+Templates das mensagens de lembrete - Fotiva
+Templates pré-compilados por idioma/canal e cache dos trechos já renderizados de cada evento
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from string import Formatter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_LOCALE = "pt-BR"
+DEFAULT_CHANNEL = "default"
+
+# Campos do evento que entram na mensagem: são a versão do evento no cache
+EVENT_VERSION_FIELDS = ("event_type", "client_name", "location", "event_date", "total_value", "amount_paid")
+
+# Eventos mantidos no cache de cada template (os lembretes de uma passada cabem com folga)
+MAX_CACHED_EVENTS = 4096
+
+
+def split_type_fields(text: str) -> Tuple[List[str], List[str]]:
+    """
+    Separa o texto nos campos do tipo ({emoji}): trechos entre eles, já com os
+    campos do evento ({{event_type}} vira {event_type}), e os nomes dos campos
+    """
+    chunks, fields = [""], []
+    for literal, field, _, _ in Formatter().parse(text):
+        chunks[-1] += literal
+        if field is not None:
+            fields.append(field)
+            chunks.append("")
+    return chunks, fields
+
+
+def join_chunks(chunks: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    """Intercala os trechos do evento com os valores dos campos do tipo"""
+    if not values:
+        return chunks[0]
+    parts = [None] * (len(chunks) + len(values))
+    parts[::2] = chunks
+    parts[1::2] = values
+    return "".join(parts)
+
+
+class MessageTemplate:
+    """
+    Título e corpo no formato do str.format em duas partes: os trechos do evento
+    ({{campos}}, com data e valores formatados pelo próprio texto) são renderizados
+    uma vez por versão do evento e reaproveitados por todos os tipos de lembrete;
+    os campos de cada tipo ({emoji}, {time_text}) só são intercalados no envio
+    """
+
+    def __init__(
+        self,
+        title: str,
+        body: str,
+        headers: Dict[str, Dict[str, str]],
+        fallback_header: Callable[[str], Dict[str, str]],
+        max_events: int = MAX_CACHED_EVENTS
+    ):
+        """
+        Args:
+            title / body: Texto com {campos do tipo} e {{campos do evento}}
+            headers: notification_type -> campos do tipo (emoji, time_text...)
+            fallback_header: Campos para um tipo fora de `headers`
+            max_events: Versões de evento mantidas no cache (LRU)
+        """
+        self.title_chunks, self.title_fields = split_type_fields(title)
+        self.body_chunks, self.body_fields = split_type_fields(body)
+        self.fallback_header = fallback_header
+        # notification_type -> valores dos campos do tipo, na ordem em que aparecem
+        self.compiled = {
+            notification_type: self.compile(header)
+            for notification_type, header in headers.items()
+        }
+        self.max_events = max_events
+        # versão do evento -> trechos já renderizados e mensagens prontas (ver event_entry)
+        self._events: "OrderedDict[tuple, list]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, header: Dict[str, str]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        return (
+            tuple(header[field] for field in self.title_fields),
+            tuple(header[field] for field in self.body_fields),
+        )
+
+    def context(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Campos do evento usados pelo texto (a formatação fica no template)"""
+
+        event_date = event['event_date']
+        if isinstance(event_date, str):
+            event_date = datetime.fromisoformat(event_date.replace('Z', '+00:00'))
+
+        total = event.get('total_value', 0) or 0
+        paid = event.get('amount_paid', 0) or 0
+
+        return {
+            "event_type": event.get('event_type', ''),
+            "client_name": event.get('client_name') or '',
+            "location": event.get('location') or '',
+            "date": event_date,
+            "total": total,
+            "paid": paid,
+            "remaining": total - paid,
+        }
+
+    def event_entry(self, event: Dict[str, Any]) -> list:
+        """
+        [trechos do título, trechos do corpo, mensagens prontas por tipo] da versão
+        do evento: parse da data e formatação dos valores só quando ela muda
+        """
+
+        version = tuple(map(event.get, EVENT_VERSION_FIELDS))
+        entry = self._events.get(version)
+        if entry is not None:
+            self.hits += 1
+            self._events.move_to_end(version)
+            return entry
+
+        self.misses += 1
+        context = self.context(event)
+        entry = self._events[version] = [
+            tuple(chunk.format_map(context) for chunk in self.title_chunks),
+            tuple(chunk.format_map(context) for chunk in self.body_chunks),
+            {},
+        ]
+        if len(self._events) > self.max_events:
+            self._events.popitem(last=False)
+        return entry
+
+    def render(self, event: Dict[str, Any], notification_type: str) -> Tuple[str, str]:
+        title_chunks, body_chunks, messages = self.event_entry(event)
+        message = messages.get(notification_type)
+        if message is not None:
+            return message
+
+        compiled = self.compiled.get(notification_type)
+        if compiled is None:
+            compiled = self.compiled[notification_type] = self.compile(self.fallback_header(notification_type))
+        message = messages[notification_type] = (
+            join_chunks(title_chunks, compiled[0]),
+            join_chunks(body_chunks, compiled[1]),
+        )
+        return message
+
+    def stats(self) -> Dict[str, int]:
+        return {"events": len(self._events), "hits": self.hits, "misses": self.misses}
+
+
+REMINDER_BODY_PT_BR = """{emoji} Lembrete: Faltam {time_text}!
+
+📸 Evento: {{event_type}}
+👤 Cliente: {{client_name}}
+📍 Local: {{location}}
+🗓️ Data: {{date:%d/%m/%Y às %H:%M}}
+
+💰 Valores:
+• Total: R$ {{total:.2f}}
+• Pago: R$ {{paid:.2f}}
+• Restante: R$ {{remaining:.2f}}
+
+Boa sorte no evento! 📸✨"""
+
+REMINDER_HEADERS_PT_BR = {
+    "48h": {"emoji": "📅", "time_text": "48 horas"},
+    "24h": {"emoji": "⏰", "time_text": "24 horas"},
+    "12h": {"emoji": "🚨", "time_text": "12 horas"},
+}
+
+
+def reminder_header_pt_br(notification_type: str) -> Dict[str, str]:
+    """Tipo sem cabeçalho próprio: mesmo texto da mensagem antiga (ex: "6h" -> "Faltam 6 horas")"""
+    return {"emoji": "🔔", "time_text": notification_type.replace('h', ' horas')}
+
+
+TEMPLATES = {
+    (DEFAULT_LOCALE, DEFAULT_CHANNEL): MessageTemplate(
+        "Evento: {{event_type}}",
+        REMINDER_BODY_PT_BR,
+        REMINDER_HEADERS_PT_BR,
+        reminder_header_pt_br
+    ),
+}
+
+
+class TemplateRenderer:
+    """Escolhe o template de cada idioma/canal (com fallback) e renderiza os lembretes"""
+
+    def __init__(self, templates: Optional[Dict[Tuple[str, str], MessageTemplate]] = None):
+        """
+        Args:
+            templates: (idioma, canal) -> template; padrão TEMPLATES
+        """
+        self.templates = dict(TEMPLATES if templates is None else templates)
+        # (idioma, canal pedido) -> template resolvido com os fallbacks
+        self._resolved: Dict[Tuple[str, str], MessageTemplate] = {}
+
+    def register(self, locale: str, channel: str, template: MessageTemplate) -> None:
+        """Adiciona/troca o template de um idioma e canal (channel="default" vale para todos)"""
+        self.templates[(locale, channel)] = template
+        self._resolved.clear()
+
+    def template_for(self, locale: str, channel: str) -> MessageTemplate:
+        template = self._resolved.get((locale, channel))
+        if template is not None:
+            return template
+
+        for key in ((locale, channel), (locale, DEFAULT_CHANNEL), (DEFAULT_LOCALE, channel), (DEFAULT_LOCALE, DEFAULT_CHANNEL)):
+            if key in self.templates:
+                template = self._resolved[(locale, channel)] = self.templates[key]
+                return template
+        raise KeyError(f"Nenhum template para {locale}/{channel}")
+
+    def render(
+        self,
+        event: Dict[str, Any],
+        notification_type: str,
+        channel: str = DEFAULT_CHANNEL,
+        locale: str = DEFAULT_LOCALE
+    ) -> Tuple[str, str]:
+        """Retorna (título, corpo) do lembrete"""
+
+        return self.template_for(locale, channel).render(event, notification_type)
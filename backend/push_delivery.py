@@ -0,0 +1,195 @@
+"""
+Entrega de Push Notifications (Web Push) - Fotiva
+Usado direto pela API (server.py) e pelo scheduler, sem passar por HTTP;
+o push_service.py é só um wrapper opcional em volta deste módulo
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from py_vapid import Vapid
+from pywebpush import WebPusher
+
+from push_pruner import SubscriptionPruner
+
+logger = logging.getLogger(__name__)
+
+VAPID_CLAIMS = {
+    "sub": "mailto:contato@fotivaapp.com"
+}
+
+
+class PushSender:
+    """
+    Chave VAPID carregada uma vez e cabeçalho Authorization assinado reaproveitado
+    por origem do push service (aud) até pouco antes de expirar
+    """
+
+    def __init__(
+        self,
+        private_key: str,
+        claims: dict,
+        session: requests.Session,
+        token_ttl: int = 12 * 60 * 60,
+        refresh_margin: int = 10 * 60
+    ):
+        self.vapid = Vapid.from_string(private_key=private_key)
+        self.claims = claims
+        self.session = session
+        self.token_ttl = token_ttl
+        self.refresh_margin = refresh_margin
+        # aud -> (exp, cabeçalhos assinados)
+        self._headers: Dict[str, Tuple[int, dict]] = {}
+        self._lock = threading.Lock()
+
+    def vapid_headers(self, endpoint: str) -> dict:
+        url = urlparse(endpoint)
+        aud = f"{url.scheme}://{url.netloc}"
+        now = time.time()
+
+        cached = self._headers.get(aud)
+        if cached is None or cached[0] - self.refresh_margin <= now:
+            with self._lock:
+                cached = self._headers.get(aud)
+                if cached is None or cached[0] - self.refresh_margin <= now:
+                    # exp do JWT é epoch em segundos (time.time()): não tem fuso, não há o que converter
+                    exp = int(now) + self.token_ttl
+                    cached = (exp, self.vapid.sign({**self.claims, "aud": aud, "exp": exp}))
+                    self._headers[aud] = cached
+
+        # WebPusher.send acrescenta os cabeçalhos de criptografia no dict recebido
+        return dict(cached[1])
+
+    def send(self, subscription_info: dict, notification: dict, timeout: float = None) -> requests.Response:
+        """Criptografa o payload (ECDH por mensagem, exigido pelo protocolo) e envia"""
+
+        return WebPusher(subscription_info, requests_session=self.session).send(
+            data=json.dumps(notification),
+            headers=self.vapid_headers(subscription_info["endpoint"]),
+            timeout=timeout
+        )
+
+
+class PushDelivery:
+    """Envio de push em um pool de threads, com limite por host e limpeza de endpoints mortos"""
+
+    def __init__(
+        self,
+        private_key: Optional[str],
+        users=None,
+        workers: int = 32,
+        host_concurrency: int = 16,
+        timeout: float = 10,
+        prune_interval: float = 30
+    ):
+        """
+        Args:
+            private_key: VAPID_PRIVATE_KEY (sem ela todo envio retorna erro)
+            users: Coleção do Motor (db.users) para achar a subscription e limpar as expiradas
+            workers: Threads de criptografia + POST no push service
+            host_concurrency: Envios simultâneos por host do push service
+            timeout: Timeout (s) de cada POST
+            prune_interval: Intervalo (s) da limpeza em lote das subscriptions 404/410
+        """
+        self.users = users
+        self.host_concurrency = host_concurrency
+        self.timeout = timeout
+        self.host_limits: Dict[str, asyncio.Semaphore] = {}
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="webpush")
+
+        # Sessão HTTP compartilhada (keep-alive) com pool do tamanho do executor
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=workers))
+
+        self.sender = PushSender(private_key, VAPID_CLAIMS, self.session) if private_key else None
+        self.pruner = SubscriptionPruner(users, flush_interval=prune_interval) if users is not None else None
+
+    @classmethod
+    def from_env(cls, users=None) -> "PushDelivery":
+        return cls(
+            os.getenv('VAPID_PRIVATE_KEY'),
+            users=users,
+            workers=int(os.getenv('PUSH_WORKERS', 32)),
+            host_concurrency=int(os.getenv('PUSH_HOST_CONCURRENCY', 16)),
+            timeout=float(os.getenv('PUSH_TIMEOUT', 10)),
+            prune_interval=float(os.getenv('PUSH_PRUNE_INTERVAL', 30))
+        )
+
+    @property
+    def configured(self) -> bool:
+        return self.sender is not None
+
+    def deliver(self, subscription_info: dict, notification: dict) -> Dict[str, Any]:
+        """Criptografa e envia uma notificação (roda em uma thread do executor)"""
+
+        try:
+            response = self.sender.send(subscription_info, notification, timeout=self.timeout)
+        except Exception as e:
+            return {"status": "error", "status_code": None, "error": str(e)}
+
+        # Subscription expirada ou inexistente no push service
+        if response.status_code in (404, 410):
+            return {"status": "expired", "status_code": response.status_code, "error": response.text}
+
+        if response.status_code > 202:
+            return {"status": "error", "status_code": response.status_code, "error": response.text}
+
+        return {"status": "success", "status_code": response.status_code}
+
+    async def send(self, subscription_info: dict, notification: dict) -> Dict[str, Any]:
+        """Envia no executor respeitando o limite de concorrência do host do endpoint"""
+
+        if not self.configured:
+            return {"status": "error", "status_code": None, "error": "VAPID keys não configuradas"}
+
+        host = urlparse(subscription_info["endpoint"]).netloc
+        limit = self.host_limits.setdefault(host, asyncio.Semaphore(self.host_concurrency))
+
+        async with limit:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, self.deliver, subscription_info, notification)
+
+        if result["status"] == "expired" and self.pruner is not None:
+            self.pruner.report(subscription_info["endpoint"])
+
+        return result
+
+    async def send_many(self, items: List[Tuple[dict, dict]]) -> List[Dict[str, Any]]:
+        """Envia vários (subscription, notificação) em paralelo; resultados na mesma ordem"""
+
+        return await asyncio.gather(*(self.send(subscription, notification) for subscription, notification in items))
+
+    async def send_to_user(self, user_id: str, notification: dict) -> Dict[str, Any]:
+        """Envia para a push_subscription salva do usuário"""
+
+        user = await self.users.find_one({"id": user_id}, {"_id": 0, "push_subscription": 1})
+
+        if not user or not user.get("push_subscription"):
+            return {"status": "no_subscription", "status_code": None, "error": "Usuário sem push ativado"}
+
+        return await self.send(user["push_subscription"], notification)
+
+    def start(self) -> None:
+        """Inicia a limpeza periódica no event loop atual"""
+        if self.pruner is not None:
+            self.pruner.start()
+
+    async def aclose(self) -> None:
+        if self.pruner is not None:
+            await self.pruner.stop()
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        if self.pruner is None:
+            return {"pruned_endpoints": 0, "pending_endpoints": 0, "pruning": False}
+        return {**self.pruner.stats(), "pruning": True}
@@ -0,0 +1,80 @@
+"""
+Limpeza de push subscriptions expiradas - Fotiva
+Endpoints que responderam 404/410 são removidos de db.users em lote
+"""
+
+import asyncio
+import logging
+from typing import Dict, Set
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionPruner:
+    """Acumula endpoints mortos e faz $unset de push_subscription periodicamente"""
+
+    def __init__(self, users, flush_interval: float = 30, batch_size: int = 500):
+        """
+        Args:
+            users: Coleção do Motor (db.users)
+            flush_interval: Intervalo (s) entre as limpezas em lote
+            batch_size: Limpa antes do intervalo se acumular esta quantidade
+        """
+        self.users = users
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending: Set[str] = set()
+        self.pruned = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def report(self, endpoint: str) -> None:
+        """Marca o endpoint como morto (não bloqueia o envio)"""
+        self.pending.add(endpoint)
+        if len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Remove as subscriptions dos endpoints acumulados em um único update_many"""
+        if not self.pending:
+            return 0
+
+        endpoints, self.pending = list(self.pending), set()
+        try:
+            result = await self.users.update_many(
+                {"push_subscription.endpoint": {"$in": endpoints}},
+                {"$unset": {"push_subscription": ""}}
+            )
+        except Exception as e:
+            # Volta para a fila; a próxima limpeza tenta de novo
+            self.pending.update(endpoints)
+            logger.error(f"❌ Erro ao remover push subscriptions expiradas: {e}")
+            return 0
+
+        self.pruned += result.modified_count
+        logger.info(f"🧹 {result.modified_count} push subscription(s) expirada(s) removida(s)")
+        return result.modified_count
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Inicia a limpeza periódica no event loop atual"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {"pruned_endpoints": self.pruned, "pending_endpoints": len(self.pending)}
@@ -1,13 +1,16 @@
 """
 Serviço de Push Notifications usando Web Push
+Wrapper HTTP opcional do push_delivery (a API e o scheduler chamam o módulo direto)
 """
 
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from pywebpush import webpush, WebPushException
-import json
+from pydantic import BaseModel, Field
+from typing import List
 import os
 import logging
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from push_delivery import PushDelivery
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,9 +20,15 @@ app = FastAPI()
 # VAPID keys - Gerar usando: webpush.generate_vapid_keys()
 VAPID_PRIVATE_KEY = os.getenv('VAPID_PRIVATE_KEY')
 VAPID_PUBLIC_KEY = os.getenv('VAPID_PUBLIC_KEY')
-VAPID_CLAIMS = {
-    "sub": "mailto:contato@fotivaapp.com"
-}
+
+PUSH_BATCH_MAX = 1000
+
+# Endpoints 404/410 removidos de db.users em lote (precisa do MONGO_URL da API)
+users = None
+if os.getenv('MONGO_URL'):
+    users = AsyncIOMotorClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']].users
+
+delivery = PushDelivery.from_env(users)
 
 
 class PushSubscription(BaseModel):
@@ -32,6 +41,10 @@ class PushNotificationRequest(BaseModel):
     notification: dict
 
 
+class PushBatchRequest(BaseModel):
+    items: List[PushNotificationRequest] = Field(..., max_length=PUSH_BATCH_MAX)
+
+
 @app.post("/send-notification")
 async def send_push_notification(request: PushNotificationRequest):
     """Envia uma push notification para o dispositivo inscrito"""
@@ -39,31 +52,44 @@ async def send_push_notification(request: PushNotificationRequest):
     if not VAPID_PRIVATE_KEY or not VAPID_PUBLIC_KEY:
         raise HTTPException(status_code=500, detail="VAPID keys não configuradas")
     
-    try:
-        subscription_info = {
-            "endpoint": request.subscription.endpoint,
-            "keys": request.subscription.keys
-        }
-        
-        # Enviar notificação
-        webpush(
-            subscription_info=subscription_info,
-            data=json.dumps(request.notification),
-            vapid_private_key=VAPID_PRIVATE_KEY,
-            vapid_claims=VAPID_CLAIMS
-        )
-        
+    result = await delivery.send(request.subscription.model_dump(), request.notification)
+    
+    if result["status"] == "success":
         logger.info(f"✅ Push notification enviada com sucesso")
         return {"status": "success", "message": "Notificação enviada"}
-        
-    except WebPushException as e:
-        logger.error(f"❌ Erro ao enviar push: {e}")
-        
-        # Se a subscription expirou, retornar 410
-        if e.response and e.response.status_code == 410:
-            raise HTTPException(status_code=410, detail="Subscription expirada")
-        
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    logger.error(f"❌ Erro ao enviar push: {result['error']}")
+    
+    # Se a subscription expirou, retornar 410
+    if result["status"] == "expired":
+        raise HTTPException(status_code=410, detail="Subscription expirada")
+    
+    raise HTTPException(status_code=500, detail=result["error"])
+
+
+@app.post("/send-batch")
+async def send_push_batch(request: PushBatchRequest):
+    """
+    Envia várias notificações em paralelo (executor + limite por host)
+    e retorna o resultado de cada item, na mesma ordem do pedido
+    """
+    
+    if not VAPID_PRIVATE_KEY or not VAPID_PUBLIC_KEY:
+        raise HTTPException(status_code=500, detail="VAPID keys não configuradas")
+    
+    results = await delivery.send_many([
+        (item.subscription.model_dump(), item.notification)
+        for item in request.items
+    ])
+    
+    sent = sum(1 for result in results if result["status"] == "success")
+    logger.info(f"✅ Lote de push: {sent}/{len(results)} enviadas")
+    
+    return {
+        "sent": sent,
+        "failed": len(results) - sent,
+        "results": [{"index": index, **result} for index, result in enumerate(results)],
+    }
 
 
 @app.get("/vapid-public-key")
@@ -75,6 +101,22 @@ async def get_vapid_public_key():
     return {"publicKey": VAPID_PUBLIC_KEY}
 
 
+@app.get("/stats")
+async def get_push_stats():
+    """Contadores da limpeza de subscriptions expiradas"""
+    return delivery.stats()
+
+
+@app.on_event("startup")
+async def start_push_delivery():
+    delivery.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_push_delivery():
+    await delivery.aclose()
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PUSH_PORT", 8001))
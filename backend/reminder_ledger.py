@@ -0,0 +1,80 @@
+"""
+Registro de lembretes enviados - Fotiva
+Garante que cada lembrete (evento, 48h/24h/12h) seja enviado uma única vez,
+mesmo com várias instâncias do scheduler rodando em paralelo
+"""
+
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+
+
+class ReminderLedger:
+    """Reserva atômica de lembretes no MongoDB (insert único + lease)"""
+
+    def __init__(self, collection, lease_seconds: float = 300):
+        """
+        Args:
+            collection: Coleção do Motor (db.reminder_ledger)
+            lease_seconds: Tempo até uma reserva de instância que caiu poder ser retomada
+        """
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_indexes([
+            # event_date na chave: evento remarcado volta a receber os lembretes
+            IndexModel(
+                [("event_id", ASCENDING), ("notification_type", ASCENDING), ("event_date", ASCENDING)],
+                name="event_id_type_date_unique",
+                unique=True
+            ),
+        ])
+
+    def _key(self, event: Dict[str, Any], notification_type: str) -> Dict[str, Any]:
+        return {
+            "event_id": event['id'],
+            "notification_type": notification_type,
+            "event_date": event['event_date'],
+        }
+
+    async def claim(self, event: Dict[str, Any], notification_type: str) -> bool:
+        """
+        Reserva o lembrete para esta instância
+
+        Returns:
+            False se já foi enviado ou está sendo enviado por outra instância
+        """
+        now = datetime.now(timezone.utc)
+        key = self._key(event, notification_type)
+        lease = {"status": "claimed", "owner": self.owner, "locked_until": now + timedelta(seconds=self.lease_seconds)}
+
+        try:
+            await self.collection.insert_one({**key, **lease, "claimed_at": now})
+            return True
+        except DuplicateKeyError:
+            pass
+
+        # Já existe: só retoma se a outra instância caiu antes de concluir o envio
+        taken = await self.collection.find_one_and_update(
+            {**key, "status": "claimed", "locked_until": {"$lte": now}},
+            {"$set": lease}
+        )
+        return taken is not None
+
+    async def mark_sent(self, event: Dict[str, Any], notification_type: str) -> None:
+        await self.collection.update_one(
+            {**self._key(event, notification_type), "owner": self.owner},
+            {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc)}, "$unset": {"locked_until": ""}}
+        )
+
+    async def release(self, event: Dict[str, Any], notification_type: str) -> None:
+        """Desfaz a reserva após falha, para outra passada tentar de novo"""
+        await self.collection.delete_one(
+            {**self._key(event, notification_type), "owner": self.owner, "status": "claimed"}
+        )
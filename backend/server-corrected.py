@@ -1,18 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import OperationFailure
 import os
+import asyncio
+import base64
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import uuid
-from datetime import datetime, timezone, timedelta
+import calendar
+import time
+from datetime import date, datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 
+from whatsapp_channel import normalize_phone
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -21,9 +32,22 @@ SECRET_KEY = os.environ['SECRET_KEY']
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Pool dedicado para bcrypt (o hash leva ~100-300 ms e não pode rodar no event loop)
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 64))
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+password_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+# Cache de usuários autenticados (evita um find_one em db.users a cada request)
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 1024))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
@@ -38,6 +62,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 api_router = APIRouter(prefix="/api")
@@ -51,6 +76,7 @@ class User(BaseModel):
     name: str
     brand_name: Optional[str] = None
     profile_photo: Optional[str] = None
+    role: str = "user"  # "admin" é definido direto no banco
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class UserCreate(BaseModel):
@@ -151,6 +177,15 @@ class PaymentCreate(BaseModel):
     amount: float
     due_date: str
 
+class PaymentSettleRequest(BaseModel):
+    payment_ids: List[str]
+
+class InstallmentPlanCreate(BaseModel):
+    installments: int
+    first_due_date: str  # formato: 2025-02-06
+    schedule: str = "monthly"  # monthly, weekly, biweekly
+    total_amount: Optional[float] = None  # padrão: valor total do evento - valor já pago
+
 class Gallery(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -177,6 +212,60 @@ class DashboardMetrics(BaseModel):
     upcoming_events: List[Event]
     monthly_revenue_chart: List[dict]
 
+# ============== AUTH CACHE ==============
+
+class UserCache:
+    """Cache LRU com TTL dos usuários autenticados, indexado por email"""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, email: str) -> Optional[User]:
+        entry = self._entries.get(email)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del self._entries[email]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(email)
+        self.hits += 1
+        return user
+
+    def set(self, email: str, user: User) -> None:
+        self._entries[email] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(email)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, email: str) -> None:
+        """Remove o usuário do cache (chamar após qualquer escrita em db.users)"""
+        self._entries.pop(email, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+user_cache = UserCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+
 # ============== AUTH FUNCTIONS ==============
 
 def verify_password(plain_password, hashed_password):
@@ -185,6 +274,24 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def run_password_task(func, *args):
+    """Executa verify/hash no pool do bcrypt, recusando quando a fila está cheia"""
+    if password_slots.locked():
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, tente novamente em instantes",
+            headers={"Retry-After": "1"},
+        )
+    async with password_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_executor, func, *args)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await run_password_task(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await run_password_task(get_password_hash, password)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -206,14 +313,388 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    user_doc = await db.users.find_one({"email": email}, {"_id": 0})
+    cached_user = user_cache.get(email)
+    if cached_user is not None:
+        return cached_user
+    
+    user_doc = await db.users.find_one({"email": email}, {"_id": 0, "password_hash": 0})
     if user_doc is None:
         raise credentials_exception
     
     if isinstance(user_doc['created_at'], str):
         user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
     
-    return User(**user_doc)
+    user = User(**user_doc)
+    user_cache.set(email, user)
+    return user
+
+async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """Rotas internas/administrativas: apenas usuários com role "admin" no banco"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores")
+    return current_user
+
+def validate_phone(phone: Optional[str]) -> Optional[str]:
+    """Telefone gravado já em E.164 (o canal de WhatsApp usa o valor como está); 400 se inválido"""
+    if not phone:
+        return None
+    normalized = normalize_phone(phone)
+    if not normalized:
+        raise HTTPException(
+            status_code=400,
+            detail="Telefone inválido: use DDD + número ou +DDI para números estrangeiros"
+        )
+    return normalized
+
+# ============== DASHBOARD COUNTERS ==============
+
+# Contadores do dashboard mantidos em db.user_stats (um documento por usuário)
+USER_STATS_FIELDS = (
+    "total_clients",
+    "total_events",
+    "confirmed_events",
+    "total_revenue",
+    "pending_payments",
+    "photos_delivered",
+)
+
+# Definição única de pagamento pendente para contadores, rebuild e baixas:
+# pago é paid == True; todo o resto (False ou documento sem o campo) é pendente
+PAYMENT_PAID_EXPR = {"$eq": ["$paid", True]}
+PAYMENT_PENDING_FILTER = {"paid": {"$ne": True}}
+
+async def aggregate_one(collection, pipeline: list) -> dict:
+    """Roda um pipeline que agrega em um único documento (ou {} se não houver dados)"""
+    result = await collection.aggregate(pipeline).to_list(1)
+    return result[0] if result else {}
+
+async def bump_user_stats(user_id: str, session=None, **deltas):
+    """Aplica um $inc atômico nos contadores do usuário"""
+    inc = {field: value for field, value in deltas.items() if value}
+    if not inc:
+        return
+    # Sem upsert: se o documento não existir, a próxima leitura reconstrói tudo
+    await db.user_stats.update_one(
+        {"user_id": user_id},
+        {"$inc": inc, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        session=session
+    )
+
+async def rebuild_user_stats(user_id: str) -> dict:
+    """Recalcula os contadores a partir das coleções (corrige qualquer drift)"""
+    payment_totals_pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$group": {
+            "_id": None,
+            "paid": {"$sum": {"$cond": [PAYMENT_PAID_EXPR, "$amount", 0]}},
+            "pending": {"$sum": {"$cond": [PAYMENT_PAID_EXPR, 0, "$amount"]}},
+        }},
+    ]
+    photos_pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": None, "photos": {"$sum": "$photo_count"}}},
+    ]
+    
+    total_clients, total_events, confirmed_events, payment_totals, photos = await asyncio.gather(
+        db.clients.count_documents({"user_id": user_id}),
+        db.events.count_documents({"user_id": user_id}),
+        db.events.count_documents({"user_id": user_id, "status": "confirmado"}),
+        aggregate_one(db.payments, payment_totals_pipeline),
+        aggregate_one(db.galleries, photos_pipeline),
+    )
+    
+    stats = {
+        "user_id": user_id,
+        "total_clients": total_clients,
+        "total_events": total_events,
+        "confirmed_events": confirmed_events,
+        "total_revenue": payment_totals.get('paid', 0),
+        "pending_payments": payment_totals.get('pending', 0),
+        "photos_delivered": photos.get('photos', 0),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    await db.user_stats.update_one({"user_id": user_id}, {"$set": stats}, upsert=True)
+    return stats
+
+async def get_user_stats(user_id: str) -> dict:
+    stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0})
+    if stats is None:
+        stats = await rebuild_user_stats(user_id)
+    return stats
+
+async def rebuild_all_user_stats(user_ids: Optional[List[str]] = None) -> int:
+    """Reconstrói os contadores de todos os usuários (ou apenas dos informados)"""
+    if not user_ids:
+        user_ids = [u['id'] async for u in db.users.find({}, {"_id": 0, "id": 1})]
+    for user_id in user_ids:
+        await rebuild_user_stats(user_id)
+    return len(user_ids)
+
+# ============== PAGINATION ==============
+
+# Tamanho máximo de página das listagens (/clients, /events, /payments, /galleries)
+LIST_PAGE_MAX = 1000
+STREAM_BATCH_SIZE = 200
+
+def encode_cursor(doc: dict) -> str:
+    """Cursor opaco com a chave (created_at, id) do último item da página"""
+    created_at = doc['created_at']
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    return base64.urlsafe_b64encode(f"{created_at}|{doc['id']}".encode()).decode()
+
+def decode_cursor(after: str) -> dict:
+    """Converte o cursor em um filtro keyset: itens estritamente depois de (created_at, id)"""
+    try:
+        created_at, doc_id = base64.urlsafe_b64decode(after.encode()).decode().split('|', 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return {
+        "$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": doc_id}},
+        ]
+    }
+
+async def stream_ndjson(cursor, model):
+    """Serializa um cursor do Motor linha a linha, sem materializar a lista"""
+    async for doc in cursor:
+        yield model(**doc).model_dump_json() + "\n"
+
+async def list_user_documents(
+    collection,
+    model,
+    user_id: str,
+    response: Response,
+    limit: Optional[int],
+    after: Optional[str],
+    stream: bool
+):
+    """
+    Listagem paginada por keyset em (created_at, id).
+    
+    O próximo cursor vai no header X-Next-Cursor; com stream=true a resposta
+    é NDJSON lida direto do cursor.
+    """
+    query = {"user_id": user_id}
+    if after:
+        query.update(decode_cursor(after))
+    
+    cursor = collection.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+    
+    if stream:
+        if limit:
+            cursor = cursor.limit(limit)
+        return StreamingResponse(
+            stream_ndjson(cursor.batch_size(STREAM_BATCH_SIZE), model),
+            media_type="application/x-ndjson"
+        )
+    
+    page_size = limit or LIST_PAGE_MAX
+    docs = await cursor.limit(page_size + 1).to_list(page_size + 1)
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    return docs
+
+# ============== PAYMENT SETTLEMENT ==============
+
+# Baixa de parcelas em transação (exige MongoDB em replica set)
+MONGO_TRANSACTIONS = os.environ.get('MONGO_TRANSACTIONS', 'false').lower() == 'true'
+SETTLE_MANY_MAX = 500
+
+async def run_settlement(func, *args):
+    """Executa a baixa dentro de uma transação quando MONGO_TRANSACTIONS=true"""
+    if not MONGO_TRANSACTIONS:
+        return await func(*args)
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            return await func(*args, session=session)
+
+async def apply_settlements(user_id: str, settled: List[dict], session=None):
+    """Soma as parcelas baixadas no paid_amount dos eventos e nos contadores"""
+    per_event = {}
+    for payment in settled:
+        per_event[payment['event_id']] = per_event.get(payment['event_id'], 0) + payment['amount']
+    if not per_event:
+        return
+    
+    await db.events.bulk_write(
+        [
+            UpdateOne({"id": event_id, "user_id": user_id}, {"$inc": {"paid_amount": amount}})
+            for event_id, amount in per_event.items()
+        ],
+        ordered=False,
+        session=session
+    )
+    total = sum(per_event.values())
+    await bump_user_stats(user_id, session=session, total_revenue=total, pending_payments=-total)
+
+async def settle_payment(user_id: str, payment_id: str, session=None) -> Optional[dict]:
+    """Marca uma parcela como paga só se ainda estiver pendente; None se nada mudou"""
+    payment = await db.payments.find_one_and_update(
+        {"id": payment_id, "user_id": user_id, **PAYMENT_PENDING_FILTER},
+        {"$set": {"paid": True, "paid_date": datetime.now(timezone.utc).strftime("%Y-%m-%d")}},
+        projection={"_id": 0, "id": 1, "event_id": 1, "amount": 1},
+        session=session
+    )
+    if payment is not None:
+        await apply_settlements(user_id, [payment], session)
+    return payment
+
+async def settle_many_payments(user_id: str, payment_ids: List[str], session=None) -> List[dict]:
+    """Baixa várias parcelas com um update_many; o settlement_id identifica quais mudaram"""
+    settlement_id = str(uuid.uuid4())
+    await db.payments.update_many(
+        {"id": {"$in": payment_ids}, "user_id": user_id, **PAYMENT_PENDING_FILTER},
+        {"$set": {
+            "paid": True,
+            "paid_date": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+            "settlement_id": settlement_id
+        }},
+        session=session
+    )
+    settled = await db.payments.find(
+        {"settlement_id": settlement_id},
+        {"_id": 0, "id": 1, "event_id": 1, "amount": 1},
+        session=session
+    ).to_list(len(payment_ids))
+    await apply_settlements(user_id, settled, session)
+    return settled
+
+# ============== INSTALLMENT PLANS ==============
+
+# Intervalo entre parcelas (em dias) para as regras que não são mensais
+INSTALLMENT_INTERVAL_DAYS = {"weekly": 7, "biweekly": 14}
+INSTALLMENT_SCHEDULES = ("monthly", *INSTALLMENT_INTERVAL_DAYS)
+INSTALLMENTS_MAX = 60
+
+def add_months(value: date, months: int) -> date:
+    """Soma meses mantendo o dia (ou o último dia do mês, ex: 31/01 -> 28/02)"""
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+def build_installment_schedule(total_amount: float, installments: int, first_due_date: str, schedule: str) -> List[tuple]:
+    """
+    Divide o total em parcelas (em centavos, a última absorve o resto)
+    e calcula o vencimento de cada uma. Retorna [(due_date, amount), ...]
+    """
+    if schedule not in INSTALLMENT_SCHEDULES:
+        raise HTTPException(status_code=400, detail=f"Regra de vencimento inválida. Use: {', '.join(INSTALLMENT_SCHEDULES)}")
+    if not 1 <= installments <= INSTALLMENTS_MAX:
+        raise HTTPException(status_code=400, detail=f"Número de parcelas deve ser entre 1 e {INSTALLMENTS_MAX}")
+    if total_amount <= 0:
+        raise HTTPException(status_code=400, detail="Valor total deve ser maior que zero")
+    try:
+        first_due = date.fromisoformat(first_due_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data do primeiro vencimento inválida (use AAAA-MM-DD)")
+    
+    total_cents = round(total_amount * 100)
+    base_cents, remainder_cents = divmod(total_cents, installments)
+    
+    schedule_rows = []
+    for index in range(installments):
+        if schedule == "monthly":
+            due_date = add_months(first_due, index)
+        else:
+            due_date = first_due + timedelta(days=INSTALLMENT_INTERVAL_DAYS[schedule] * index)
+        cents = base_cents + (remainder_cents if index == installments - 1 else 0)
+        schedule_rows.append((due_date.isoformat(), cents / 100))
+    return schedule_rows
+
+def build_installment_payments(user_id: str, event: dict, plan: "InstallmentPlanCreate") -> List[Payment]:
+    """Valida o plano e monta as parcelas do evento, sem gravar nada"""
+    total_amount = plan.total_amount
+    if total_amount is None:
+        total_amount = event['total_value'] - event.get('paid_amount', 0)
+    
+    schedule_rows = build_installment_schedule(total_amount, plan.installments, plan.first_due_date, plan.schedule)
+    return [
+        Payment(
+            user_id=user_id,
+            event_id=event['id'],
+            client_id=event['client_id'],
+            client_name=event['client_name'],
+            event_name=event['name'],
+            installment_number=number,
+            total_installments=len(schedule_rows),
+            amount=amount,
+            due_date=due_date
+        )
+        for number, (due_date, amount) in enumerate(schedule_rows, start=1)
+    ]
+
+async def save_installment_payments(user_id: str, payments: List[Payment]) -> List[Payment]:
+    """Grava as parcelas com um único insert_many e soma o pendente nos contadores"""
+    docs = []
+    for payment in payments:
+        doc = payment.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        docs.append(doc)
+    await db.payments.insert_many(docs, ordered=False)
+    await bump_user_stats(user_id, pending_payments=sum(p.amount for p in payments))
+    return payments
+
+async def create_installment_plan(user_id: str, event: dict, plan: "InstallmentPlanCreate") -> List[Payment]:
+    """Gera todas as parcelas do evento e grava com um único insert_many"""
+    return await save_installment_payments(user_id, build_installment_payments(user_id, event, plan))
+
+# ============== REMINDER TIMELINE ==============
+
+# Lembretes do fotógrafo: horas antes do evento em que cada aviso dispara
+REMINDER_OFFSETS = {"48h": 48, "24h": 24, "12h": 12}
+REMINDER_STATUS = ("confirmado", "pendente")
+
+def event_datetime(event: dict) -> Optional[datetime]:
+    """Data e hora do evento (campos date "AAAA-MM-DD" e time "HH:MM"), ou None se inválidas"""
+    try:
+        return datetime.fromisoformat(f"{event['date']}T{event.get('time') or '00:00'}")
+    except (KeyError, TypeError, ValueError):
+        return None
+
+async def sync_event_reminders(event: dict):
+    """
+    Materializa em db.event_reminders os horários de disparo (48h, 24h, 12h)
+    do evento; o scheduler é avisado da mudança pelo change stream da coleção
+    """
+    await db.event_reminders.delete_many({"event_id": event['id'], "sent_at": {"$exists": False}})
+    if event.get('status') not in REMINDER_STATUS:
+        return
+    
+    event_date = event_datetime(event)
+    if event_date is None:
+        return
+    
+    # date/time são hora local do servidor; fire_at é gravado em UTC
+    event_date = event_date.astimezone(timezone.utc)
+    now = datetime.now(timezone.utc)
+    reminders = [
+        {
+            "event_id": event['id'],
+            "user_id": event['user_id'],
+            "notification_type": notification_type,
+            "fire_at": event_date - timedelta(hours=hours),
+        }
+        for notification_type, hours in REMINDER_OFFSETS.items()
+        if event_date - timedelta(hours=hours) > now
+    ]
+    if reminders:
+        await db.event_reminders.insert_many(reminders)
+
+async def rebuild_all_event_reminders() -> int:
+    """Materializa os lembretes de todos os eventos futuros (eventos anteriores à timeline)"""
+    total = 0
+    # date é string em hora local: compara com a data local atual
+    today = datetime.now(timezone.utc).astimezone().date().isoformat()
+    async for event in db.events.find(
+        {"status": {"$in": list(REMINDER_STATUS)}, "date": {"$gte": today}},
+        {"_id": 0, "id": 1, "user_id": 1, "date": 1, "time": 1, "status": 1}
+    ):
+        await sync_event_reminders(event)
+        total += 1
+    return total
 
 # ============== AUTH ROUTES ==============
 
@@ -232,10 +713,13 @@ async def register(user_data: UserCreate):
     )
     
     user_dict = user.model_dump()
-    user_dict['password_hash'] = get_password_hash(user_data.password)
+    user_dict['password_hash'] = await get_password_hash_async(user_data.password)
     user_dict['created_at'] = user_dict['created_at'].isoformat()
     
     await db.users.insert_one(user_dict)
+    await db.user_stats.insert_one(
+        {"user_id": user.id, **{field: 0 for field in USER_STATS_FIELDS}}
+    )
     
     access_token = create_access_token(data={"sub": user.email})
     
@@ -247,7 +731,7 @@ async def login(user_data: UserLogin):
     if not user_doc:
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
-    if not verify_password(user_data.password, user_doc['password_hash']):
+    if not await verify_password_async(user_data.password, user_doc['password_hash']):
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
     if isinstance(user_doc['created_at'], str):
@@ -267,36 +751,64 @@ async def get_me(current_user: User = Depends(get_current_user)):
 @api_router.post("/clients", response_model=Client)
 async def create_client(client_data: ClientCreate, current_user: User = Depends(get_current_user)):
     client = Client(user_id=current_user.id, **client_data.model_dump())
+    client.phone = validate_phone(client.phone)
     doc = client.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.clients.insert_one(doc)
+    await bump_user_stats(current_user.id, total_clients=1)
     return client
 
 @api_router.get("/clients", response_model=List[Client])
-async def get_clients(current_user: User = Depends(get_current_user)):
-    clients = await db.clients.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for client in clients:
-        if isinstance(client['created_at'], str):
-            client['created_at'] = datetime.fromisoformat(client['created_at'])
-    return clients
+async def get_clients(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    return await list_user_documents(db.clients, Client, current_user.id, response, limit, after, stream)
 
 # ============== EVENT ROUTES ==============
 
 @api_router.post("/events", response_model=Event)
-async def create_event(event_data: EventCreate, current_user: User = Depends(get_current_user)):
+async def create_event(
+    event_data: EventCreate,
+    generate_installments: bool = False,
+    current_user: User = Depends(get_current_user)
+):
     event = Event(user_id=current_user.id, **event_data.model_dump())
     doc = event.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    
+    # Parcelas validadas antes de gravar: um plano inválido (400) não deixa evento órfão
+    payments = []
+    if generate_installments and event.remaining_installments > 1:
+        # Parcelas mensais a partir de hoje para o valor ainda não pago
+        payments = build_installment_payments(current_user.id, doc, InstallmentPlanCreate(
+            installments=event.remaining_installments,
+            first_due_date=datetime.now(timezone.utc).date().isoformat()
+        ))
+    
     await db.events.insert_one(doc)
+    await bump_user_stats(
+        current_user.id,
+        total_events=1,
+        confirmed_events=1 if event.status == "confirmado" else 0
+    )
+    await sync_event_reminders(doc)
+    if payments:
+        await save_installment_payments(current_user.id, payments)
     return event
 
 @api_router.get("/events", response_model=List[Event])
-async def get_events(current_user: User = Depends(get_current_user)):
-    events = await db.events.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for event in events:
-        if isinstance(event['created_at'], str):
-            event['created_at'] = datetime.fromisoformat(event['created_at'])
-    return events
+async def get_events(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    return await list_user_documents(db.events, Event, current_user.id, response, limit, after, stream)
 
 @api_router.get("/events/{event_id}", response_model=Event)
 async def get_event(event_id: str, current_user: User = Depends(get_current_user)):
@@ -324,18 +836,45 @@ async def update_event(event_id: str, event_data: EventUpdate, current_user: Use
         )
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Evento não encontrado")
+        
+        if 'status' in update_data:
+            was_confirmed = existing_event.get('status') == "confirmado"
+            is_confirmed = update_data['status'] == "confirmado"
+            await bump_user_stats(current_user.id, confirmed_events=int(is_confirmed) - int(was_confirmed))
     
-    return await get_event(event_id, current_user)
+    event = await get_event(event_id, current_user)
+    await sync_event_reminders(event.model_dump())
+    return event
 
 @api_router.delete("/events/{event_id}")
 async def delete_event(event_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.events.delete_one({"id": event_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    deleted = await db.events.find_one_and_delete(
+        {"id": event_id, "user_id": current_user.id},
+        projection={"_id": 0, "status": 1}
+    )
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Evento não encontrado")
     
-    # Delete associated payments
+    # Delete associated payments (descontando seus valores dos contadores)
+    payment_totals = await aggregate_one(db.payments, [
+        {"$match": {"event_id": event_id, "user_id": current_user.id}},
+        {"$group": {
+            "_id": None,
+            "paid": {"$sum": {"$cond": [PAYMENT_PAID_EXPR, "$amount", 0]}},
+            "pending": {"$sum": {"$cond": [PAYMENT_PAID_EXPR, 0, "$amount"]}},
+        }},
+    ])
     await db.payments.delete_many({"event_id": event_id, "user_id": current_user.id})
     
+    await bump_user_stats(
+        current_user.id,
+        total_events=-1,
+        confirmed_events=-1 if deleted.get('status') == "confirmado" else 0,
+        total_revenue=-payment_totals.get('paid', 0),
+        pending_payments=-payment_totals.get('pending', 0)
+    )
+    await db.event_reminders.delete_many({"event_id": event_id})
+    
     return {"message": "Evento deletado com sucesso"}
 
 # ============== PAYMENT ROUTES ==============
@@ -346,36 +885,53 @@ async def create_payment(payment_data: PaymentCreate, current_user: User = Depen
     doc = payment.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.payments.insert_one(doc)
+    await bump_user_stats(current_user.id, pending_payments=payment.amount)
     return payment
 
 @api_router.get("/payments", response_model=List[Payment])
-async def get_payments(current_user: User = Depends(get_current_user)):
-    payments = await db.payments.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for payment in payments:
-        if isinstance(payment['created_at'], str):
-            payment['created_at'] = datetime.fromisoformat(payment['created_at'])
-    return payments
+async def get_payments(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    return await list_user_documents(db.payments, Payment, current_user.id, response, limit, after, stream)
 
 @api_router.patch("/payments/{payment_id}/mark-paid")
 async def mark_payment_paid(payment_id: str, current_user: User = Depends(get_current_user)):
-    paid_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    result = await db.payments.update_one(
-        {"id": payment_id, "user_id": current_user.id},
-        {"$set": {"paid": True, "paid_date": paid_date}}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Pagamento não encontrado")
-    
-    # Update event paid_amount
-    payment_doc = await db.payments.find_one({"id": payment_id}, {"_id": 0, "event_id": 1, "amount": 1})
-    if payment_doc:
-        event_id = payment_doc['event_id']
-        all_payments = await db.payments.find({"event_id": event_id}, {"_id": 0, "amount": 1, "paid": 1}).to_list(1000)
-        total_paid = sum(p['amount'] for p in all_payments if p.get('paid', False))
-        await db.events.update_one({"id": event_id}, {"$set": {"paid_amount": total_paid}})
+    payment_doc = await run_settlement(settle_payment, current_user.id, payment_id)
+    if payment_doc is None:
+        if await db.payments.count_documents({"id": payment_id, "user_id": current_user.id}, limit=1) == 0:
+            raise HTTPException(status_code=404, detail="Pagamento não encontrado")
+        return {"message": "Pagamento já estava marcado como pago"}
     
     return {"message": "Pagamento marcado como pago"}
 
+@api_router.post("/payments/settle")
+async def settle_payments(data: PaymentSettleRequest, current_user: User = Depends(get_current_user)):
+    """Marca várias parcelas como pagas de uma vez"""
+    payment_ids = list(dict.fromkeys(data.payment_ids))
+    if len(payment_ids) > SETTLE_MANY_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo de {SETTLE_MANY_MAX} parcelas por requisição")
+    
+    settled = await run_settlement(settle_many_payments, current_user.id, payment_ids)
+    settled_ids = {p['id'] for p in settled}
+    
+    return {
+        "settled": [payment_id for payment_id in payment_ids if payment_id in settled_ids],
+        "skipped": [payment_id for payment_id in payment_ids if payment_id not in settled_ids],
+        "total_settled": sum(p['amount'] for p in settled)
+    }
+
+@api_router.post("/events/{event_id}/installments", response_model=List[Payment])
+async def create_event_installments(event_id: str, plan: InstallmentPlanCreate, current_user: User = Depends(get_current_user)):
+    """Gera o carnê de parcelas do evento em uma única requisição"""
+    event = await db.events.find_one({"id": event_id, "user_id": current_user.id}, {"_id": 0})
+    if not event:
+        raise HTTPException(status_code=404, detail="Evento não encontrado")
+    return await create_installment_plan(current_user.id, event, plan)
+
 # ============== GALLERY ROUTES ==============
 
 @api_router.post("/galleries", response_model=Gallery)
@@ -384,61 +940,87 @@ async def create_gallery(gallery_data: GalleryCreate, current_user: User = Depen
     doc = gallery.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.galleries.insert_one(doc)
+    await bump_user_stats(current_user.id, photos_delivered=gallery.photo_count)
     return gallery
 
 @api_router.get("/galleries", response_model=List[Gallery])
-async def get_galleries(current_user: User = Depends(get_current_user)):
-    galleries = await db.galleries.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for gallery in galleries:
-        if isinstance(gallery['created_at'], str):
-            gallery['created_at'] = datetime.fromisoformat(gallery['created_at'])
-    return galleries
+async def get_galleries(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    return await list_user_documents(db.galleries, Gallery, current_user.id, response, limit, after, stream)
 
 # ============== DASHBOARD ROUTES ==============
 
+MONTH_LABELS = ["Jan", "Fev", "Mar", "Abr", "Mai", "Jun", "Jul", "Ago", "Set", "Out", "Nov", "Dez"]
+
 @api_router.get("/dashboard/metrics", response_model=DashboardMetrics)
 async def get_dashboard_metrics(current_user: User = Depends(get_current_user)):
-    # Get current month revenue
-    events = await db.events.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    payments = await db.payments.find({"user_id": current_user.id, "paid": True}, {"_id": 0}).to_list(1000)
-    pending_payments = await db.payments.find({"user_id": current_user.id, "paid": False}, {"_id": 0}).to_list(1000)
-    galleries = await db.galleries.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    
-    monthly_revenue = sum(p['amount'] for p in payments)
-    confirmed_events = len([e for e in events if e['status'] == 'confirmado'])
-    photos_delivered = sum(g['photo_count'] for g in galleries)
-    pending_payments_total = sum(p['amount'] for p in pending_payments)
-    
-    # Upcoming events (próximos 5)
-    sorted_events = sorted(events, key=lambda x: x['date'])[:5]
-    for event in sorted_events:
-        if isinstance(event['created_at'], str):
-            event['created_at'] = datetime.fromisoformat(event['created_at'])
+    user_id = current_user.id
     
-    # Monthly revenue chart
-    months = ["Jan", "Fev", "Mar", "Abr", "Mai", "Jun", "Jul", "Ago", "Set", "Out", "Nov", "Dez"]
-    monthly_data = [{"month": month, "revenue": 0} for month in months]
+    # Faturamento por mês a partir de paid_date (YYYY-MM-DD)
+    monthly_revenue_pipeline = [
+        {"$match": {"user_id": user_id, "paid": True, "paid_date": {"$type": "string"}}},
+        {"$project": {
+            "amount": 1,
+            "paid_at": {"$dateFromString": {
+                "dateString": "$paid_date",
+                "format": "%Y-%m-%d",
+                "onError": None,
+                "onNull": None,
+            }},
+        }},
+        {"$match": {"paid_at": {"$ne": None}}},
+        {"$group": {"_id": {"$month": "$paid_at"}, "revenue": {"$sum": "$amount"}}},
+    ]
     
-    # Calculate revenue by month from payments
-    for payment in payments:
-        if payment.get('paid_date'):
-            try:
-                paid_date = datetime.strptime(payment['paid_date'], "%Y-%m-%d")
-                month_index = paid_date.month - 1
-                monthly_data[month_index]['revenue'] += payment['amount']
-            except:
-                pass
+    # Próximos 5 eventos
+    upcoming_pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"date": 1}},
+        {"$limit": 5},
+        {"$project": {"_id": 0}},
+    ]
+    
+    stats, monthly_rows, upcoming = await asyncio.gather(
+        get_user_stats(user_id),
+        db.payments.aggregate(monthly_revenue_pipeline).to_list(12),
+        db.events.aggregate(upcoming_pipeline).to_list(5),
+    )
+    
+    monthly_data = [{"month": month, "revenue": 0} for month in MONTH_LABELS]
+    for row in monthly_rows:
+        monthly_data[row['_id'] - 1]['revenue'] = row['revenue']
+    
+    for event in upcoming:
+        if isinstance(event['created_at'], str):
+            event['created_at'] = datetime.fromisoformat(event['created_at'])
     
     return DashboardMetrics(
-        monthly_revenue=monthly_revenue,
-        confirmed_events=confirmed_events,
-        photos_delivered=photos_delivered,
-        pending_payments=pending_payments_total,
+        monthly_revenue=stats['total_revenue'],
+        confirmed_events=stats['confirmed_events'],
+        photos_delivered=stats['photos_delivered'],
+        pending_payments=stats['pending_payments'],
         revenue_trend=12.5,
-        upcoming_events=[Event(**e) for e in sorted_events],
+        upcoming_events=[Event(**e) for e in upcoming],
         monthly_revenue_chart=monthly_data
     )
 
+@api_router.post("/dashboard/stats/rebuild")
+async def rebuild_dashboard_stats(current_user: User = Depends(get_current_user)):
+    """Recalcula os contadores do dashboard do usuário a partir das coleções"""
+    return await rebuild_user_stats(current_user.id)
+
+# ============== INTERNAL METRICS ROUTES ==============
+
+@api_router.get("/internal/user-cache")
+async def get_user_cache_stats(current_user: User = Depends(get_admin_user)):
+    """Contadores de hit/miss do cache de usuários autenticados"""
+    return user_cache.stats()
+
 # ============== BASIC ROUTES ==============
 
 @api_router.get("/")
@@ -448,6 +1030,69 @@ async def root():
 # Include router AFTER CORS middleware
 app.include_router(api_router)
 
+# ============== DATABASE INDEXES ==============
+
+# Um índice para cada formato de query usado nas rotas
+DATABASE_INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id"),
+    ],
+    "clients": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_id"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+    ],
+    "events": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_id"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_status"),
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], name="user_date"),
+    ],
+    "payments": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_id"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+        IndexModel([("event_id", ASCENDING), ("paid", ASCENDING)], name="event_paid"),
+        IndexModel([("user_id", ASCENDING), ("paid", ASCENDING)], name="user_paid"),
+        IndexModel([("settlement_id", ASCENDING)], name="settlement_id", sparse=True),
+    ],
+    "galleries": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_id"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+    ],
+    "event_reminders": [
+        IndexModel([("fire_at", ASCENDING)], name="fire_at"),
+        IndexModel([("event_id", ASCENDING)], name="event_id"),
+    ],
+    "user_stats": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+}
+
+async def ensure_indexes():
+    """Cria (de forma idempotente) os índices usados pelas queries da API"""
+    for collection_name, indexes in DATABASE_INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            logger.warning(f"Não foi possível criar índices em {collection_name}: {e}")
+
+async def print_index_stats():
+    """Mostra quantas vezes cada índice foi usado ($indexStats)"""
+    for collection_name in DATABASE_INDEXES:
+        print(f"📚 {collection_name}")
+        async for stat in db[collection_name].aggregate([{"$indexStats": {}}]):
+            print(f"   {stat['name']:<40} ops={stat['accesses']['ops']:<10} desde {stat['accesses']['since']}")
+
+# ============== LIFECYCLE ==============
+
+@app.on_event("startup")
+async def startup_ensure_indexes():
+    await ensure_indexes()
+
+@app.on_event("shutdown")
+async def shutdown_password_executor():
+    password_executor.shutdown(wait=False)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -456,6 +1101,21 @@ logger = logging.getLogger(__name__)
 
 # Run with uvicorn
 if __name__ == "__main__":
-    import uvicorn
-    port = int(os.environ.get("PORT", 10000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    import sys
+    
+    # python server-corrected.py rebuild-stats [user_id ...]  -> reconcilia db.user_stats
+    # python server-corrected.py index-stats               -> uso dos índices ($indexStats)
+    # python server-corrected.py rebuild-reminders         -> materializa lembretes dos eventos futuros
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "rebuild-stats":
+        total = asyncio.run(rebuild_all_user_stats(sys.argv[2:]))
+        print(f"✅ Contadores reconstruídos para {total} usuário(s)")
+    elif command == "rebuild-reminders":
+        total = asyncio.run(rebuild_all_event_reminders())
+        print(f"✅ Lembretes materializados para {total} evento(s)")
+    elif command == "index-stats":
+        asyncio.run(print_index_stats())
+    else:
+        import uvicorn
+        port = int(os.environ.get("PORT", 10000))
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -3,13 +3,29 @@
 # Cole estas rotas no seu server.py
 # ========================================
 
+import os
+import re
+
 from subscription_models import *
 from subscription_service import SubscriptionService
+from subscription_storage import MongoSubscriptionStorage
 from mercadopago_service import MercadoPagoService
+from webhook_queue import WebhookQueue
 
 # Inicializar serviços
 mp_service = MercadoPagoService()
 
+# Assinaturas e cupons persistidos no MongoDB (mesmo `db` do server.py)
+SubscriptionService.configure(MongoSubscriptionStorage(db))
+
+@app.on_event("startup")
+async def startup_subscription_storage():
+    await SubscriptionService.storage.ensure_indexes()
+
+@app.on_event("shutdown")
+async def shutdown_mercadopago_client():
+    await mp_service.aclose()
+
 # ========================================
 # ROTAS DE ASSINATURA
 # ========================================
@@ -24,14 +40,14 @@ async def get_subscription_status(request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Não autorizado")
     
-    subscription = SubscriptionService.get_subscription(user["id"])
+    subscription = await SubscriptionService.get_subscription(user["id"])
     
     if not subscription:
         # Criar trial automático para novo usuário
-        subscription = SubscriptionService.create_trial(user["id"])
+        subscription = await SubscriptionService.create_trial(user["id"])
     
-    is_active = SubscriptionService.is_subscription_active(user["id"])
-    days_remaining = SubscriptionService.get_days_remaining(user["id"])
+    is_active = await SubscriptionService.is_subscription_active(user["id"])
+    days_remaining = await SubscriptionService.get_days_remaining(user["id"])
     
     return {
         "subscription": subscription,
@@ -58,7 +74,7 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
     
     # Validar cupom se fornecido
     if data.coupon_code:
-        validation = SubscriptionService.validate_coupon(data.coupon_code, user["id"])
+        validation = await SubscriptionService.validate_coupon(data.coupon_code, user["id"])
         
         if not validation["valid"]:
             raise HTTPException(status_code=400, detail=validation["message"])
@@ -76,11 +92,12 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
     
     try:
         # Criar pagamento no Mercado Pago
-        payment_result = mp_service.create_payment(
+        payment_result = await mp_service.create_payment(
             amount=final_price,
             description=f"Fotiva - Assinatura Mensal",
             payer_email=user["email"],
-            payment_method_id=data.payment_method_id
+            payment_method_id=data.payment_method_id,
+            external_reference=user["id"]
         )
         
         if payment_result["status"] != 201:
@@ -90,7 +107,7 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
         
         # Se pagamento aprovado, criar assinatura recorrente
         if payment_data["status"] == "approved":
-            subscription_result = mp_service.create_subscription(
+            subscription_result = await mp_service.create_subscription(
                 user_email=user["email"],
                 plan_price=plan_price,
                 payer_id=payment_data["payer"]["id"],
@@ -104,7 +121,7 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
             
             # Ativar assinatura no sistema
             months_to_add = 1 + free_months
-            subscription = SubscriptionService.activate_subscription(
+            subscription = await SubscriptionService.activate_subscription(
                 user_id=user["id"],
                 plan_id="monthly_19_90",
                 mercadopago_subscription_id=subscription_data["id"],
@@ -113,7 +130,7 @@ async def create_subscription(data: SubscriptionCreate, request: Request):
             
             # Registrar uso do cupom
             if data.coupon_code:
-                SubscriptionService.use_coupon(data.coupon_code, user["id"], discount_applied)
+                await SubscriptionService.use_coupon(data.coupon_code, user["id"], discount_applied)
             
             return {
                 "success": True,
@@ -141,7 +158,7 @@ async def cancel_subscription(data: SubscriptionCancel, request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Não autorizado")
     
-    subscription = SubscriptionService.get_subscription(user["id"])
+    subscription = await SubscriptionService.get_subscription(user["id"])
     
     if not subscription or subscription["status"] != "active":
         raise HTTPException(status_code=400, detail="Nenhuma assinatura ativa encontrada")
@@ -149,10 +166,10 @@ async def cancel_subscription(data: SubscriptionCancel, request: Request):
     try:
         # Cancelar no Mercado Pago
         if subscription.get("mercadopago_subscription_id"):
-            mp_service.cancel_subscription(subscription["mercadopago_subscription_id"])
+            await mp_service.cancel_subscription(subscription["mercadopago_subscription_id"])
         
         # Cancelar no sistema
-        cancelled_subscription = SubscriptionService.cancel_subscription(user["id"], data.reason)
+        cancelled_subscription = await SubscriptionService.cancel_subscription(user["id"], data.reason)
         
         return {
             "success": True,
@@ -182,7 +199,7 @@ async def create_coupon(data: CouponCreate, request: Request):
     #     raise HTTPException(status_code=403, detail="Apenas administradores")
     
     try:
-        coupon = SubscriptionService.create_coupon(
+        coupon = await SubscriptionService.create_coupon(
             code=data.code,
             discount_type=data.discount_type,
             discount_value=data.discount_value,
@@ -211,7 +228,7 @@ async def validate_coupon(data: CouponValidate, request: Request):
     if not user:
         raise HTTPException(status_code=401, detail="Não autorizado")
     
-    validation = SubscriptionService.validate_coupon(data.code, user["id"])
+    validation = await SubscriptionService.validate_coupon(data.code, user["id"])
     
     if validation["valid"]:
         # Calcular quanto seria o desconto
@@ -252,7 +269,7 @@ async def list_coupons(request: Request):
     
     # TODO: Adicionar verificação de admin
     
-    coupons = SubscriptionService.list_coupons()
+    coupons = await SubscriptionService.list_coupons()
     
     return {
         "coupons": coupons,
@@ -271,7 +288,7 @@ async def deactivate_coupon(code: str, request: Request):
     
     # TODO: Adicionar verificação de admin
     
-    coupon = SubscriptionService.deactivate_coupon(code)
+    coupon = await SubscriptionService.deactivate_coupon(code)
     
     if not coupon:
         raise HTTPException(status_code=404, detail="Cupom não encontrado")
@@ -286,47 +303,140 @@ async def deactivate_coupon(code: str, request: Request):
 # WEBHOOK MERCADO PAGO
 # ========================================
 
+async def process_mercadopago_notification(notification: dict):
+    """Processa uma notificação da fila (roda nos workers, fora do request)"""
+    
+    if notification.get("type") != "payment":
+        return
+    
+    payment_id = str(notification["data"]["id"])
+    payment_info = await mp_service.get_payment(payment_id)
+    
+    if payment_info["status"] != 200:
+        # Levanta para a fila tentar de novo (ou mandar para dead-letter)
+        raise RuntimeError(f"Mercado Pago respondeu {payment_info['status']} para o pagamento {payment_id}")
+    
+    payment = payment_info["response"]
+    user_id = payment.get("external_reference")
+    now = datetime.now()
+    
+    await db.subscription_payments.update_one(
+        {"mercadopago_payment_id": payment_id},
+        {
+            "$set": {
+                "user_id": user_id,
+                "amount": payment.get("transaction_amount"),
+                "status": payment.get("status"),
+                "payment_method": payment.get("payment_method_id"),
+                "updated_at": now
+            },
+            "$setOnInsert": {"created_at": now}
+        },
+        upsert=True
+    )
+    
+    if user_id and payment.get("status") == "approved":
+        subscription = await SubscriptionService.get_subscription(user_id)
+        
+        # Pagamento aprovado depois (ex: boleto/pix): ativa a assinatura
+        if not subscription or subscription["status"] != "active":
+            await SubscriptionService.activate_subscription(
+                user_id=user_id,
+                plan_id="monthly_19_90",
+                mercadopago_subscription_id=(subscription or {}).get("mercadopago_subscription_id")
+            )
+    
+    if user_id:
+        # O status da assinatura pode ter mudado: descarta o cache do middleware
+        SubscriptionService.invalidate_status_cache(user_id)
+    
+    print(f"Pagamento processado: {payment_id} - Status: {payment.get('status')}")
+
+webhook_queue = WebhookQueue(
+    db.webhook_queue,
+    process_mercadopago_notification,
+    workers=int(os.getenv('WEBHOOK_WORKERS', 4)),
+    max_attempts=int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 5))
+)
+
+@app.on_event("startup")
+async def startup_webhook_queue():
+    await webhook_queue.ensure_indexes()
+    webhook_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_webhook_queue():
+    await webhook_queue.stop()
+
 @app.post("/api/payments/webhook")
 async def mercadopago_webhook(request: Request):
-    """Webhook para notificações do Mercado Pago"""
+    """
+    Webhook para notificações do Mercado Pago (grava na fila e responde na hora)
+    200 só quando a notificação foi gravada (ou já estava na fila); se a gravação
+    falhar, o 5xx faz o Mercado Pago reenviar
+    """
     
+    # Pings IPN podem vir sem corpo (ou com corpo que não é JSON)
     try:
         data = await request.json()
-        
-        # Processar notificação
-        if data.get("type") == "payment":
-            payment_id = data["data"]["id"]
-            payment_info = mp_service.get_payment(payment_id)
-            
-            # Atualizar status do pagamento no seu sistema
-            # TODO: Implementar lógica de atualização
-            
-            print(f"Pagamento recebido: {payment_id} - Status: {payment_info['status']}")
-        
-        return {"success": True}
-        
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    
+    # Formato novo (corpo JSON) ou IPN (?topic=payment&id=123)
+    notification_type = data.get("type") or request.query_params.get("topic")
+    data_id = (data.get("data") or {}).get("id") or request.query_params.get("id")
+    
+    if not notification_type or not data_id:
+        raise HTTPException(status_code=400, detail="Notificação sem type/data.id")
+    
+    payload = {**data, "type": notification_type, "data": {"id": str(data_id)}}
+    try:
+        queued = await webhook_queue.enqueue(notification_type, str(data_id), payload)
     except Exception as e:
         print(f"Erro no webhook: {str(e)}")
-        return {"success": False, "error": str(e)}
+        raise HTTPException(status_code=503, detail="Não foi possível registrar a notificação")
+    
+    # queued=False: duplicada, já estava na fila
+    return {"success": True, "queued": queued}
+
+@app.get("/api/internal/webhook-queue")
+async def get_webhook_queue_depth(request: Request):
+    """Tamanho da fila de webhooks por status (apenas admin)"""
+    
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+    user = verify_token(token)
+    
+    if not user:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores")
+    
+    return await webhook_queue.depth()
 
 # ========================================
 # MIDDLEWARE DE VERIFICAÇÃO DE ASSINATURA
 # ========================================
 
+# Rotas públicas (não precisam de assinatura)
+PUBLIC_ROUTES = [
+    "/api/auth/login",
+    "/api/auth/register",
+    "/api/subscription/status",
+    "/api/subscription/create",
+    "/api/payments/webhook"
+]
+
+# Um único regex ancorado no início equivale ao startswith de cada rota
+PUBLIC_ROUTES_PATTERN = re.compile("|".join(re.escape(route) for route in PUBLIC_ROUTES))
+
 async def check_subscription(request: Request, call_next):
     """Middleware para verificar se usuário tem assinatura ativa"""
     
-    # Rotas públicas (não precisam de assinatura)
-    public_routes = [
-        "/api/auth/login",
-        "/api/auth/register",
-        "/api/subscription/status",
-        "/api/subscription/create",
-        "/api/payments/webhook"
-    ]
-    
     # Se for rota pública, continua
-    if any(request.url.path.startswith(route) for route in public_routes):
+    if PUBLIC_ROUTES_PATTERN.match(request.url.path):
         return await call_next(request)
     
     # Verificar token
@@ -334,10 +444,10 @@ async def check_subscription(request: Request, call_next):
     user = verify_token(token)
     
     if user:
-        # Verificar se tem assinatura ativa
-        is_active = SubscriptionService.is_subscription_active(user["id"])
+        # Verificar se tem assinatura ativa ("ativa até" em cache por usuário)
+        active_until = await SubscriptionService.get_active_until(user["id"])
         
-        if not is_active:
+        if datetime.now() >= active_until:
             return JSONResponse(
                 status_code=403,
                 content={
@@ -1,17 +1,39 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
+import os
+import time
 import uuid
 
+from subscription_storage import SubscriptionStorage, InMemorySubscriptionStorage
+
 class SubscriptionService:
     """Serviço de gerenciamento de assinaturas"""
     
-    # Simulação de banco de dados (você vai substituir por SQLite/PostgreSQL)
-    subscriptions: Dict[str, Any] = {}
-    coupons: Dict[str, Any] = {}
-    coupon_usage: List[Dict[str, Any]] = []
+    # Backend de armazenamento (MongoSubscriptionStorage em produção)
+    storage: SubscriptionStorage = InMemorySubscriptionStorage()
+    
+    # Cache (LRU) por usuário de "ativa até" usado pelo middleware (valor, expira_em)
+    status_cache: "OrderedDict[str, Tuple[datetime, float]]" = OrderedDict()
+    status_cache_ttl = float(os.getenv('SUBSCRIPTION_STATUS_CACHE_TTL', 300))
+    # Inativos/expirados ficam pouco tempo: um pagamento confirmado em outro worker
+    # libera o acesso sem esperar o TTL cheio
+    status_cache_negative_ttl = float(os.getenv('SUBSCRIPTION_STATUS_NEGATIVE_TTL', 10))
+    status_cache_max_size = int(os.getenv('SUBSCRIPTION_STATUS_CACHE_SIZE', 10000))
+    
+    @staticmethod
+    def configure(storage: SubscriptionStorage) -> None:
+        """
+        Define o backend de armazenamento
+        
+        Args:
+            storage: Instância de SubscriptionStorage
+        """
+        
+        SubscriptionService.storage = storage
     
     @staticmethod
-    def create_trial(user_id: str) -> Dict[str, Any]:
+    async def create_trial(user_id: str) -> Dict[str, Any]:
         """
         Cria período de trial de 30 dias para novo usuário
         
@@ -37,11 +59,12 @@ class SubscriptionService:
             "created_at": now
         }
         
-        SubscriptionService.subscriptions[user_id] = subscription
+        subscription = await SubscriptionService.storage.save_subscription(subscription)
+        SubscriptionService.invalidate_status_cache(user_id)
         return subscription
     
     @staticmethod
-    def get_subscription(user_id: str) -> Optional[Dict[str, Any]]:
+    async def get_subscription(user_id: str) -> Optional[Dict[str, Any]]:
         """
         Busca assinatura do usuário
         
@@ -52,47 +75,100 @@ class SubscriptionService:
             Dados da assinatura ou None
         """
         
-        return SubscriptionService.subscriptions.get(user_id)
+        return await SubscriptionService.storage.get_subscription(user_id)
     
     @staticmethod
-    def is_subscription_active(user_id: str) -> bool:
+    def compute_active_until(subscription: Optional[Dict[str, Any]]) -> datetime:
         """
-        Verifica se a assinatura está ativa
+        Calcula até quando a assinatura dá acesso
         
         Args:
-            user_id: ID do usuário
+            subscription: Dados da assinatura (ou None)
             
         Returns:
-            True se ativa, False caso contrário
+            datetime.max se não expira, datetime.min se inativa
         """
         
-        subscription = SubscriptionService.get_subscription(user_id)
-        
         if not subscription:
-            return False
-        
-        now = datetime.now()
+            return datetime.min
         
         # Trial ativo
         if subscription["status"] == "trial":
             if isinstance(subscription["trial_end"], str):
-                trial_end = datetime.fromisoformat(subscription["trial_end"])
-            else:
-                trial_end = subscription["trial_end"]
-            return now < trial_end
+                return datetime.fromisoformat(subscription["trial_end"])
+            return subscription["trial_end"]
         
         # Assinatura ativa
         if subscription["status"] == "active":
             if isinstance(subscription["subscription_end"], str):
-                sub_end = datetime.fromisoformat(subscription["subscription_end"])
-            else:
-                sub_end = subscription["subscription_end"]
-            return now < sub_end if sub_end else True
+                return datetime.fromisoformat(subscription["subscription_end"])
+            return subscription["subscription_end"] or datetime.max
+        
+        return datetime.min
+    
+    @staticmethod
+    async def get_active_until(user_id: str) -> datetime:
+        """
+        "Ativa até" do usuário, em cache por status_cache_ttl segundos
+        (status_cache_negative_ttl se a assinatura já não está ativa)
+        
+        Args:
+            user_id: ID do usuário
+            
+        Returns:
+            datetime até o qual a assinatura está ativa
+        """
+        
+        cache = SubscriptionService.status_cache
+        cached = cache.get(user_id)
+        if cached and cached[1] > time.monotonic():
+            cache.move_to_end(user_id)
+            return cached[0]
+        
+        subscription = await SubscriptionService.get_subscription(user_id)
+        active_until = SubscriptionService.compute_active_until(subscription)
+        
+        if active_until > datetime.now():
+            ttl = SubscriptionService.status_cache_ttl
+        else:
+            ttl = SubscriptionService.status_cache_negative_ttl
+        
+        if ttl > 0:
+            cache[user_id] = (active_until, time.monotonic() + ttl)
+            cache.move_to_end(user_id)
+            while len(cache) > SubscriptionService.status_cache_max_size:
+                cache.popitem(last=False)
+        else:
+            cache.pop(user_id, None)
+        return active_until
+    
+    @staticmethod
+    def invalidate_status_cache(user_id: str) -> None:
+        """
+        Descarta o "ativa até" em cache (chamar após mudar a assinatura)
+        
+        Args:
+            user_id: ID do usuário
+        """
         
-        return False
+        SubscriptionService.status_cache.pop(user_id, None)
     
     @staticmethod
-    def get_days_remaining(user_id: str) -> Optional[int]:
+    async def is_subscription_active(user_id: str) -> bool:
+        """
+        Verifica se a assinatura está ativa
+        
+        Args:
+            user_id: ID do usuário
+            
+        Returns:
+            True se ativa, False caso contrário
+        """
+        
+        return datetime.now() < await SubscriptionService.get_active_until(user_id)
+    
+    @staticmethod
+    async def get_days_remaining(user_id: str) -> Optional[int]:
         """
         Retorna quantos dias faltam no trial/assinatura
         
@@ -103,7 +179,7 @@ class SubscriptionService:
             Número de dias restantes ou None
         """
         
-        subscription = SubscriptionService.get_subscription(user_id)
+        subscription = await SubscriptionService.get_subscription(user_id)
         
         if not subscription:
             return None
@@ -129,7 +205,7 @@ class SubscriptionService:
         return None
     
     @staticmethod
-    def activate_subscription(
+    async def activate_subscription(
         user_id: str,
         plan_id: str,
         mercadopago_subscription_id: str,
@@ -151,21 +227,23 @@ class SubscriptionService:
         now = datetime.now()
         subscription_end = now + timedelta(days=30 * months)
         
-        subscription = SubscriptionService.subscriptions.get(user_id, {})
-        subscription.update({
-            "plan_id": plan_id,
-            "status": "active",
-            "subscription_start": now,
-            "subscription_end": subscription_end,
-            "mercadopago_subscription_id": mercadopago_subscription_id,
-            "activated_at": now
-        })
-        
-        SubscriptionService.subscriptions[user_id] = subscription
+        subscription = await SubscriptionService.storage.update_subscription(
+            user_id,
+            {
+                "plan_id": plan_id,
+                "status": "active",
+                "subscription_start": now,
+                "subscription_end": subscription_end,
+                "mercadopago_subscription_id": mercadopago_subscription_id,
+                "activated_at": now
+            },
+            upsert=True
+        )
+        SubscriptionService.invalidate_status_cache(user_id)
         return subscription
     
     @staticmethod
-    def cancel_subscription(user_id: str, reason: Optional[str] = None) -> Dict[str, Any]:
+    async def cancel_subscription(user_id: str, reason: Optional[str] = None) -> Dict[str, Any]:
         """
         Cancela assinatura
         
@@ -177,14 +255,13 @@ class SubscriptionService:
             Dados da assinatura cancelada
         """
         
-        subscription = SubscriptionService.subscriptions.get(user_id)
-        
-        if subscription:
-            subscription["status"] = "cancelled"
-            subscription["cancelled_at"] = datetime.now()
-            subscription["cancellation_reason"] = reason
-            subscription["auto_renew"] = False
-        
+        subscription = await SubscriptionService.storage.update_subscription(user_id, {
+            "status": "cancelled",
+            "cancelled_at": datetime.now(),
+            "cancellation_reason": reason,
+            "auto_renew": False
+        })
+        SubscriptionService.invalidate_status_cache(user_id)
         return subscription
     
     # ========================================
@@ -192,7 +269,7 @@ class SubscriptionService:
     # ========================================
     
     @staticmethod
-    def create_coupon(
+    async def create_coupon(
         code: str,
         discount_type: str,
         discount_value: float,
@@ -232,11 +309,10 @@ class SubscriptionService:
             "created_at": datetime.now()
         }
         
-        SubscriptionService.coupons[code] = coupon
-        return coupon
+        return await SubscriptionService.storage.save_coupon(coupon)
     
     @staticmethod
-    def validate_coupon(code: str, user_id: str) -> Dict[str, Any]:
+    async def validate_coupon(code: str, user_id: str) -> Dict[str, Any]:
         """
         Valida um cupom
         
@@ -249,7 +325,7 @@ class SubscriptionService:
         """
         
         code = code.upper()
-        coupon = SubscriptionService.coupons.get(code)
+        coupon = await SubscriptionService.storage.get_coupon(code)
         
         if not coupon:
             return {"valid": False, "message": "Cupom não encontrado"}
@@ -282,7 +358,7 @@ class SubscriptionService:
             return {"valid": False, "message": "Cupom esgotado"}
         
         # Verificar se usuário já usou
-        user_usage = [u for u in SubscriptionService.coupon_usage if u["user_id"] == user_id and u["coupon_code"] == code]
+        user_usage = await SubscriptionService.storage.find_coupon_usage(code, user_id)
         if user_usage:
             return {"valid": False, "message": "Você já usou este cupom"}
         
@@ -294,7 +370,7 @@ class SubscriptionService:
         }
     
     @staticmethod
-    def use_coupon(code: str, user_id: str, discount_applied: float) -> None:
+    async def use_coupon(code: str, user_id: str, discount_applied: float) -> bool:
         """
         Registra uso de cupom
         
@@ -302,23 +378,33 @@ class SubscriptionService:
             code: Código do cupom
             user_id: ID do usuário
             discount_applied: Desconto aplicado em reais
+            
+        Returns:
+            True se o uso foi registrado, False se o cupom não existe,
+            esgotou ou já foi usado pelo usuário
         """
         
         code = code.upper()
-        coupon = SubscriptionService.coupons.get(code)
         
-        if coupon:
-            coupon["current_uses"] += 1
-            
-            SubscriptionService.coupon_usage.append({
-                "coupon_code": code,
-                "user_id": user_id,
-                "discount_applied": discount_applied,
-                "used_at": datetime.now()
-            })
+        # Reserva (cupom, usuário) primeiro: o índice único impede uso duplo concorrente
+        registered = await SubscriptionService.storage.add_coupon_usage({
+            "coupon_code": code,
+            "user_id": user_id,
+            "discount_applied": discount_applied,
+            "used_at": datetime.now()
+        })
+        if not registered:
+            return False
+        
+        coupon = await SubscriptionService.storage.increment_coupon_uses(code)
+        if not coupon:
+            await SubscriptionService.storage.remove_coupon_usage(code, user_id)
+            return False
+        
+        return True
     
     @staticmethod
-    def list_coupons() -> List[Dict[str, Any]]:
+    async def list_coupons() -> List[Dict[str, Any]]:
         """
         Lista todos os cupons
         
@@ -326,10 +412,10 @@ class SubscriptionService:
             Lista de cupons
         """
         
-        return list(SubscriptionService.coupons.values())
+        return await SubscriptionService.storage.list_coupons()
     
     @staticmethod
-    def deactivate_coupon(code: str) -> Dict[str, Any]:
+    async def deactivate_coupon(code: str) -> Dict[str, Any]:
         """
         Desativa um cupom
         
@@ -341,9 +427,4 @@ class SubscriptionService:
         """
         
         code = code.upper()
-        coupon = SubscriptionService.coupons.get(code)
-        
-        if coupon:
-            coupon["is_active"] = False
-        
-        return coupon
+        return await SubscriptionService.storage.update_coupon(code, {"is_active": False})
@@ -0,0 +1,256 @@
+"""
+Armazenamento de assinaturas e cupons - Fotiva
+Backends plugáveis do SubscriptionService: MongoDB (produção) e memória (testes)
+"""
+
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, List, Tuple
+
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class SubscriptionStorage(ABC):
+    """Interface assíncrona de armazenamento usada pelo SubscriptionService"""
+
+    async def ensure_indexes(self) -> None:
+        """Cria os índices necessários (no-op para backends sem índice)"""
+
+    # ---------- Assinaturas ----------
+
+    @abstractmethod
+    async def get_subscription(self, user_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def save_subscription(self, subscription: Dict[str, Any]) -> Dict[str, Any]:
+        """Cria ou substitui a assinatura de subscription["user_id"]"""
+
+    @abstractmethod
+    async def update_subscription(
+        self,
+        user_id: str,
+        fields: Dict[str, Any],
+        upsert: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """Atualiza campos da assinatura e retorna o documento atualizado"""
+
+    # ---------- Cupons ----------
+
+    @abstractmethod
+    async def get_coupon(self, code: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def save_coupon(self, coupon: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def update_coupon(self, code: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def list_coupons(self) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def increment_coupon_uses(self, code: str) -> Optional[Dict[str, Any]]:
+        """
+        Incrementa current_uses de forma atômica, respeitando max_uses
+
+        Returns:
+            Cupom atualizado, ou None se não existir ou estiver esgotado
+        """
+
+    # ---------- Uso de cupons ----------
+
+    @abstractmethod
+    async def add_coupon_usage(self, usage: Dict[str, Any]) -> bool:
+        """
+        Registra o uso do cupom pelo usuário
+
+        Returns:
+            False se o usuário já tinha usado este cupom
+        """
+
+    @abstractmethod
+    async def remove_coupon_usage(self, code: str, user_id: str) -> None:
+        ...
+
+    @abstractmethod
+    async def find_coupon_usage(self, code: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Busca o uso por (coupon_code, user_id) em tempo constante"""
+
+
+class InMemorySubscriptionStorage(SubscriptionStorage):
+    """Armazenamento em memória (um processo só) - usado em testes e desenvolvimento"""
+
+    def __init__(self):
+        self.subscriptions: Dict[str, Any] = {}
+        self.coupons: Dict[str, Any] = {}
+        # Índice (coupon_code, user_id) -> uso, para consultas O(1)
+        self.coupon_usage: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    async def get_subscription(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self.subscriptions.get(user_id)
+
+    async def save_subscription(self, subscription: Dict[str, Any]) -> Dict[str, Any]:
+        self.subscriptions[subscription["user_id"]] = subscription
+        return subscription
+
+    async def update_subscription(
+        self,
+        user_id: str,
+        fields: Dict[str, Any],
+        upsert: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        subscription = self.subscriptions.get(user_id)
+
+        if subscription is None:
+            if not upsert:
+                return None
+            subscription = self.subscriptions[user_id] = {"user_id": user_id}
+
+        subscription.update(fields)
+        return subscription
+
+    async def get_coupon(self, code: str) -> Optional[Dict[str, Any]]:
+        return self.coupons.get(code)
+
+    async def save_coupon(self, coupon: Dict[str, Any]) -> Dict[str, Any]:
+        self.coupons[coupon["code"]] = coupon
+        return coupon
+
+    async def update_coupon(self, code: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        coupon = self.coupons.get(code)
+        if coupon is not None:
+            coupon.update(fields)
+        return coupon
+
+    async def list_coupons(self) -> List[Dict[str, Any]]:
+        return list(self.coupons.values())
+
+    async def increment_coupon_uses(self, code: str) -> Optional[Dict[str, Any]]:
+        coupon = self.coupons.get(code)
+
+        if coupon is None:
+            return None
+        if coupon["max_uses"] and coupon["current_uses"] >= coupon["max_uses"]:
+            return None
+
+        coupon["current_uses"] += 1
+        return coupon
+
+    async def add_coupon_usage(self, usage: Dict[str, Any]) -> bool:
+        key = (usage["coupon_code"], usage["user_id"])
+        if key in self.coupon_usage:
+            return False
+        self.coupon_usage[key] = usage
+        return True
+
+    async def remove_coupon_usage(self, code: str, user_id: str) -> None:
+        self.coupon_usage.pop((code, user_id), None)
+
+    async def find_coupon_usage(self, code: str, user_id: str) -> Optional[Dict[str, Any]]:
+        return self.coupon_usage.get((code, user_id))
+
+
+class MongoSubscriptionStorage(SubscriptionStorage):
+    """Armazenamento no MongoDB (compartilhado entre workers e servidores)"""
+
+    def __init__(self, db):
+        self.subscriptions = db.subscriptions
+        self.coupons = db.coupons
+        self.coupon_usage = db.coupon_usage
+
+    async def ensure_indexes(self) -> None:
+        await self.subscriptions.create_indexes([
+            IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        ])
+        await self.coupons.create_indexes([
+            IndexModel([("code", ASCENDING)], name="code_unique", unique=True),
+        ])
+        await self.coupon_usage.create_indexes([
+            # Um uso por usuário: também atende as consultas só por coupon_code
+            IndexModel(
+                [("coupon_code", ASCENDING), ("user_id", ASCENDING)],
+                name="coupon_code_user_id_unique",
+                unique=True
+            ),
+            IndexModel([("user_id", ASCENDING)], name="user_id"),
+        ])
+
+    async def get_subscription(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.subscriptions.find_one({"user_id": user_id}, {"_id": 0})
+
+    async def save_subscription(self, subscription: Dict[str, Any]) -> Dict[str, Any]:
+        await self.subscriptions.replace_one(
+            {"user_id": subscription["user_id"]},
+            dict(subscription),
+            upsert=True
+        )
+        return subscription
+
+    async def update_subscription(
+        self,
+        user_id: str,
+        fields: Dict[str, Any],
+        upsert: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        return await self.subscriptions.find_one_and_update(
+            {"user_id": user_id},
+            {"$set": fields},
+            projection={"_id": 0},
+            upsert=upsert,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def get_coupon(self, code: str) -> Optional[Dict[str, Any]]:
+        return await self.coupons.find_one({"code": code}, {"_id": 0})
+
+    async def save_coupon(self, coupon: Dict[str, Any]) -> Dict[str, Any]:
+        await self.coupons.replace_one({"code": coupon["code"]}, dict(coupon), upsert=True)
+        return coupon
+
+    async def update_coupon(self, code: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await self.coupons.find_one_and_update(
+            {"code": code},
+            {"$set": fields},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def list_coupons(self) -> List[Dict[str, Any]]:
+        return await self.coupons.find({}, {"_id": 0}).to_list(None)
+
+    async def increment_coupon_uses(self, code: str) -> Optional[Dict[str, Any]]:
+        # O filtro garante que dois workers não ultrapassem max_uses
+        return await self.coupons.find_one_and_update(
+            {
+                "code": code,
+                "$or": [
+                    {"max_uses": None},
+                    {"max_uses": 0},
+                    {"$expr": {"$lt": ["$current_uses", "$max_uses"]}},
+                ],
+            },
+            {"$inc": {"current_uses": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def add_coupon_usage(self, usage: Dict[str, Any]) -> bool:
+        try:
+            await self.coupon_usage.insert_one(dict(usage))
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def remove_coupon_usage(self, code: str, user_id: str) -> None:
+        await self.coupon_usage.delete_one({"coupon_code": code, "user_id": user_id})
+
+    async def find_coupon_usage(self, code: str, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.coupon_usage.find_one(
+            {"coupon_code": code, "user_id": user_id},
+            {"_id": 0}
+        )
@@ -0,0 +1,211 @@
+"""
+Fila durável de webhooks - Fotiva
+O endpoint só grava a notificação e responde; workers em background processam
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookQueue:
+    """Fila de notificações no MongoDB com deduplicação, retentativas e dead-letter"""
+
+    def __init__(
+        self,
+        collection,
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        workers: int = 4,
+        max_attempts: int = 5,
+        retry_backoff: float = 30,
+        lease_seconds: float = 120,
+        poll_interval: float = 5
+    ):
+        """
+        Args:
+            collection: Coleção do Motor onde os itens ficam gravados
+            handler: Coroutine que processa o payload da notificação
+            workers: Quantos itens processar ao mesmo tempo
+            max_attempts: Tentativas antes de mandar o item para "dead"
+            retry_backoff: Espera base (s) entre tentativas, dobrando a cada falha
+            lease_seconds: Tempo até um item "processing" abandonado voltar para a fila
+            poll_interval: Intervalo (s) de consulta quando a fila está vazia
+        """
+        self.collection = collection
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_indexes([
+            # Um item por (type, data.id): retentativas do Mercado Pago não duplicam a fila,
+            # e uma notificação nova do mesmo pagamento reabre o item (ver enqueue)
+            IndexModel([("type", ASCENDING), ("data_id", ASCENDING)], name="type_data_id_unique", unique=True),
+            IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt"),
+        ])
+
+    async def enqueue(self, notification_type: str, data_id: str, payload: Dict[str, Any]) -> bool:
+        """
+        Grava a notificação para processamento
+
+        A deduplicação vale só enquanto o item está na fila: o Mercado Pago manda
+        payment.created e depois payment.updated com o mesmo data.id, e o segundo
+        precisa buscar o pagamento de novo (ex: boleto/pix aprovado depois)
+
+        Returns:
+            False se a mesma notificação já estava na fila aguardando (duplicada)
+        """
+        now = datetime.now(timezone.utc)
+        key = {"type": notification_type, "data_id": data_id}
+        try:
+            await self.collection.insert_one({
+                **key,
+                "payload": payload,
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": now,
+                "created_at": now,
+            })
+        except DuplicateKeyError:
+            if not await self._reopen(key, payload, now):
+                return False
+
+        self._wakeup.set()
+        return True
+
+    async def _reopen(self, key: Dict[str, Any], payload: Dict[str, Any], now: datetime) -> bool:
+        """
+        Item já existente: volta para "pending" se já foi processado (ou morreu), ou é
+        marcado para rodar de novo se está em processamento (a leitura pode ser anterior)
+
+        Returns:
+            False se o item ainda está pendente (a próxima execução já verá o estado novo)
+        """
+        # O status pode mudar entre as consultas (worker concluindo): tenta de novo
+        for _ in range(3):
+            reopened = await self.collection.find_one_and_update(
+                {**key, "status": {"$in": ["processed", "dead"]}},
+                {
+                    "$set": {"payload": payload, "status": "pending", "attempts": 0, "next_attempt_at": now},
+                    "$unset": {"processed_at": "", "last_error": "", "rerun": ""},
+                }
+            )
+            if reopened is not None:
+                return True
+
+            running = await self.collection.update_one(
+                {**key, "status": "processing"},
+                {"$set": {"payload": payload, "rerun": True}}
+            )
+            if running.matched_count:
+                return True
+
+            if await self.collection.count_documents({**key, "status": "pending"}):
+                return False
+
+        return False
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        """Reserva o próximo item pronto (ou com lease expirado) para este worker"""
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending", "next_attempt_at": {"$lte": now}},
+                    {"status": "processing", "locked_until": {"$lte": now}},
+                ]
+            },
+            {
+                "$set": {"status": "processing", "locked_until": now + timedelta(seconds=self.lease_seconds)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def process(self, item: Dict[str, Any]) -> None:
+        try:
+            await self.handler(item["payload"])
+        except Exception as e:
+            if item["attempts"] >= self.max_attempts:
+                status, next_attempt_at = "dead", None
+                logger.error(f"❌ Webhook {item['type']}/{item['data_id']} foi para dead-letter: {e}")
+            else:
+                status = "pending"
+                delay = self.retry_backoff * 2 ** (item["attempts"] - 1)
+                next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+                logger.warning(f"⚠️ Webhook {item['type']}/{item['data_id']} falhou, nova tentativa em {delay:.0f}s: {e}")
+
+            await self.collection.update_one(
+                {"_id": item["_id"]},
+                {
+                    "$set": {"status": status, "next_attempt_at": next_attempt_at, "last_error": str(e)},
+                    "$unset": {"locked_until": ""},
+                }
+            )
+            return
+
+        now = datetime.now(timezone.utc)
+        done = await self.collection.update_one(
+            {"_id": item["_id"], "rerun": {"$ne": True}},
+            {
+                "$set": {"status": "processed", "processed_at": now},
+                "$unset": {"locked_until": ""},
+            }
+        )
+        if not done.matched_count:
+            # Notificação nova chegou durante o processamento: roda de novo
+            await self.collection.update_one(
+                {"_id": item["_id"]},
+                {
+                    "$set": {"status": "pending", "attempts": 0, "next_attempt_at": now},
+                    "$unset": {"locked_until": "", "rerun": ""},
+                }
+            )
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                item = await self.claim()
+            except Exception as e:
+                logger.error(f"❌ Erro ao ler a fila de webhooks: {e}")
+                item = None
+
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self.process(item)
+
+    def start(self) -> None:
+        """Inicia os workers no event loop atual"""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def depth(self) -> Dict[str, int]:
+        """Quantidade de itens por status (pending, processing, processed, dead)"""
+        counts = {"pending": 0, "processing": 0, "processed": 0, "dead": 0}
+        async for row in self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        return counts
@@ -0,0 +1,177 @@
+"""
+Canal de WhatsApp (Twilio) - Fotiva
+Um único Client do Twilio, envio em pool de threads limitado e rate limit por número remetente
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# DDI usado quando o número vem sem "+" (cadastros brasileiros)
+DEFAULT_COUNTRY_CODE = "55"
+
+# DDDs existentes no Brasil (número sem "+" fora desta lista não é tratado como brasileiro)
+BRAZIL_AREA_CODES = frozenset(
+    "11 12 13 14 15 16 17 18 19 21 22 24 27 28 31 32 33 34 35 37 38 41 42 43 44 45 46 47 48 49 "
+    "51 53 54 55 61 62 63 64 65 66 67 68 69 71 73 74 75 77 79 81 82 83 84 85 86 87 88 89 "
+    "91 92 93 94 95 96 97 98 99".split()
+)
+
+
+def is_brazilian_number(digits: str) -> bool:
+    """DDD + celular (9 + 8 dígitos) ou DDD + fixo (2-5 + 7 dígitos)"""
+    if digits[:2] not in BRAZIL_AREA_CODES:
+        return False
+    if len(digits) == 11:
+        return digits[2] == "9"
+    return len(digits) == 10 and digits[2] in "2345"
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """
+    Converte o telefone para E.164 (ex: "(11) 98765-4321" -> "+5511987654321")
+    
+    Sem "+" o número só é aceito se for brasileiro (DDD válido, com ou sem 55);
+    estrangeiros precisam vir com "+DDI". None quando não dá para normalizar.
+    Aplicado no cadastro pelos servers; no envio é só uma salvaguarda (no-op em E.164)
+    """
+    if not phone:
+        return None
+
+    # TWILIO_WHATSAPP_FROM vem no formato do Twilio ("whatsapp:+14155238886")
+    phone = phone.strip()
+    if phone.startswith("whatsapp:"):
+        phone = phone[len("whatsapp:"):].strip()
+
+    digits = re.sub(r"\D", "", phone)
+    if not digits:
+        return None
+
+    if phone.startswith("+"):
+        # E.164: DDI + número, no máximo 15 dígitos
+        return "+" + digits if 8 <= len(digits) <= 15 else None
+
+    # Prefixo de operadora/DDD com zero à esquerda (ex: 011...)
+    digits = digits.lstrip("0")
+    if digits.startswith(DEFAULT_COUNTRY_CODE) and is_brazilian_number(digits[len(DEFAULT_COUNTRY_CODE):]):
+        return "+" + digits
+    if is_brazilian_number(digits):
+        return "+" + DEFAULT_COUNTRY_CODE + digits
+
+    return None
+
+
+class TokenBucket:
+    """Rate limit assíncrono: até `rate` envios por segundo, com rajada de `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class WhatsAppChannel:
+    """Envio de WhatsApp pelo Twilio sem bloquear o event loop"""
+
+    def __init__(
+        self,
+        account_sid: str,
+        auth_token: str,
+        from_number: str,
+        rate: float = 80,
+        workers: int = 8,
+        base_url: Optional[str] = None
+    ):
+        """
+        Args:
+            account_sid / auth_token: Credenciais do Twilio
+            from_number: Número remetente do WhatsApp (E.164)
+            rate: Mensagens por segundo permitidas para o remetente
+            workers: Chamadas simultâneas à API do Twilio
+            base_url: URL da API (servidor stub local nos testes)
+        """
+        from twilio.rest import Client
+
+        self.client = Client(account_sid, auth_token)
+        if base_url:
+            self.client.api.base_url = base_url.rstrip("/")
+
+        self.from_whatsapp = f"whatsapp:{normalize_phone(from_number)}"
+        self.bucket = TokenBucket(rate, capacity=max(1, rate))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whatsapp")
+        self.sent = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["WhatsAppChannel"]:
+        """Canal configurado pelo .env, ou None se faltar credencial do Twilio"""
+        account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+        auth_token = os.getenv('TWILIO_AUTH_TOKEN')
+        from_whatsapp = os.getenv('TWILIO_WHATSAPP_FROM')
+
+        if not all([account_sid, auth_token, from_whatsapp]):
+            logger.error("❌ Credenciais do Twilio não configuradas")
+            return None
+
+        return cls(
+            account_sid,
+            auth_token,
+            from_whatsapp,
+            rate=float(os.getenv('WHATSAPP_RATE_PER_SECOND', 80)),
+            workers=int(os.getenv('WHATSAPP_WORKERS', 8)),
+            base_url=os.getenv('TWILIO_API_URL')
+        )
+
+    def _create(self, phone: str, message: str) -> str:
+        return self.client.messages.create(
+            from_=self.from_whatsapp,
+            to=f"whatsapp:{phone}",
+            body=message
+        ).sid
+
+    async def send(self, phone: str, message: str) -> Dict[str, Any]:
+        """Envia a mensagem respeitando o rate limit do remetente"""
+
+        phone = normalize_phone(phone)
+        if not phone:
+            self.failed += 1
+            return {"status": "error", "error": "Telefone inválido"}
+
+        await self.bucket.acquire()
+
+        try:
+            loop = asyncio.get_running_loop()
+            sid = await loop.run_in_executor(self.executor, self._create, phone, message)
+        except Exception as e:
+            self.failed += 1
+            return {"status": "error", "error": str(e)}
+
+        self.sent += 1
+        return {"status": "success", "sid": sid}
+
+    async def aclose(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"sent": self.sent, "failed": self.failed}
@@ -1,31 +1,65 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
 import os
+import asyncio
+import base64
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import uuid
-from datetime import datetime, timezone, timedelta
+import calendar
+import time
+from datetime import date, datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import random
 import string
+import sys
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Módulos de entrega (push, outbox, WhatsApp) são os mesmos do scheduler, em backend/;
+# trazem junto as dependências deles (requests, pywebpush, py-vapid, twilio), listadas
+# em backend/requirements_add.txt
+BACKEND_DIR = Path(os.environ.get('BACKEND_DIR', ROOT_DIR.parents[2] / 'backend')).resolve()
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from notification_outbox import outbox_lag
+from push_delivery import PushDelivery
+from whatsapp_channel import normalize_phone
+
 # Security
 SECRET_KEY = os.environ['SECRET_KEY']
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Pool dedicado para bcrypt (o hash leva ~100-300 ms e não pode rodar no event loop)
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', 64))
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+password_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+# Cache de usuários autenticados (evita um find_one em db.users a cada request)
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 1024))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
@@ -67,6 +101,8 @@ class User(BaseModel):
     name: str
     brand_name: Optional[str] = None
     profile_photo: Optional[str] = None
+    role: str = "user"  # "admin" é definido direto no banco
+    phone: Optional[str] = None  # E.164, usado nos lembretes por WhatsApp
     push_subscription: Optional[dict] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -75,6 +111,7 @@ class UserCreate(BaseModel):
     password: str
     name: str
     brand_name: Optional[str] = None
+    phone: Optional[str] = None
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -143,6 +180,15 @@ class PaymentCreate(BaseModel):
     amount: float
     due_date: str
 
+class PaymentSettleRequest(BaseModel):
+    payment_ids: List[str]
+
+class InstallmentPlanCreate(BaseModel):
+    installments: int
+    first_due_date: str  # formato: 2025-02-06
+    schedule: str = "monthly"  # monthly, weekly, biweekly
+    total_amount: Optional[float] = None  # padrão: valor total do evento - valor já pago
+
 class Gallery(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -203,6 +249,60 @@ class MercadoPagoWebhook(BaseModel):
     user_id: str
 
 
+# ============== AUTH CACHE ==============
+
+class UserCache:
+    """Cache LRU com TTL dos usuários autenticados, indexado por email"""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, email: str) -> Optional[User]:
+        entry = self._entries.get(email)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del self._entries[email]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(email)
+        self.hits += 1
+        return user
+
+    def set(self, email: str, user: User) -> None:
+        self._entries[email] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(email)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, email: str) -> None:
+        """Remove o usuário do cache (chamar após qualquer escrita em db.users)"""
+        self._entries.pop(email, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+user_cache = UserCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+
 # ============== AUTH FUNCTIONS ==============
 
 def verify_password(plain_password, hashed_password):
@@ -225,6 +325,24 @@ def get_password_hash(password):
     
     return pwd_context.hash(password)
 
+async def run_password_task(func, *args):
+    """Executa verify/hash no pool do bcrypt, recusando quando a fila está cheia"""
+    if password_slots.locked():
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, tente novamente em instantes",
+            headers={"Retry-After": "1"},
+        )
+    async with password_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_executor, func, *args)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await run_password_task(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await run_password_task(get_password_hash, password)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -246,14 +364,380 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    user_doc = await db.users.find_one({"email": email}, {"_id": 0})
+    cached_user = user_cache.get(email)
+    if cached_user is not None:
+        return cached_user
+    
+    user_doc = await db.users.find_one({"email": email}, {"_id": 0, "password_hash": 0})
     if user_doc is None:
         raise credentials_exception
     
     if isinstance(user_doc.get('created_at'), str):
         user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
     
-    return User(**user_doc)
+    user = User(**user_doc)
+    user_cache.set(email, user)
+    return user
+
+async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """Rotas internas/administrativas: apenas usuários com role "admin" no banco"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas administradores")
+    return current_user
+
+def validate_phone(phone: Optional[str]) -> Optional[str]:
+    """Telefone gravado já em E.164 (o canal de WhatsApp usa o valor como está); 400 se inválido"""
+    if not phone:
+        return None
+    normalized = normalize_phone(phone)
+    if not normalized:
+        raise HTTPException(
+            status_code=400,
+            detail="Telefone inválido: use DDD + número ou +DDI para números estrangeiros"
+        )
+    return normalized
+
+# ============== DASHBOARD COUNTERS ==============
+
+# Contadores do dashboard mantidos em db.user_stats (um documento por usuário)
+USER_STATS_FIELDS = (
+    "total_clients",
+    "total_events",
+    "confirmed_events",
+    "total_revenue",
+    "pending_payments",
+    "photos_delivered",
+)
+
+# Definição única de pagamento pendente para contadores, rebuild e baixas:
+# pago é paid == True; todo o resto (False ou documento sem o campo) é pendente
+PAYMENT_PAID_EXPR = {"$eq": ["$paid", True]}
+PAYMENT_PENDING_FILTER = {"paid": {"$ne": True}}
+
+async def aggregate_one(collection, pipeline: list) -> dict:
+    """Roda um pipeline que agrega em um único documento (ou {} se não houver dados)"""
+    result = await collection.aggregate(pipeline).to_list(1)
+    return result[0] if result else {}
+
+async def bump_user_stats(user_id: str, session=None, **deltas):
+    """Aplica um $inc atômico nos contadores do usuário"""
+    inc = {field: value for field, value in deltas.items() if value}
+    if not inc:
+        return
+    # Sem upsert: se o documento não existir, a próxima leitura reconstrói tudo
+    await db.user_stats.update_one(
+        {"user_id": user_id},
+        {"$inc": inc, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        session=session
+    )
+
+async def rebuild_user_stats(user_id: str) -> dict:
+    """Recalcula os contadores a partir das coleções (corrige qualquer drift)"""
+    payment_totals_pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$group": {
+            "_id": None,
+            "paid": {"$sum": {"$cond": [PAYMENT_PAID_EXPR, "$amount", 0]}},
+            "pending": {"$sum": {"$cond": [PAYMENT_PAID_EXPR, 0, "$amount"]}},
+        }},
+    ]
+    photos_pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": None, "photos": {"$sum": "$photos_count"}}},
+    ]
+    
+    total_clients, total_events, confirmed_events, payment_totals, photos = await asyncio.gather(
+        db.clients.count_documents({"user_id": user_id}),
+        db.events.count_documents({"user_id": user_id}),
+        db.events.count_documents({"user_id": user_id, "status": "confirmado"}),
+        aggregate_one(db.payments, payment_totals_pipeline),
+        aggregate_one(db.galleries, photos_pipeline),
+    )
+    
+    stats = {
+        "user_id": user_id,
+        "total_clients": total_clients,
+        "total_events": total_events,
+        "confirmed_events": confirmed_events,
+        "total_revenue": payment_totals.get('paid', 0),
+        "pending_payments": payment_totals.get('pending', 0),
+        "photos_delivered": photos.get('photos', 0),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    await db.user_stats.update_one({"user_id": user_id}, {"$set": stats}, upsert=True)
+    return stats
+
+async def get_user_stats(user_id: str) -> dict:
+    stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0})
+    if stats is None:
+        stats = await rebuild_user_stats(user_id)
+    return stats
+
+async def rebuild_all_user_stats(user_ids: Optional[List[str]] = None) -> int:
+    """Reconstrói os contadores de todos os usuários (ou apenas dos informados)"""
+    if not user_ids:
+        user_ids = [u['id'] async for u in db.users.find({}, {"_id": 0, "id": 1})]
+    for user_id in user_ids:
+        await rebuild_user_stats(user_id)
+    return len(user_ids)
+
+# ============== PAGINATION ==============
+
+# Tamanho máximo de página das listagens (/clients, /events, /payments, /galleries)
+LIST_PAGE_MAX = 1000
+STREAM_BATCH_SIZE = 200
+
+def encode_cursor(doc: dict) -> str:
+    """Cursor opaco com a chave (created_at, id) do último item da página"""
+    created_at = doc['created_at']
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+    return base64.urlsafe_b64encode(f"{created_at}|{doc['id']}".encode()).decode()
+
+def decode_cursor(after: str) -> dict:
+    """Converte o cursor em um filtro keyset: itens estritamente depois de (created_at, id)"""
+    try:
+        created_at, doc_id = base64.urlsafe_b64decode(after.encode()).decode().split('|', 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return {
+        "$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": doc_id}},
+        ]
+    }
+
+async def stream_ndjson(cursor, model):
+    """Serializa um cursor do Motor linha a linha, sem materializar a lista"""
+    async for doc in cursor:
+        yield model(**doc).model_dump_json() + "\n"
+
+async def list_user_documents(
+    collection,
+    model,
+    user_id: str,
+    response: Response,
+    limit: Optional[int],
+    after: Optional[str],
+    stream: bool
+):
+    """
+    Listagem paginada por keyset em (created_at, id).
+    
+    O próximo cursor vai no header X-Next-Cursor; com stream=true a resposta
+    é NDJSON lida direto do cursor.
+    """
+    query = {"user_id": user_id}
+    if after:
+        query.update(decode_cursor(after))
+    
+    cursor = collection.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)])
+    
+    if stream:
+        if limit:
+            cursor = cursor.limit(limit)
+        return StreamingResponse(
+            stream_ndjson(cursor.batch_size(STREAM_BATCH_SIZE), model),
+            media_type="application/x-ndjson"
+        )
+    
+    page_size = limit or LIST_PAGE_MAX
+    docs = await cursor.limit(page_size + 1).to_list(page_size + 1)
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    return docs
+
+# ============== PAYMENT SETTLEMENT ==============
+
+# Baixa de parcelas em transação (exige MongoDB em replica set)
+MONGO_TRANSACTIONS = os.environ.get('MONGO_TRANSACTIONS', 'false').lower() == 'true'
+SETTLE_MANY_MAX = 500
+
+async def run_settlement(func, *args):
+    """Executa a baixa dentro de uma transação quando MONGO_TRANSACTIONS=true"""
+    if not MONGO_TRANSACTIONS:
+        return await func(*args)
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            return await func(*args, session=session)
+
+async def apply_settlements(user_id: str, settled: List[dict], session=None):
+    """Soma as parcelas baixadas no amount_paid dos eventos e nos contadores"""
+    per_event = {}
+    for payment in settled:
+        per_event[payment['event_id']] = per_event.get(payment['event_id'], 0) + payment['amount']
+    if not per_event:
+        return
+    
+    await db.events.bulk_write(
+        [
+            UpdateOne({"id": event_id, "user_id": user_id}, {"$inc": {"amount_paid": amount}})
+            for event_id, amount in per_event.items()
+        ],
+        ordered=False,
+        session=session
+    )
+    total = sum(per_event.values())
+    await bump_user_stats(user_id, session=session, total_revenue=total, pending_payments=-total)
+
+async def settle_payment(user_id: str, payment_id: str, session=None) -> Optional[dict]:
+    """Marca uma parcela como paga só se ainda estiver pendente; None se nada mudou"""
+    payment = await db.payments.find_one_and_update(
+        {"id": payment_id, "user_id": user_id, **PAYMENT_PENDING_FILTER},
+        {"$set": {"paid": True, "paid_date": datetime.now(timezone.utc).strftime("%Y-%m-%d")}},
+        projection={"_id": 0, "id": 1, "event_id": 1, "amount": 1},
+        session=session
+    )
+    if payment is not None:
+        await apply_settlements(user_id, [payment], session)
+    return payment
+
+async def settle_many_payments(user_id: str, payment_ids: List[str], session=None) -> List[dict]:
+    """Baixa várias parcelas com um update_many; o settlement_id identifica quais mudaram"""
+    settlement_id = str(uuid.uuid4())
+    await db.payments.update_many(
+        {"id": {"$in": payment_ids}, "user_id": user_id, **PAYMENT_PENDING_FILTER},
+        {"$set": {
+            "paid": True,
+            "paid_date": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+            "settlement_id": settlement_id
+        }},
+        session=session
+    )
+    settled = await db.payments.find(
+        {"settlement_id": settlement_id},
+        {"_id": 0, "id": 1, "event_id": 1, "amount": 1},
+        session=session
+    ).to_list(len(payment_ids))
+    await apply_settlements(user_id, settled, session)
+    return settled
+
+# ============== INSTALLMENT PLANS ==============
+
+# Intervalo entre parcelas (em dias) para as regras que não são mensais
+INSTALLMENT_INTERVAL_DAYS = {"weekly": 7, "biweekly": 14}
+INSTALLMENT_SCHEDULES = ("monthly", *INSTALLMENT_INTERVAL_DAYS)
+INSTALLMENTS_MAX = 60
+
+def add_months(value: date, months: int) -> date:
+    """Soma meses mantendo o dia (ou o último dia do mês, ex: 31/01 -> 28/02)"""
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+def build_installment_schedule(total_amount: float, installments: int, first_due_date: str, schedule: str) -> List[tuple]:
+    """
+    Divide o total em parcelas (em centavos, a última absorve o resto)
+    e calcula o vencimento de cada uma. Retorna [(due_date, amount), ...]
+    """
+    if schedule not in INSTALLMENT_SCHEDULES:
+        raise HTTPException(status_code=400, detail=f"Regra de vencimento inválida. Use: {', '.join(INSTALLMENT_SCHEDULES)}")
+    if not 1 <= installments <= INSTALLMENTS_MAX:
+        raise HTTPException(status_code=400, detail=f"Número de parcelas deve ser entre 1 e {INSTALLMENTS_MAX}")
+    if total_amount <= 0:
+        raise HTTPException(status_code=400, detail="Valor total deve ser maior que zero")
+    try:
+        first_due = date.fromisoformat(first_due_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data do primeiro vencimento inválida (use AAAA-MM-DD)")
+    
+    total_cents = round(total_amount * 100)
+    base_cents, remainder_cents = divmod(total_cents, installments)
+    
+    schedule_rows = []
+    for index in range(installments):
+        if schedule == "monthly":
+            due_date = add_months(first_due, index)
+        else:
+            due_date = first_due + timedelta(days=INSTALLMENT_INTERVAL_DAYS[schedule] * index)
+        cents = base_cents + (remainder_cents if index == installments - 1 else 0)
+        schedule_rows.append((due_date.isoformat(), cents / 100))
+    return schedule_rows
+
+def build_installment_payments(user_id: str, event: dict, plan: "InstallmentPlanCreate") -> List[Payment]:
+    """Valida o plano e monta as parcelas do evento, sem gravar nada"""
+    total_amount = plan.total_amount
+    if total_amount is None:
+        total_amount = event['total_value'] - event.get('amount_paid', 0)
+    
+    return [
+        Payment(
+            user_id=user_id,
+            event_id=event['id'],
+            installment_number=number,
+            amount=amount,
+            due_date=due_date
+        )
+        for number, (due_date, amount) in enumerate(
+            build_installment_schedule(total_amount, plan.installments, plan.first_due_date, plan.schedule),
+            start=1
+        )
+    ]
+
+async def save_installment_payments(user_id: str, payments: List[Payment]) -> List[Payment]:
+    """Grava as parcelas com um único insert_many e soma o pendente nos contadores"""
+    docs = []
+    for payment in payments:
+        doc = payment.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        docs.append(doc)
+    await db.payments.insert_many(docs, ordered=False)
+    await bump_user_stats(user_id, pending_payments=sum(p.amount for p in payments))
+    return payments
+
+async def create_installment_plan(user_id: str, event: dict, plan: "InstallmentPlanCreate") -> List[Payment]:
+    """Gera todas as parcelas do evento e grava com um único insert_many"""
+    return await save_installment_payments(user_id, build_installment_payments(user_id, event, plan))
+
+# ============== REMINDER TIMELINE ==============
+
+# Lembretes do fotógrafo: horas antes do evento em que cada aviso dispara
+REMINDER_OFFSETS = {"48h": 48, "24h": 24, "12h": 12}
+REMINDER_STATUS = ("confirmado", "pendente")
+
+async def sync_event_reminders(event: dict):
+    """
+    Materializa em db.event_reminders os horários de disparo (48h, 24h, 12h)
+    do evento; o scheduler é avisado da mudança pelo change stream da coleção
+    """
+    await db.event_reminders.delete_many({"event_id": event['id'], "sent_at": {"$exists": False}})
+    if event.get('status') not in REMINDER_STATUS:
+        return
+    
+    try:
+        event_date = datetime.fromisoformat(event['event_date'])
+    except (TypeError, ValueError):
+        return
+    
+    # event_date sem fuso é hora local do servidor; fire_at é gravado em UTC
+    event_date = event_date.astimezone(timezone.utc)
+    now = datetime.now(timezone.utc)
+    reminders = [
+        {
+            "event_id": event['id'],
+            "user_id": event['user_id'],
+            "notification_type": notification_type,
+            "fire_at": event_date - timedelta(hours=hours),
+        }
+        for notification_type, hours in REMINDER_OFFSETS.items()
+        if event_date - timedelta(hours=hours) > now
+    ]
+    if reminders:
+        await db.event_reminders.insert_many(reminders)
+
+async def rebuild_all_event_reminders() -> int:
+    """Materializa os lembretes de todos os eventos futuros (eventos anteriores à timeline)"""
+    total = 0
+    # event_date é string em hora local: compara com a hora local atual
+    now = datetime.now(timezone.utc).astimezone().strftime("%Y-%m-%dT%H:%M:%S")
+    async for event in db.events.find(
+        {"status": {"$in": list(REMINDER_STATUS)}, "event_date": {"$gt": now}},
+        {"_id": 0, "id": 1, "user_id": 1, "event_date": 1, "status": 1}
+    ):
+        await sync_event_reminders(event)
+        total += 1
+    return total
 
 # ============== AUTH ROUTES ==============
 
@@ -266,14 +750,18 @@ async def register(user_data: UserCreate):
     user = User(
         email=user_data.email,
         name=user_data.name,
-        brand_name=user_data.brand_name
+        brand_name=user_data.brand_name,
+        phone=validate_phone(user_data.phone)
     )
     
     user_dict = user.model_dump()
-    user_dict['password_hash'] = get_password_hash(user_data.password)
+    user_dict['password_hash'] = await get_password_hash_async(user_data.password)
     user_dict['created_at'] = user_dict['created_at'].isoformat()
     
     await db.users.insert_one(user_dict)
+    await db.user_stats.insert_one(
+        {"user_id": user.id, **{field: 0 for field in USER_STATS_FIELDS}}
+    )
     
     access_token = create_access_token(data={"sub": user.email})
     
@@ -285,7 +773,7 @@ async def login(user_data: UserLogin):
     if not user_doc:
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
-    if not verify_password(user_data.password, user_doc['password_hash']):
+    if not await verify_password_async(user_data.password, user_doc['password_hash']):
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
     if isinstance(user_doc['created_at'], str):
@@ -307,6 +795,7 @@ async def save_push_subscription(subscription: dict, current_user: User = Depend
         {"id": current_user.id},
         {"$set": {"push_subscription": subscription}}
     )
+    user_cache.invalidate(current_user.email)
     return {"message": "Subscription salva com sucesso"}
 
 @api_router.delete("/auth/push-subscription")
@@ -316,10 +805,49 @@ async def delete_push_subscription(current_user: User = Depends(get_current_user
         {"id": current_user.id},
         {"$unset": {"push_subscription": ""}}
     )
+    user_cache.invalidate(current_user.email)
     return {"message": "Subscription removida com sucesso"}
 
+# ============== PUSH NOTIFICATIONS ==============
+
+# Envio direto (sem o push_service.py): o scheduler usa o mesmo módulo
+push_delivery = PushDelivery.from_env(db.users)
+
+class PushSendRequest(BaseModel):
+    title: str
+    body: str
+    icon: str = "/fotiva-icon-192.png"
+    badge: str = "/fotiva-icon-192.png"
+    data: Optional[dict] = None
+
+@api_router.post("/push/send")
+async def send_push(request: PushSendRequest, current_user: User = Depends(get_current_user)):
+    """Envia uma push notification para a subscription salva do usuário"""
+    if not push_delivery.configured:
+        raise HTTPException(status_code=500, detail="VAPID keys não configuradas")
+    
+    result = await push_delivery.send_to_user(current_user.id, request.model_dump(exclude_none=True))
+    
+    if result["status"] == "no_subscription":
+        raise HTTPException(status_code=404, detail="Push notifications não ativadas")
+    if result["status"] == "expired":
+        user_cache.invalidate(current_user.email)
+        raise HTTPException(status_code=410, detail="Subscription expirada")
+    if result["status"] != "success":
+        raise HTTPException(status_code=502, detail=result["error"])
+    
+    return {"status": "success", "message": "Notificação enviada"}
+
 # ============== PASSWORD RECOVERY ROUTES ==============
 
+def as_utc_datetime(value) -> datetime:
+    """expires_at é salvo como data BSON (para o índice TTL); aceita também strings ISO antigas"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
 @api_router.post("/auth/forgot-password")
 async def forgot_password(request: ForgotPasswordRequest):
     """
@@ -340,7 +868,7 @@ async def forgot_password(request: ForgotPasswordRequest):
         {
             "$set": {
                 "code": reset_code,
-                "expires_at": expires_at.isoformat(),
+                "expires_at": expires_at,
                 "used": False
             }
         },
@@ -376,7 +904,7 @@ async def verify_reset_code(request: VerifyResetCodeRequest):
         raise HTTPException(status_code=400, detail="Este código já foi utilizado")
     
     # Verificar se o código expirou
-    expires_at = datetime.fromisoformat(reset_doc['expires_at'])
+    expires_at = as_utc_datetime(reset_doc['expires_at'])
     if datetime.now(timezone.utc) > expires_at:
         raise HTTPException(status_code=400, detail="Código expirado. Solicite um novo código.")
     
@@ -394,16 +922,17 @@ async def reset_password(request: ResetPasswordRequest):
         raise HTTPException(status_code=400, detail="Código inválido")
     
     # Verificar expiração
-    expires_at = datetime.fromisoformat(reset_doc['expires_at'])
+    expires_at = as_utc_datetime(reset_doc['expires_at'])
     if datetime.now(timezone.utc) > expires_at:
         raise HTTPException(status_code=400, detail="Código expirado")
     
     # Atualizar senha do usuário
-    new_password_hash = get_password_hash(request.new_password)
+    new_password_hash = await get_password_hash_async(request.new_password)
     await db.users.update_one(
         {"email": request.email},
         {"$set": {"password_hash": new_password_hash}}
     )
+    user_cache.invalidate(request.email)
     
     # Marcar código como usado
     await db.password_resets.update_one(
@@ -420,18 +949,22 @@ async def reset_password(request: ResetPasswordRequest):
 @api_router.post("/clients", response_model=Client)
 async def create_client(client_data: ClientCreate, current_user: User = Depends(get_current_user)):
     client = Client(user_id=current_user.id, **client_data.model_dump())
+    client.phone = validate_phone(client.phone)
     doc = client.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.clients.insert_one(doc)
+    await bump_user_stats(current_user.id, total_clients=1)
     return client
 
 @api_router.get("/clients", response_model=List[Client])
-async def get_clients(current_user: User = Depends(get_current_user)):
-    clients = await db.clients.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for client in clients:
-        if isinstance(client['created_at'], str):
-            client['created_at'] = datetime.fromisoformat(client['created_at'])
-    return clients
+async def get_clients(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    return await list_user_documents(db.clients, Client, current_user.id, response, limit, after, stream)
 
 @api_router.get("/clients/{client_id}", response_model=Client)
 async def get_client(client_id: str, current_user: User = Depends(get_current_user)):
@@ -447,28 +980,53 @@ async def delete_client(client_id: str, current_user: User = Depends(get_current
     result = await db.clients.delete_one({"id": client_id, "user_id": current_user.id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
+    await bump_user_stats(current_user.id, total_clients=-1)
     return {"message": "Cliente deletado com sucesso"}
 
 # ============== EVENT ROUTES ==============
 
 @api_router.post("/events", response_model=Event)
-async def create_event(event_data: EventCreate, current_user: User = Depends(get_current_user)):
+async def create_event(
+    event_data: EventCreate,
+    generate_installments: bool = False,
+    current_user: User = Depends(get_current_user)
+):
     print(f"📝 Criando evento: {event_data.model_dump()}")  # Debug log
     event = Event(user_id=current_user.id, **event_data.model_dump())
     doc = event.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     print(f"✅ Documento a ser inserido: {doc}")  # Debug log
+    
+    # Parcelas validadas antes de gravar: um plano inválido (400) não deixa evento órfão
+    payments = []
+    if generate_installments and event.remaining_installments > 1:
+        # Parcelas mensais a partir de hoje para o valor ainda não pago
+        payments = build_installment_payments(current_user.id, doc, InstallmentPlanCreate(
+            installments=event.remaining_installments,
+            first_due_date=datetime.now(timezone.utc).date().isoformat()
+        ))
+    
     await db.events.insert_one(doc)
+    await bump_user_stats(
+        current_user.id,
+        total_events=1,
+        confirmed_events=1 if event.status == "confirmado" else 0
+    )
+    await sync_event_reminders(doc)
+    if payments:
+        await save_installment_payments(current_user.id, payments)
     print(f"✅ Evento criado com sucesso: {event.id}")  # Debug log
     return event
 
 @api_router.get("/events", response_model=List[Event])
-async def get_events(current_user: User = Depends(get_current_user)):
-    events = await db.events.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for event in events:
-        if isinstance(event['created_at'], str):
-            event['created_at'] = datetime.fromisoformat(event['created_at'])
-    return events
+async def get_events(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    return await list_user_documents(db.events, Event, current_user.id, response, limit, after, stream)
 
 @api_router.get("/events/{event_id}", response_model=Event)
 async def get_event(event_id: str, current_user: User = Depends(get_current_user)):
@@ -481,19 +1039,38 @@ async def get_event(event_id: str, current_user: User = Depends(get_current_user
 
 @api_router.put("/events/{event_id}", response_model=Event)
 async def update_event(event_id: str, event_data: EventCreate, current_user: User = Depends(get_current_user)):
-    result = await db.events.update_one(
+    previous = await db.events.find_one_and_update(
         {"id": event_id, "user_id": current_user.id},
-        {"$set": event_data.model_dump()}
+        # amount_paid é mantido pelas baixas ($inc em apply_settlements), não pela edição
+        {"$set": event_data.model_dump(exclude={"amount_paid"})},
+        projection={"_id": 0, "status": 1},
+        return_document=ReturnDocument.BEFORE
     )
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Evento não encontrado")
-    return await get_event(event_id, current_user)
+    
+    was_confirmed = previous.get('status') == "confirmado"
+    is_confirmed = event_data.status == "confirmado"
+    await bump_user_stats(current_user.id, confirmed_events=int(is_confirmed) - int(was_confirmed))
+    
+    event = await get_event(event_id, current_user)
+    await sync_event_reminders(event.model_dump())
+    return event
 
 @api_router.delete("/events/{event_id}")
 async def delete_event(event_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.events.delete_one({"id": event_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    deleted = await db.events.find_one_and_delete(
+        {"id": event_id, "user_id": current_user.id},
+        projection={"_id": 0, "status": 1}
+    )
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Evento não encontrado")
+    await bump_user_stats(
+        current_user.id,
+        total_events=-1,
+        confirmed_events=-1 if deleted.get('status') == "confirmado" else 0
+    )
+    await db.event_reminders.delete_many({"event_id": event_id})
     return {"message": "Evento deletado com sucesso"}
 
 # ============== PAYMENT ROUTES ==============
@@ -504,15 +1081,18 @@ async def create_payment(payment_data: PaymentCreate, current_user: User = Depen
     doc = payment.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.payments.insert_one(doc)
+    await bump_user_stats(current_user.id, pending_payments=payment.amount)
     return payment
 
 @api_router.get("/payments", response_model=List[Payment])
-async def get_payments(current_user: User = Depends(get_current_user)):
-    payments = await db.payments.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for payment in payments:
-        if isinstance(payment['created_at'], str):
-            payment['created_at'] = datetime.fromisoformat(payment['created_at'])
-    return payments
+async def get_payments(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    return await list_user_documents(db.payments, Payment, current_user.id, response, limit, after, stream)
 
 @api_router.get("/payments/{payment_id}", response_model=Payment)
 async def get_payment(payment_id: str, current_user: User = Depends(get_current_user)):
@@ -525,28 +1105,52 @@ async def get_payment(payment_id: str, current_user: User = Depends(get_current_
 
 @api_router.patch("/payments/{payment_id}/pay")
 async def pay_payment(payment_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.payments.update_one(
-        {"id": payment_id, "user_id": current_user.id},
-        {"$set": {"paid": True, "paid_date": datetime.now(timezone.utc).strftime("%Y-%m-%d")}}
-    )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Pagamento não encontrado")
-    
-    # Update event amount_paid
-    payment = await db.payments.find_one({"id": payment_id}, {"_id": 0})
-    event_payments = await db.payments.find({"event_id": payment['event_id'], "paid": True}, {"_id": 0}).to_list(1000)
-    total_paid = sum(p['amount'] for p in event_payments)
-    await db.events.update_one({"id": payment['event_id']}, {"$set": {"amount_paid": total_paid}})
+    payment = await run_settlement(settle_payment, current_user.id, payment_id)
+    if payment is None:
+        if await db.payments.count_documents({"id": payment_id, "user_id": current_user.id}, limit=1) == 0:
+            raise HTTPException(status_code=404, detail="Pagamento não encontrado")
+        return {"message": "Pagamento já estava marcado como pago"}
     
     return {"message": "Pagamento marcado como pago"}
 
+@api_router.post("/payments/settle")
+async def settle_payments(data: PaymentSettleRequest, current_user: User = Depends(get_current_user)):
+    """Marca várias parcelas como pagas de uma vez"""
+    payment_ids = list(dict.fromkeys(data.payment_ids))
+    if len(payment_ids) > SETTLE_MANY_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo de {SETTLE_MANY_MAX} parcelas por requisição")
+    
+    settled = await run_settlement(settle_many_payments, current_user.id, payment_ids)
+    settled_ids = {p['id'] for p in settled}
+    
+    return {
+        "settled": [payment_id for payment_id in payment_ids if payment_id in settled_ids],
+        "skipped": [payment_id for payment_id in payment_ids if payment_id not in settled_ids],
+        "total_settled": sum(p['amount'] for p in settled)
+    }
+
 @api_router.delete("/payments/{payment_id}")
 async def delete_payment(payment_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.payments.delete_one({"id": payment_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    deleted = await db.payments.find_one_and_delete(
+        {"id": payment_id, "user_id": current_user.id},
+        projection={"_id": 0, "amount": 1, "paid": 1}
+    )
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Pagamento não encontrado")
+    if deleted.get('paid') is True:
+        await bump_user_stats(current_user.id, total_revenue=-deleted['amount'])
+    else:
+        await bump_user_stats(current_user.id, pending_payments=-deleted['amount'])
     return {"message": "Pagamento deletado com sucesso"}
 
+@api_router.post("/events/{event_id}/installments", response_model=List[Payment])
+async def create_event_installments(event_id: str, plan: InstallmentPlanCreate, current_user: User = Depends(get_current_user)):
+    """Gera o carnê de parcelas do evento em uma única requisição"""
+    event = await db.events.find_one({"id": event_id, "user_id": current_user.id}, {"_id": 0})
+    if not event:
+        raise HTTPException(status_code=404, detail="Evento não encontrado")
+    return await create_installment_plan(current_user.id, event, plan)
+
 # ============== GALLERY ROUTES ==============
 
 @api_router.post("/galleries", response_model=Gallery)
@@ -555,48 +1159,152 @@ async def create_gallery(gallery_data: GalleryCreate, current_user: User = Depen
     doc = gallery.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.galleries.insert_one(doc)
+    await bump_user_stats(current_user.id, photos_delivered=gallery.photos_count)
     return gallery
 
 @api_router.get("/galleries", response_model=List[Gallery])
-async def get_galleries(current_user: User = Depends(get_current_user)):
-    galleries = await db.galleries.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for gallery in galleries:
-        if isinstance(gallery['created_at'], str):
-            gallery['created_at'] = datetime.fromisoformat(gallery['created_at'])
-    return galleries
+async def get_galleries(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_PAGE_MAX),
+    after: Optional[str] = None,
+    stream: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    return await list_user_documents(db.galleries, Gallery, current_user.id, response, limit, after, stream)
 
 # ============== DASHBOARD ROUTES ==============
 
 @api_router.get("/dashboard/stats", response_model=DashboardStats)
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
-    clients = await db.clients.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    events = await db.events.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    payments = await db.payments.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
+    user_id = current_user.id
     
-    total_revenue = sum(p['amount'] for p in payments if p.get('paid', False))
-    pending_payments = sum(p['amount'] for p in payments if not p.get('paid', False))
+    # Próximos 5 eventos (confirmados ou pendentes)
+    upcoming_pipeline = [
+        {"$match": {"user_id": user_id, "status": {"$in": ["confirmado", "pendente"]}}},
+        {"$sort": {"event_date": 1}},
+        {"$limit": 5},
+        {"$project": {"_id": 0}},
+    ]
     
-    # Get upcoming events (next 5)
-    upcoming = sorted(
-        [e for e in events if e['status'] in ['confirmado', 'pendente']],
-        key=lambda x: x['event_date']
-    )[:5]
+    stats, upcoming = await asyncio.gather(
+        get_user_stats(user_id),
+        db.events.aggregate(upcoming_pipeline).to_list(5),
+    )
     
     for event in upcoming:
         if isinstance(event['created_at'], str):
             event['created_at'] = datetime.fromisoformat(event['created_at'])
     
     return DashboardStats(
-        total_clients=len(clients),
-        total_events=len(events),
-        total_revenue=total_revenue,
-        pending_payments=pending_payments,
+        total_clients=stats['total_clients'],
+        total_events=stats['total_events'],
+        total_revenue=stats['total_revenue'],
+        pending_payments=stats['pending_payments'],
         upcoming_events=upcoming
     )
 
+@api_router.post("/dashboard/stats/rebuild")
+async def rebuild_dashboard_stats(current_user: User = Depends(get_current_user)):
+    """Recalcula os contadores do dashboard do usuário a partir das coleções"""
+    return await rebuild_user_stats(current_user.id)
+
+# ============== INTERNAL METRICS ROUTES ==============
+
+@api_router.get("/internal/user-cache")
+async def get_user_cache_stats(current_user: User = Depends(get_admin_user)):
+    """Contadores de hit/miss do cache de usuários autenticados"""
+    return user_cache.stats()
+
+@api_router.get("/internal/push")
+async def get_push_stats(current_user: User = Depends(get_admin_user)):
+    """Contadores da limpeza de push subscriptions expiradas"""
+    return push_delivery.stats()
+
+@api_router.get("/internal/notification-outbox")
+async def get_notification_outbox_lag(current_user: User = Depends(get_admin_user)):
+    """Itens por status e atraso (s) de cada canal do outbox do scheduler"""
+    return await outbox_lag(db.notification_outbox)
+
 # ============== INCLUDE ROUTER - DEVE SER DEPOIS DO CORS! ==============
 app.include_router(api_router)
 
+# ============== DATABASE INDEXES ==============
+
+# Um índice para cada formato de query usado nas rotas
+DATABASE_INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id"),
+        # Limpeza em lote das subscriptions expiradas (push_pruner)
+        IndexModel([("push_subscription.endpoint", ASCENDING)], name="push_endpoint", sparse=True),
+    ],
+    "clients": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_id"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+    ],
+    "events": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_id"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING), ("event_date", ASCENDING)], name="user_status_event_date"),
+    ],
+    "payments": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_id"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+        IndexModel([("event_id", ASCENDING), ("paid", ASCENDING)], name="event_paid"),
+        IndexModel([("user_id", ASCENDING), ("paid", ASCENDING)], name="user_paid"),
+        IndexModel([("settlement_id", ASCENDING)], name="settlement_id", sparse=True),
+    ],
+    "galleries": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_id"),
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user"),
+    ],
+    "password_resets": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # Remove códigos expirados automaticamente
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "event_reminders": [
+        IndexModel([("fire_at", ASCENDING)], name="fire_at"),
+        IndexModel([("event_id", ASCENDING)], name="event_id"),
+    ],
+    "user_stats": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+}
+
+async def ensure_indexes():
+    """Cria (de forma idempotente) os índices usados pelas queries da API"""
+    for collection_name, indexes in DATABASE_INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(indexes)
+        except OperationFailure as e:
+            logger.warning(f"Não foi possível criar índices em {collection_name}: {e}")
+
+async def print_index_stats():
+    """Mostra quantas vezes cada índice foi usado ($indexStats)"""
+    for collection_name in DATABASE_INDEXES:
+        print(f"📚 {collection_name}")
+        async for stat in db[collection_name].aggregate([{"$indexStats": {}}]):
+            print(f"   {stat['name']:<40} ops={stat['accesses']['ops']:<10} desde {stat['accesses']['since']}")
+
+# ============== LIFECYCLE ==============
+
+@app.on_event("startup")
+async def startup_ensure_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def startup_push_delivery():
+    push_delivery.start()
+
+@app.on_event("shutdown")
+async def shutdown_password_executor():
+    password_executor.shutdown(wait=False)
+
+@app.on_event("shutdown")
+async def shutdown_push_delivery():
+    await push_delivery.aclose()
+
 # ============== LOGGING ==============
 logging.basicConfig(
     level=logging.INFO,
@@ -606,6 +1314,19 @@ logger = logging.getLogger(__name__)
 
 # ============== RUN SERVER ==============
 if __name__ == "__main__":
-    import uvicorn
-    port = int(os.environ.get("PORT", 10000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # python server.py rebuild-stats [user_id ...]  -> reconcilia db.user_stats
+    # python server.py index-stats               -> uso dos índices ($indexStats)
+    # python server.py rebuild-reminders         -> materializa lembretes dos eventos futuros
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "rebuild-stats":
+        total = asyncio.run(rebuild_all_user_stats(sys.argv[2:]))
+        print(f"✅ Contadores reconstruídos para {total} usuário(s)")
+    elif command == "rebuild-reminders":
+        total = asyncio.run(rebuild_all_event_reminders())
+        print(f"✅ Lembretes materializados para {total} evento(s)")
+    elif command == "index-stats":
+        asyncio.run(print_index_stats())
+    else:
+        import uvicorn
+        port = int(os.environ.get("PORT", 10000))
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,233 @@
+"""
+MongoDB em memória com a parte da API do Motor usada pelo backend (testes sem servidor)
+Suporta filtros simples ($or/$and, $in, $ne, $exists, $lt/$lte/$gt/$gte), $set/$unset/$inc
+e índices únicos criados com create_indexes
+"""
+
+import copy
+import itertools
+from types import SimpleNamespace
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_ids = itertools.count(1)
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+def _matches_value(value, exists, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for op, arg in condition.items():
+            if op == "$exists":
+                if exists != bool(arg):
+                    return False
+            elif op == "$in":
+                if value not in arg:
+                    return False
+            elif op == "$ne":
+                if value == arg:
+                    return False
+            elif op in ("$lt", "$lte", "$gt", "$gte"):
+                if not exists or value is None:
+                    return False
+                if op == "$lt" and not value < arg:
+                    return False
+                if op == "$lte" and not value <= arg:
+                    return False
+                if op == "$gt" and not value > arg:
+                    return False
+                if op == "$gte" and not value >= arg:
+                    return False
+            else:
+                raise NotImplementedError(op)
+        return True
+    return exists and value == condition
+
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        else:
+            value, exists = _get(doc, key)
+            if not _matches_value(value, exists, condition):
+                return False
+    return True
+
+
+def _project(doc, projection):
+    if doc is None:
+        return None
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = [key for key, value in projection.items() if value and key != "_id"]
+    if included:
+        doc = {key: doc[key] for key in included + ["_id"] if key in doc}
+    for key, value in projection.items():
+        if not value:
+            doc.pop(key, None)
+    return doc
+
+
+def _apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            doc.update(copy.deepcopy(fields))
+        elif op == "$unset":
+            for key in fields:
+                doc.pop(key, None)
+        elif op == "$inc":
+            for key, value in fields.items():
+                doc[key] = doc.get(key, 0) + value
+        elif op != "$setOnInsert":
+            raise NotImplementedError(op)
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda doc: _get(doc, field)[0], reverse=order < 0)
+        return self
+
+    def limit(self, count):
+        if count:
+            self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs[:length] if length else list(self.docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = []
+        self.unique = []
+
+    # ---------- índices ----------
+
+    async def create_indexes(self, indexes):
+        for index in indexes:
+            if index.document.get("unique"):
+                self.unique.append(list(index.document["key"]))
+        return [index.document["name"] for index in indexes]
+
+    def _check_unique(self, doc, ignore=None):
+        for keys in self.unique:
+            value = tuple(_get(doc, key)[0] for key in keys)
+            for other in self.docs:
+                if other is not ignore and tuple(_get(other, key)[0] for key in keys) == value:
+                    raise DuplicateKeyError(f"E11000 duplicate key {dict(zip(keys, value))}")
+
+    # ---------- escrita ----------
+
+    async def insert_one(self, doc, session=None):
+        doc.setdefault("_id", next(_ids))
+        self._check_unique(doc)
+        self.docs.append(copy.deepcopy(doc))
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True, session=None):
+        inserted = []
+        for doc in docs:
+            try:
+                inserted.append((await self.insert_one(doc)).inserted_id)
+            except DuplicateKeyError:
+                if ordered:
+                    raise BulkWriteError({"nInserted": len(inserted)})
+        if len(inserted) != len(docs):
+            raise BulkWriteError({"nInserted": len(inserted)})
+        return SimpleNamespace(inserted_ids=inserted)
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, session=None):
+        candidates = [doc for doc in self.docs if matches(doc, query)]
+        if sort:
+            candidates = FakeCursor(candidates).sort(sort).docs
+        if not candidates:
+            if not upsert:
+                return None
+            doc = {key: value for key, value in query.items() if not key.startswith("$") and not isinstance(value, dict)}
+            _apply_update(doc, update, inserting=True)
+            await self.insert_one(doc)
+            return _project(doc, projection) if return_document == ReturnDocument.AFTER else None
+
+        doc = candidates[0]
+        before = copy.deepcopy(doc)
+        _apply_update(doc, update)
+        self._check_unique(doc, ignore=doc)
+        return _project(doc if return_document == ReturnDocument.AFTER else before, projection)
+
+    async def update_one(self, query, update, upsert=False, session=None):
+        before = await self.find_one_and_update(query, update, upsert=upsert)
+        matched = int(before is not None)
+        return SimpleNamespace(matched_count=matched, modified_count=matched)
+
+    async def update_many(self, query, update, session=None):
+        matched = [doc for doc in self.docs if matches(doc, query)]
+        for doc in matched:
+            _apply_update(doc, update)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched))
+
+    async def delete_one(self, query, session=None):
+        for doc in self.docs:
+            if matches(doc, query):
+                self.docs.remove(doc)
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query, session=None):
+        before = len(self.docs)
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
+
+    # ---------- leitura ----------
+
+    def find(self, query=None, projection=None, session=None):
+        return FakeCursor([_project(doc, projection) for doc in self.docs if matches(doc, query)])
+
+    async def find_one(self, query=None, projection=None, sort=None, session=None):
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.docs[0] if cursor.docs else None
+
+    async def count_documents(self, query, session=None):
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+
+class FakeDatabase:
+    """db.<coleção> cria a coleção no primeiro acesso, como no Motor"""
+
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
@@ -0,0 +1,106 @@
+"""
+Testes das retentativas do MercadoPagoService contra um gateway falso (httpx.MockTransport)
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from mercadopago_service import MercadoPagoService
+
+
+class FakeGateway:
+    """Responde com os status da fila, na ordem, e guarda cada requisição recebida"""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        status = self.statuses.pop(0)
+        if status == 200:
+            return httpx.Response(200, json={"id": 123, "status": "approved"})
+        return httpx.Response(status, json={"message": "erro do gateway"})
+
+
+def make_service(gateway, max_retries=3):
+    service = MercadoPagoService(
+        access_token="TEST-TOKEN",
+        http_client=httpx.AsyncClient(base_url="https://gateway.test", transport=httpx.MockTransport(gateway))
+    )
+    service.max_retries = max_retries
+    service.retry_backoff = 0
+    return service
+
+
+def create_payment(service, **kwargs):
+    async def scenario():
+        try:
+            return await service.create_payment(100.0, "Plano mensal", "cliente@fotiva.com", "pix", **kwargs)
+        finally:
+            await service.aclose()
+
+    return asyncio.run(scenario())
+
+
+def test_retries_429_and_5xx_with_same_idempotency_key():
+    gateway = FakeGateway(429, 503, 200)
+
+    result = create_payment(make_service(gateway))
+
+    assert result == {"status": 200, "response": {"id": 123, "status": "approved"}}
+    assert len(gateway.requests) == 3
+    keys = {request.headers["X-Idempotency-Key"] for request in gateway.requests}
+    assert len(keys) == 1
+
+
+def test_explicit_idempotency_key_is_sent():
+    gateway = FakeGateway(500, 200)
+
+    create_payment(make_service(gateway), idempotency_key="pedido-42")
+
+    assert [request.headers["X-Idempotency-Key"] for request in gateway.requests] == ["pedido-42", "pedido-42"]
+
+
+def test_gives_up_after_max_retries():
+    gateway = FakeGateway(503, 503, 503)
+
+    result = create_payment(make_service(gateway, max_retries=2))
+
+    assert result["status"] == 503
+    assert len(gateway.requests) == 3
+
+
+def test_client_error_is_not_retried():
+    gateway = FakeGateway(400)
+
+    result = create_payment(make_service(gateway))
+
+    assert result["status"] == 400
+    assert len(gateway.requests) == 1
+
+
+def test_transport_error_is_retried():
+    attempts = []
+
+    def flaky(request):
+        attempts.append(request)
+        if len(attempts) == 1:
+            raise httpx.ConnectError("conexão recusada", request=request)
+        return httpx.Response(200, json={"id": 1})
+
+    result = create_payment(make_service(flaky))
+
+    assert result["status"] == 200
+    assert len(attempts) == 2
+    assert attempts[0].headers["X-Idempotency-Key"] == attempts[1].headers["X-Idempotency-Key"]
+
+
+def test_transport_error_is_raised_after_max_retries():
+    def down(request):
+        raise httpx.ConnectError("conexão recusada", request=request)
+
+    with pytest.raises(httpx.ConnectError):
+        create_payment(make_service(down, max_retries=1))
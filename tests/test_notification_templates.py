@@ -0,0 +1,70 @@
+"""
+Testes dos templates de lembrete (mesmo texto da mensagem antiga do scheduler)
+"""
+
+from notification_templates import MessageTemplate, TemplateRenderer
+
+EVENT = {
+    "id": "event-1",
+    "event_type": "Casamento",
+    "client_name": "Ana",
+    "location": "São Paulo",
+    "event_date": "2025-02-06T14:00:00",
+    "total_value": 2500.0,
+    "amount_paid": 1000.0,
+}
+
+
+def test_render_default_template():
+    title, body = TemplateRenderer().render(EVENT, "24h", "push")
+
+    assert title == "Evento: Casamento"
+    assert body.startswith("⏰ Lembrete: Faltam 24 horas!\n")
+    assert "🗓️ Data: 06/02/2025 às 14:00" in body
+    assert "• Total: R$ 2500.00\n• Pago: R$ 1000.00\n• Restante: R$ 1500.00" in body
+
+
+def test_unknown_type_uses_legacy_fallback():
+    _, body = TemplateRenderer().render(EVENT, "6h")
+
+    assert body.startswith("🔔 Lembrete: Faltam 6 horas!\n")
+
+
+def test_channel_and_locale_fallback():
+    renderer = TemplateRenderer()
+    renderer.register("pt-BR", "whatsapp", MessageTemplate(
+        "{{event_type}}", "{emoji} {{client_name}} em {time_text}", {"24h": {"emoji": "⏰", "time_text": "24 horas"}},
+        lambda notification_type: {"emoji": "🔔", "time_text": notification_type}
+    ))
+
+    assert renderer.render(EVENT, "24h", "whatsapp") == ("Casamento", "⏰ Ana em 24 horas")
+    assert renderer.render(EVENT, "48h", "whatsapp", locale="en-US") == ("Casamento", "🔔 Ana em 48h")
+    # Outros canais continuam no template padrão
+    assert renderer.render(EVENT, "24h", "push")[0] == "Evento: Casamento"
+
+
+def test_event_version_is_rendered_once_per_change():
+    template = MessageTemplate(
+        "{{event_type}}", "{emoji} Pago: R$ {{paid:.2f}}", {"48h": {"emoji": "📅"}, "24h": {"emoji": "⏰"}},
+        lambda notification_type: {"emoji": "🔔"}
+    )
+    renderer = TemplateRenderer({("pt-BR", "default"): template})
+
+    for notification_type in ("48h", "24h"):
+        for channel in ("push", "whatsapp"):
+            renderer.render(EVENT, notification_type, channel)
+    assert template.stats() == {"events": 1, "hits": 3, "misses": 1}
+
+    # Baixa de uma parcela muda a versão do evento: a mensagem sai com o valor novo
+    assert renderer.render({**EVENT, "amount_paid": 1500.0}, "24h")[1] == "⏰ Pago: R$ 1500.00"
+    assert template.stats()["misses"] == 2
+
+
+def test_event_cache_is_bounded():
+    template = MessageTemplate("{{event_type}}", "{{client_name}}", {}, lambda notification_type: {}, max_events=2)
+
+    for name in ("Ana", "Bia", "Caio"):
+        template.render({**EVENT, "client_name": name}, "24h")
+
+    assert template.stats()["events"] == 2
+    assert template.render({**EVENT, "client_name": "Ana"}, "24h") == ("Casamento", "Ana")
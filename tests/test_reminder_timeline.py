@@ -0,0 +1,73 @@
+"""
+Testes da timeline de lembretes (espera de nova tentativa persistida e eventos cancelados)
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from notification_service_updated import (
+    REMINDER_RETRY,
+    REMINDER_TOLERANCE,
+    NotificationScheduler,
+    ReminderTimeline,
+)
+from tests.fake_mongo import FakeDatabase
+
+NOW = datetime(2025, 2, 4, 14, 0, tzinfo=timezone.utc)
+
+
+def reminder(event_id, fire_at):
+    return {"event_id": event_id, "user_id": "user-1", "notification_type": "48h", "fire_at": fire_at}
+
+
+def test_retry_backoff_survives_reload():
+    db = FakeDatabase()
+    timeline = ReminderTimeline(db)
+
+    async def scenario():
+        await db.event_reminders.insert_one(reminder("event-1", NOW))
+        await timeline.reload(NOW)
+        failed = timeline.pop_due(NOW)
+        assert len(failed) == 1
+
+        await timeline.retry(failed, NOW + REMINDER_RETRY)
+
+        # Uma mudança na timeline (outro evento) recarrega o heap antes da nova tentativa
+        await timeline.reload(NOW + timedelta(seconds=5))
+        assert timeline.pop_due(NOW + timedelta(seconds=5)) == []
+        assert timeline.next_wakeup() == NOW + REMINDER_RETRY
+
+    asyncio.run(scenario())
+
+
+def test_retry_past_tolerance_is_not_reloaded():
+    db = FakeDatabase()
+    timeline = ReminderTimeline(db)
+
+    async def scenario():
+        await db.event_reminders.insert_one(reminder("event-1", NOW))
+        await timeline.reload(NOW)
+        await timeline.retry(timeline.pop_due(NOW), NOW + REMINDER_TOLERANCE + timedelta(seconds=1))
+
+        await timeline.reload(NOW + timedelta(minutes=1))
+        assert timeline.heap == []
+
+    asyncio.run(scenario())
+
+
+def test_reminders_of_cancelled_events_are_deleted():
+    db = FakeDatabase()
+    scheduler = NotificationScheduler(db)
+
+    async def scenario():
+        await db.events.insert_one({"id": "event-1", "user_id": "user-1", "status": "cancelado"})
+        await db.event_reminders.insert_one(reminder("event-1", NOW))
+        timeline = ReminderTimeline(db)
+        await timeline.reload(NOW)
+
+        failed = await scheduler.send_reminders(timeline.pop_due(NOW))
+
+        assert failed == []
+        assert await db.event_reminders.count_documents({}) == 0
+
+    asyncio.run(scenario())
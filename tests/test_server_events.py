@@ -0,0 +1,80 @@
+"""
+Testes das rotas de eventos e clientes do server.py (frontend/src/pages) com um MongoDB em memória
+"""
+
+import asyncio
+import importlib.util
+import os
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+
+from tests.fake_mongo import FakeDatabase
+
+SERVER_PATH = Path(__file__).resolve().parent.parent / "frontend" / "src" / "pages" / "server.py"
+
+
+@pytest.fixture(scope="module")
+def server():
+    os.environ.setdefault("SECRET_KEY", "test-secret")
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "fotiva_test")
+
+    spec = importlib.util.spec_from_file_location("fotiva_server", SERVER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def db(server, monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(server, "db", db)
+    return db
+
+
+def test_update_event_keeps_settled_amount(server, db):
+    user = server.User(id="u1", email="foto@fotiva.com", name="Fotógrafo")
+    event = server.Event(
+        user_id=user.id, client_id="c1", event_type="Casamento",
+        event_date="2099-02-06T14:00:00", total_value=3000, amount_paid=0, remaining_installments=3
+    )
+    doc = event.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    # Duas parcelas já baixadas pelo $inc de apply_settlements
+    doc['amount_paid'] = 2000
+
+    async def scenario():
+        await db.events.insert_one(doc)
+        return await server.update_event(event.id, server.EventCreate(
+            client_id="c1", event_type="Casamento", event_date="2099-02-06T15:00:00",
+            location="Igreja Matriz", total_value=3000
+        ), current_user=user)
+
+    updated = asyncio.run(scenario())
+
+    assert updated.amount_paid == 2000
+    assert updated.location == "Igreja Matriz"
+    assert updated.event_date == "2099-02-06T15:00:00"
+
+
+def test_create_client_stores_phone_in_e164(server, db):
+    user = server.User(id="u1", email="foto@fotiva.com", name="Fotógrafo")
+
+    client = asyncio.run(server.create_client(
+        server.ClientCreate(name="Ana", phone="(11) 98765-4321"), current_user=user
+    ))
+
+    assert client.phone == "+5511987654321"
+    assert db.clients.docs[0]["phone"] == "+5511987654321"
+
+
+def test_create_client_rejects_invalid_phone(server, db):
+    user = server.User(id="u1", email="foto@fotiva.com", name="Fotógrafo")
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.create_client(server.ClientCreate(name="Ana", phone="447911123456"), current_user=user))
+
+    assert error.value.status_code == 400
+    assert db.clients.docs == []
@@ -0,0 +1,100 @@
+"""
+Testes do armazenamento de assinaturas/cupons com o backend em memória
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from subscription_service import SubscriptionService
+from subscription_storage import InMemorySubscriptionStorage, SubscriptionStorage
+
+
+@pytest.fixture
+def storage():
+    storage = InMemorySubscriptionStorage()
+    SubscriptionService.configure(storage)
+    SubscriptionService.status_cache.clear()
+    return storage
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        SubscriptionStorage()
+
+    class Incomplete(SubscriptionStorage):
+        async def get_subscription(self, user_id):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_update_subscription_upsert(storage):
+    async def scenario():
+        assert await storage.update_subscription("u1", {"status": "active"}) is None
+
+        created = await storage.update_subscription("u1", {"status": "active"}, upsert=True)
+        assert created == {"user_id": "u1", "status": "active"}
+        assert await storage.get_subscription("u1") == created
+
+    asyncio.run(scenario())
+
+
+def test_trial_is_active(storage):
+    async def scenario():
+        await SubscriptionService.create_trial("u1")
+        assert await SubscriptionService.is_subscription_active("u1")
+        assert not await SubscriptionService.is_subscription_active("sem-assinatura")
+
+    asyncio.run(scenario())
+
+
+def test_coupon_max_uses(storage):
+    async def scenario():
+        await SubscriptionService.create_coupon(
+            "bemvindo", "percentage", 10, created_by="admin", max_uses=2,
+            valid_from=datetime.now() - timedelta(days=1)
+        )
+
+        assert await SubscriptionService.use_coupon("BEMVINDO", "u1", 5)
+        # Mesmo usuário não usa duas vezes
+        assert not await SubscriptionService.use_coupon("BEMVINDO", "u1", 5)
+        assert await SubscriptionService.use_coupon("BEMVINDO", "u2", 5)
+        # Esgotado: o uso reservado é desfeito
+        assert not await SubscriptionService.use_coupon("BEMVINDO", "u3", 5)
+
+        assert (await storage.get_coupon("BEMVINDO"))["current_uses"] == 2
+        assert await storage.find_coupon_usage("BEMVINDO", "u3") is None
+        assert (await SubscriptionService.validate_coupon("bemvindo", "u3"))["message"] == "Cupom esgotado"
+
+    asyncio.run(scenario())
+
+
+def test_inactive_status_is_not_cached_for_long(storage, monkeypatch):
+    monkeypatch.setattr(SubscriptionService, "status_cache_negative_ttl", 0)
+
+    async def scenario():
+        assert not await SubscriptionService.is_subscription_active("u1")
+        assert "u1" not in SubscriptionService.status_cache
+
+        # Pagamento confirmado por outro worker (sem invalidar este cache)
+        await storage.update_subscription("u1", {"status": "active", "subscription_end": None}, upsert=True)
+        assert await SubscriptionService.is_subscription_active("u1")
+        assert "u1" in SubscriptionService.status_cache
+
+    asyncio.run(scenario())
+
+
+def test_status_cache_is_bounded(storage, monkeypatch):
+    monkeypatch.setattr(SubscriptionService, "status_cache_max_size", 2)
+
+    async def scenario():
+        for user_id in ("u1", "u2", "u3"):
+            await SubscriptionService.create_trial(user_id)
+            await SubscriptionService.get_active_until(user_id)
+
+        assert list(SubscriptionService.status_cache) == ["u2", "u3"]
+
+    asyncio.run(scenario())
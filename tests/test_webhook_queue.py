@@ -0,0 +1,81 @@
+"""
+Testes da fila de webhooks (deduplicação só dos itens ainda na fila)
+"""
+
+import asyncio
+
+from tests.fake_mongo import FakeCollection
+from webhook_queue import WebhookQueue
+
+
+def make_queue():
+    handled = []
+
+    async def handler(payload):
+        handled.append(payload["action"])
+
+    queue = WebhookQueue(FakeCollection(), handler)
+    return queue, handled
+
+
+async def drain(queue):
+    while (item := await queue.claim()) is not None:
+        await queue.process(item)
+
+
+def test_payment_updated_after_created_is_processed_again():
+    queue, handled = make_queue()
+
+    async def scenario():
+        await queue.ensure_indexes()
+
+        assert await queue.enqueue("payment", "123", {"action": "payment.created"})
+        await drain(queue)
+
+        # Boleto/pix aprovado depois: mesmo data.id, notificação nova
+        assert await queue.enqueue("payment", "123", {"action": "payment.updated"})
+        await drain(queue)
+
+    asyncio.run(scenario())
+
+    assert handled == ["payment.created", "payment.updated"]
+    [item] = queue.collection.docs
+    assert item["status"] == "processed"
+    assert item["payload"]["action"] == "payment.updated"
+
+
+def test_retry_of_pending_notification_is_deduplicated():
+    queue, handled = make_queue()
+
+    async def scenario():
+        await queue.ensure_indexes()
+        assert await queue.enqueue("payment", "123", {"action": "payment.created"})
+        assert not await queue.enqueue("payment", "123", {"action": "payment.created"})
+        await drain(queue)
+
+    asyncio.run(scenario())
+
+    assert handled == ["payment.created"]
+    assert len(queue.collection.docs) == 1
+
+
+def test_notification_during_processing_reruns_item():
+    queue, handled = make_queue()
+
+    async def scenario():
+        await queue.ensure_indexes()
+        await queue.enqueue("payment", "123", {"action": "payment.created"})
+
+        item = await queue.claim()
+        # Chega enquanto o worker ainda processa o primeiro
+        assert await queue.enqueue("payment", "123", {"action": "payment.updated"})
+        await queue.process(item)
+
+        await drain(queue)
+
+    asyncio.run(scenario())
+
+    assert handled == ["payment.created", "payment.updated"]
+    [item] = queue.collection.docs
+    assert item["status"] == "processed"
+    assert "rerun" not in item
@@ -0,0 +1,117 @@
+"""
+Testes do canal de WhatsApp contra uma API do Twilio falsa local (TWILIO_API_URL)
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+pytest.importorskip("twilio")
+
+from whatsapp_channel import WhatsAppChannel, normalize_phone
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    """POST /2010-04-01/Accounts/<sid>/Messages.json como a API do Twilio"""
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        message = {key: values[0] for key, values in form.items()}
+
+        if self.server.fail:
+            status, body = 503, {"code": 20503, "message": "Service Unavailable", "status": 503}
+        else:
+            self.server.created.append({"path": self.path, **message})
+            status, body = 201, {"sid": f"SM{len(self.server.created)}", "status": "queued", **message}
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def twilio_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTwilioHandler)
+    server.created = []
+    server.fail = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def channel(twilio_api):
+    base_url = f"http://127.0.0.1:{twilio_api.server_address[1]}/"
+    channel = WhatsAppChannel("ACtest", "token", "whatsapp:+14155238886", rate=1000, base_url=base_url)
+    yield channel
+    asyncio.run(channel.aclose())
+
+
+@pytest.mark.parametrize("phone, expected", [
+    ("(11) 98765-4321", "+5511987654321"),
+    ("011 98765-4321", "+5511987654321"),
+    ("5511987654321", "+5511987654321"),
+    ("(21) 2555-1234", "+552125551234"),
+    ("+1 (415) 523-8886", "+14155238886"),
+    ("whatsapp:+14155238886", "+14155238886"),
+    ("+5511987654321", "+5511987654321"),
+    # Estrangeiros sem "+DDI" não viram +55 silenciosamente
+    ("447911123456", None),
+    ("3012345678", None),
+    ("11 8765-4321 0", None),
+    ("+12", None),
+    ("", None),
+    (None, None),
+    ("sem número", None),
+])
+def test_normalize_phone(phone, expected):
+    assert normalize_phone(phone) == expected
+
+
+def test_send_uses_single_client_and_base_url(channel, twilio_api):
+    async def scenario():
+        return await asyncio.gather(
+            channel.send("+5511987654321", "Lembrete 1"),
+            channel.send("+5511912345678", "Lembrete 2"),
+        )
+
+    results = asyncio.run(scenario())
+
+    assert [result["status"] for result in results] == ["success", "success"]
+    assert sorted(result["sid"] for result in results) == ["SM1", "SM2"]
+    assert {message["path"] for message in twilio_api.created} == {"/2010-04-01/Accounts/ACtest/Messages.json"}
+    assert sorted(message["To"] for message in twilio_api.created) == [
+        "whatsapp:+5511912345678",
+        "whatsapp:+5511987654321",
+    ]
+    assert {message["From"] for message in twilio_api.created} == {"whatsapp:+14155238886"}
+    assert channel.stats() == {"sent": 2, "failed": 0}
+
+
+def test_send_reports_twilio_errors(channel, twilio_api):
+    twilio_api.fail = True
+
+    result = asyncio.run(channel.send("+5511987654321", "Lembrete"))
+
+    assert result["status"] == "error"
+    assert "503" in result["error"]
+    assert channel.stats() == {"sent": 0, "failed": 1}
+
+
+def test_send_rejects_invalid_phone(channel, twilio_api):
+    result = asyncio.run(channel.send("---", "Lembrete"))
+
+    assert result["status"] == "error"
+    assert twilio_api.created == []